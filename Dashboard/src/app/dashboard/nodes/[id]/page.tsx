@@ -1,7 +1,7 @@
 'use client'
 
 import { useParams, useRouter } from 'next/navigation'
-import { useQuery } from '@tanstack/react-query'
+import { useQuery, useInfiniteQuery } from '@tanstack/react-query'
 import { motion } from 'framer-motion'
 import { 
   ArrowLeft, 
@@ -20,12 +20,15 @@ import {
   Shield,
   Lock
 } from 'lucide-react'
-import { fetchNodes, fetchEvents } from '@/lib/api'
+import { fetchNodes, fetchEventsPage } from '@/lib/api'
 import { Node, Event } from '@/types'
 import { getRelativeTime } from '@/lib/utils'
 import { SkeletonTable } from '@/components/ui/Skeleton'
 import { useState, useMemo } from 'react'
 
+// Events fetched per request; older pages are loaded on demand
+const EVENTS_PAGE_SIZE = 500
+
 export default function NodeDetailPage() {
   const params = useParams()
   const router = useRouter()
@@ -37,12 +40,24 @@ export default function NodeDetailPage() {
     queryFn: fetchNodes,
   })
 
-  const { data: events, isLoading: eventsLoading } = useQuery<Event[]>({
+  const {
+    data: eventPages,
+    isLoading: eventsLoading,
+    fetchNextPage,
+    hasNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery({
     queryKey: ['node-events', nodeId],
-    queryFn: () => fetchEvents({ node_id: nodeId, limit: 1000 }),
+    queryFn: ({ pageParam }) => fetchEventsPage({ node_id: nodeId, limit: EVENTS_PAGE_SIZE, cursor: pageParam }),
+    initialPageParam: undefined as string | undefined,
+    getNextPageParam: (lastPage) => lastPage.nextCursor ?? undefined,
     refetchInterval: 5000,
   })
 
+  const events = useMemo<Event[] | undefined>(() => {
+    return eventPages?.pages.flatMap(page => page.events as Event[])
+  }, [eventPages])
+
   const node = useMemo(() => {
     return nodes?.find(n => n.id === nodeId)
   }, [nodes, nodeId])
@@ -442,6 +457,18 @@ export default function NodeDetailPage() {
                   )}
                 </>
               )}
+
+              {hasNextPage && (
+                <div className="flex justify-center pt-3">
+                  <button
+                    onClick={() => fetchNextPage()}
+                    disabled={isFetchingNextPage}
+                    className="px-4 py-2 text-sm font-medium text-primary border border-primary rounded-lg hover:bg-primary hover:text-white transition-colors disabled:opacity-50"
+                  >
+                    {isFetchingNextPage ? 'Loading...' : 'Load older events'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
@@ -3,10 +3,10 @@
 import { useQuery } from '@tanstack/react-query'
 import { motion } from 'framer-motion'
 import { Server, Activity, AlertTriangle, Shield } from 'lucide-react'
-import { fetchNodes, fetchEvents } from '@/lib/api'
+import { fetchNodes, fetchEvents, fetchEventStats } from '@/lib/api'
 import { StatCard } from '@/components/ui/StatCard'
 import { SkeletonCard } from '@/components/ui/Skeleton'
-import { Node, Event } from '@/types'
+import { Node, Event, EventStats } from '@/types'
 import { getRelativeTime, getSeverityColor } from '@/lib/utils'
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts'
 
@@ -18,23 +18,29 @@ export default function DashboardPage() {
   })
 
   const { data: events, isLoading: eventsLoading } = useQuery<Event[]>({
-    queryKey: ['events'],
-    queryFn: () => fetchEvents({ limit: 100 }),
+    queryKey: ['events', 'recent'],
+    queryFn: () => fetchEvents({ limit: 5 }),
+    refetchInterval: 5000,
+  })
+
+  // Counts for the last 24 hours come from the server-side rollups
+  const { data: eventStats } = useQuery<EventStats>({
+    queryKey: ['events', 'stats'],
+    queryFn: () => fetchEventStats({ interval: 'hour' }),
     refetchInterval: 5000,
   })
 
   const stats = {
     totalNodes: nodes?.length || 0,
     onlineNodes: nodes?.filter((n) => n.status === 'online').length || 0,
-    totalEvents: events?.length || 0,
-    criticalEvents: events?.filter((e) => e.severity === 'critical').length || 0,
+    totalEvents: eventStats?.total || 0,
+    criticalEvents: eventStats?.by_severity.find((s) => s.key === 'critical')?.count || 0,
   }
 
-  // Prepare chart data (events over time)
-  const chartData = events?.slice(0, 24).reverse().map((event, idx) => ({
-    name: `${idx}`,
-    events: 1,
-    time: new Date(event.timestamp).toLocaleTimeString(),
+  // Prepare chart data (events per hour)
+  const chartData = eventStats?.histogram.map((bucket) => ({
+    name: new Date(bucket.bucket + 'Z').toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }),
+    events: bucket.count,
   })) || []
 
   return (
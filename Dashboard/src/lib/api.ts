@@ -82,11 +82,41 @@ export const fetchEvents = async (params?: {
   severity?: string
   event_type?: string
   limit?: number
+  cursor?: string
 }) => {
   const response = await api.get('/logs', { params })
   return response.data
 }
 
+// Keyset pagination: returns one page plus the cursor of the next (if any)
+export const fetchEventsPage = async (params?: {
+  node_id?: number
+  severity?: string
+  event_type?: string
+  limit?: number
+  cursor?: string
+}) => {
+  const response = await api.get('/logs', { params })
+  return {
+    events: response.data,
+    nextCursor: (response.headers['x-next-cursor'] as string | undefined) ?? null,
+  }
+}
+
+export const fetchEventStats = async (params?: {
+  start_time?: string
+  end_time?: string
+  interval?: 'minute' | 'hour' | 'day'
+  node_id?: number
+  group?: string
+  severity?: string
+  event_type?: string
+  top?: number
+}) => {
+  const response = await api.get('/logs/stats', { params })
+  return response.data
+}
+
 // Policies
 export const fetchPolicies = async () => {
   const response = await api.get('/policies')
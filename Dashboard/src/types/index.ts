@@ -16,6 +16,23 @@ export interface Event {
   details: Record<string, any>
 }
 
+export interface EventStatsBreakdownItem {
+  key: number | string
+  count: number
+}
+
+export interface EventStats {
+  interval: 'minute' | 'hour' | 'day'
+  start_time: string
+  end_time: string
+  total: number
+  histogram: { bucket: string; count: number }[]
+  by_severity: EventStatsBreakdownItem[]
+  by_event_type: EventStatsBreakdownItem[]
+  by_node: EventStatsBreakdownItem[]
+  by_group: EventStatsBreakdownItem[]
+}
+
 export interface Policy {
   id: number
   name: string
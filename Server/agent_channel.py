@@ -0,0 +1,312 @@
+"""
+Agent Channel - Persistent WebSocket connection for agents
+
+Instead of one HTTP request per heartbeat, status check and event batch, an
+agent can keep a single WebSocket open at
+
+    /api/v1/agents/ws?hostname=<hostname>
+
+authenticated with the node's own API key or the shared agent API key (the
+`X-API-Key` header, or an `api_key` query parameter for clients that cannot
+set handshake headers). A per-node key only opens the channel of its node.
+Messages are JSON text frames.
+
+Agent -> server:
+    {"type": "heartbeat"}
+    {"type": "events", "id": <any>, "events": [{"event_type", "severity", "details"}, ...]}
+    {"type": "ping"}
+
+Server -> agent:
+    {"type": "policies", "version": "<sha256>", "data": [<policy>, ...]}
+                                                    on connect and on every assignment change
+    {"type": "events_ack", "id": <id>, "count": <n>, "triggered_rules": [...]}
+    {"type": "pong"}
+    {"type": "error", "id": <id>, "detail": "..."}
+
+Heartbeats and events go through the same code paths as the HTTP endpoints.
+Policies are pushed as the node's full policy list, so an agent that missed
+a push is back in sync after its next reconnect. The list and its version are
+the node's compiled bundle (see policy_bundles.py), as served over HTTP by
+`GET /policies/{node_id}/bundle`.
+
+Everything sent to an agent goes through a bounded queue (AGENT_SEND_QUEUE_SIZE
+messages) drained by the connection's own writer task, so pushing policies
+never waits on an agent. A queued policy list is replaced by a newer one. An
+agent whose queue is full, or that has not accepted a message within
+AGENT_SEND_TIMEOUT seconds, is disconnected and gets its policies again when
+it reconnects.
+
+An idle connection costs two suspended coroutines and no timers, so a process
+can hold tens of thousands of them; the limits are file descriptors
+(`ulimit -n`) and the server's WebSocket ping settings. Each node has at most
+one channel; a new connection replaces the previous one.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional, Tuple
+
+from fastapi import APIRouter, Header, HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from sqlalchemy import select
+
+import models
+import schemas
+from authentication import authenticate_agent
+from db import ReadSessionLocal
+from logs import ingest_events
+from policy_bundles import policy_bundles
+from nodes import record_heartbeat
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Messages buffered per agent connection; an agent that falls further behind is disconnected
+AGENT_SEND_QUEUE_SIZE = int(os.getenv("AGENT_SEND_QUEUE_SIZE", "64"))
+# Seconds an agent may take to accept a message before it is disconnected
+AGENT_SEND_TIMEOUT = float(os.getenv("AGENT_SEND_TIMEOUT", "10"))
+
+router = APIRouter(
+    prefix="/agents",
+    tags=["Agent Channel"],
+)
+
+# Close code sent to a connection replaced by a newer one from the same node
+CLOSE_REPLACED = 4000
+
+
+class AgentConnection:
+    """An agent's socket and the bounded queue its writer task drains."""
+
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        # (replace key, serialized message); a message with a key replaces a queued one with the same key
+        self.queue: Deque[Tuple[Optional[str], str]] = deque()
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # Set to have the writer close the socket instead of sending what is queued
+        self.close_code: Optional[int] = None
+
+    def enqueue(self, text: str, key: Optional[str] = None) -> bool:
+        """
+        Buffers a serialized message for the writer task. Never blocks.
+
+        Returns:
+            False if the queue is full (the agent is not keeping up)
+        """
+        if key is not None:
+            for index, (queued_key, _) in enumerate(self.queue):
+                if queued_key == key:
+                    self.queue[index] = (key, text)
+                    return True
+        if len(self.queue) >= self.max_queue:
+            return False
+        self.queue.append((key, text))
+        self.ready.set()
+        return True
+
+    def close(self, code: int) -> None:
+        """Has the writer task close the socket."""
+        self.close_code = code
+        self.ready.set()
+
+
+class AgentConnectionManager:
+    """Tracks the open agent channel of every connected node."""
+
+    def __init__(self, max_queue: int = 64, send_timeout: float = 10.0):
+        """
+        Args:
+            max_queue: Messages buffered per agent
+            send_timeout: How long an agent may take to accept a message (seconds)
+        """
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.connections: Dict[int, AgentConnection] = {}
+
+    async def connect(self, node_id: int, websocket: WebSocket):
+        """Accept and register an agent connection, closing any older one for the node."""
+        await websocket.accept()
+        connection = AgentConnection(websocket, self.max_queue)
+        connection.task = asyncio.create_task(self._writer(node_id, connection))
+        previous = self.connections.get(node_id)
+        self.connections[node_id] = connection
+        if previous is not None:
+            previous.close(CLOSE_REPLACED)
+        logger.info(f"Agent channel opened for node {node_id}. Total agent connections: {len(self.connections)}")
+
+    def disconnect(self, node_id: int, websocket: WebSocket):
+        """Remove an agent connection (unless it was already replaced)."""
+        connection = self.connections.get(node_id)
+        if connection is None or connection.websocket is not websocket:
+            return
+        del self.connections[node_id]
+        if connection.task is not None and connection.task is not asyncio.current_task():
+            connection.task.cancel()
+        logger.info(f"Agent channel closed for node {node_id}. Total agent connections: {len(self.connections)}")
+
+    def send(self, node_id: int, message: dict, key: Optional[str] = None, websocket: Optional[WebSocket] = None) -> bool:
+        """
+        Queues a message for a node's agent (returns without waiting on it).
+
+        Args:
+            key: Replace a queued message with the same key instead of adding one
+            websocket: Only send on this connection (not one that replaced it)
+
+        Returns:
+            False if the agent is not connected, or was disconnected for falling behind
+        """
+        connection = self.connections.get(node_id)
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return False
+        if connection.enqueue(json.dumps(message), key):
+            return True
+        logger.warning(f"Agent of node {node_id} is not reading its messages; disconnecting it")
+        # The writer closes the socket once its current send is done (or timed out)
+        del self.connections[node_id]
+        connection.close(status.WS_1013_TRY_AGAIN_LATER)
+        return False
+
+    async def push_policies(self, node_ids: Iterable[int]):
+        """Queue the current policy list for every connected agent among `node_ids`."""
+        connected = [node_id for node_id in set(node_ids) if node_id in self.connections]
+        if not connected:
+            return
+        bundles = await policy_bundles.get_many(connected)
+        for node_id in connected:
+            if node_id in bundles:
+                self.send(node_id, {
+                    "type": "policies",
+                    "version": bundles[node_id].version,
+                    "data": list(bundles[node_id].policies.values()),
+                }, key="policies")
+
+    async def _writer(self, node_id: int, connection: AgentConnection):
+        """Drains one agent's queue onto its socket."""
+        websocket = connection.websocket
+        try:
+            while True:
+                if connection.close_code is not None:
+                    try:
+                        await asyncio.wait_for(websocket.close(code=connection.close_code), self.send_timeout)
+                    except Exception:
+                        pass
+                    break
+                if not connection.queue:
+                    connection.ready.clear()
+                    await connection.ready.wait()
+                    continue
+                _, text = connection.queue.popleft()
+                await asyncio.wait_for(websocket.send_text(text), self.send_timeout)
+        except asyncio.CancelledError:
+            return
+        except asyncio.TimeoutError:
+            logger.warning(f"Agent of node {node_id} did not accept a message for {self.send_timeout}s; disconnecting it")
+        except Exception as e:
+            logger.error(f"Error sending to agent of node {node_id}: {e}")
+        self.disconnect(node_id, websocket)
+
+
+async def _hostname_of(node_id: int) -> Optional[str]:
+    async with ReadSessionLocal() as session:
+        return (await session.execute(
+            select(models.Node.hostname).where(models.Node.id == node_id)
+        )).scalar_one_or_none()
+
+
+# Global agent connection manager instance
+agent_manager = AgentConnectionManager(max_queue=AGENT_SEND_QUEUE_SIZE, send_timeout=AGENT_SEND_TIMEOUT)
+
+
+def _error(detail: str, message_id: Any = None) -> dict:
+    return {"type": "error", "id": message_id, "detail": detail}
+
+
+async def _handle_message(node_id: int, hostname: str, text: str) -> Optional[dict]:
+    """
+    Handles one message from an agent.
+
+    Returns:
+        The reply to send, if any
+
+    Raises:
+        HTTPException: If the node no longer exists
+    """
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return _error("Message is not valid JSON")
+    if not isinstance(message, dict):
+        return _error("Message must be a JSON object")
+
+    message_type = message.get("type")
+    message_id = message.get("id")
+
+    if message_type == "heartbeat":
+        await record_heartbeat(hostname)
+        return None
+
+    if message_type == "events":
+        try:
+            batch = schemas.EventBatchIngestRequest(
+                events=[{**event, "node_id": node_id} for event in message.get("events") or []]
+            )
+        except (ValidationError, TypeError) as e:
+            return _error(f"Invalid events: {e}", message_id)
+        try:
+            results = await ingest_events(batch.events)
+        except HTTPException as e:
+            return _error(str(e.detail), message_id)
+        return {
+            "type": "events_ack",
+            "id": message_id,
+            "count": len(results),
+            "triggered_rules": sorted({rule for result in results for rule in result.triggered_rules}),
+        }
+
+    if message_type == "ping":
+        return {"type": "pong"}
+
+    return _error(f"Unknown message type: {message_type!r}", message_id)
+
+
+@router.websocket("/ws")
+async def agent_channel(
+    websocket: WebSocket,
+    hostname: str,
+    api_key: Optional[str] = None,
+    x_api_key: Optional[str] = Header(None),
+):
+    """
+    Persistent channel for agents: heartbeats and events in, policy updates out.
+    """
+    try:
+        key_node_id = await authenticate_agent(x_api_key or api_key)
+        if key_node_id is not None and await _hostname_of(key_node_id) != hostname:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="API key belongs to another node")
+        # Connecting counts as a heartbeat and identifies the node
+        node = await record_heartbeat(hostname)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    await agent_manager.connect(node.id, websocket)
+    try:
+        await agent_manager.push_policies([node.id])
+        while True:
+            text = await websocket.receive_text()
+            reply = await _handle_message(node.id, hostname, text)
+            if reply is not None and not agent_manager.send(node.id, reply, websocket=websocket):
+                # Disconnected for falling behind, or replaced by a newer connection
+                break
+    except WebSocketDisconnect:
+        pass
+    except HTTPException as e:
+        # The node was deleted (or renamed) while connected
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+    finally:
+        agent_manager.disconnect(node.id, websocket)
@@ -0,0 +1,199 @@
+"""
+Agent Keys - Per-node agent API keys
+
+Besides the shared AGENT_API_KEY, every node can have its own key, so keys
+can be rotated one node at a time and a single node can be revoked. A key
+looks like
+
+    aegis_<prefix>_<secret>
+
+where the prefix is a random public identifier and the secret is 32 random
+bytes. The database stores only the prefix (unique, indexed) and the SHA-256
+of the whole key. The keys are random and long, so a fast hash is as strong
+as a slow password KDF would be, and checking one costs a single SHA-256.
+
+AgentKeyIndex keeps prefix -> (node ID, key hash) in memory, so verifying a
+request is one dictionary lookup plus one hash. A prefix missing from the
+cache is looked up in the database once. Entries expire after
+AGENT_KEY_CACHE_TTL seconds, so a key rotated or revoked through another worker
+process stops working there within that time.
+
+Keys that could not have been generated here (wrong shape) are rejected
+without a lookup. Unknown prefixes are cached in a separate, smaller LRU
+(AGENT_KEY_NEGATIVE_CACHE_SIZE), and at most AGENT_KEY_LOOKUP_RATE uncached
+prefixes per second are looked up; beyond that they are rejected until the
+next second. A flood of made-up keys therefore can neither evict real keys
+from the cache nor turn into one query per request.
+"""
+
+import hashlib
+import os
+import re
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from db import ReadSessionLocal
+
+# --- Configuration ---
+AGENT_KEY_CACHE_TTL = float(os.getenv("AGENT_KEY_CACHE_TTL", "60"))
+AGENT_KEY_CACHE_SIZE = int(os.getenv("AGENT_KEY_CACHE_SIZE", "100000"))
+AGENT_KEY_NEGATIVE_CACHE_SIZE = int(os.getenv("AGENT_KEY_NEGATIVE_CACHE_SIZE", "10000"))
+# Uncached prefixes looked up in the database per second at most (0: no limit)
+AGENT_KEY_LOOKUP_RATE = int(os.getenv("AGENT_KEY_LOOKUP_RATE", "100"))
+
+KEY_SCHEME = "aegis"
+# What generate_key() produces: 6 random bytes in hex, then 32 in URL-safe base64
+_KEY_SHAPE = re.compile(KEY_SCHEME + r"_([0-9a-f]{12})_[A-Za-z0-9_-]{43}")
+
+
+def hash_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def is_node_key(api_key: Optional[str]) -> bool:
+    """Whether `api_key` has the shape of a per-node key (as opposed to the shared key)."""
+    return api_key is not None and api_key.startswith(KEY_SCHEME + "_") and api_key.count("_") >= 2
+
+
+def generate_key() -> Tuple[str, str, str]:
+    """
+    Creates a new per-node key.
+
+    Returns:
+        (key, prefix, key hash); only the prefix and the hash are stored
+    """
+    prefix = secrets.token_hex(6)
+    key = f"{KEY_SCHEME}_{prefix}_{secrets.token_urlsafe(32)}"
+    return key, prefix, hash_key(key)
+
+
+class AgentKeyIndex:
+    """Resolves per-node keys to node IDs from an in-memory cache of the stored hashes."""
+
+    def __init__(
+        self,
+        ttl: float = 60,
+        max_entries: int = 100000,
+        max_unknown: int = 10000,
+        lookup_rate: int = 100,
+    ):
+        """
+        Args:
+            ttl: How long a cached prefix is trusted before it is read again (seconds)
+            max_entries: Cached prefixes kept at most (the oldest are dropped first)
+            max_unknown: Cached unknown prefixes kept at most (the least recently used are dropped)
+            lookup_rate: Uncached prefixes looked up per second at most (0: no limit)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_unknown = max_unknown
+        self.lookup_rate = lookup_rate
+        # Prefix -> (node ID, key hash, expiry)
+        self._entries: Dict[str, Tuple[Optional[int], Optional[str], float]] = {}
+        # Unknown or revoked prefix -> expiry
+        self._unknown: "OrderedDict[str, float]" = OrderedDict()
+        # Lookups in the current one-second window, and when the window ends
+        self._lookups = 0
+        self._window_end = 0.0
+        self.rejected_lookups = 0
+
+    def remember(self, prefix: str, node_id: Optional[int], key_hash: Optional[str]) -> None:
+        """Caches a prefix (None for node ID and hash records an unknown prefix)."""
+        self._entries.pop(prefix, None)
+        self._unknown.pop(prefix, None)
+        expires = time.monotonic() + self.ttl
+        if key_hash is None:
+            self._unknown[prefix] = expires
+            if len(self._unknown) > self.max_unknown:
+                self._unknown.popitem(last=False)
+            return
+        if len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries[prefix] = (node_id, key_hash, expires)
+
+    def forget(self, prefix: Optional[str]) -> None:
+        """Revokes a key in this process immediately."""
+        if prefix is not None:
+            self.remember(prefix, None, None)
+
+    async def load(self, session: AsyncSession) -> None:
+        """Caches every node key."""
+        result = await session.execute(
+            select(models.Node.api_key_prefix, models.Node.id, models.Node.api_key_hash)
+            .where(models.Node.api_key_prefix.is_not(None))
+        )
+        for prefix, node_id, key_hash in result.all():
+            self.remember(prefix, node_id, key_hash)
+
+    async def resolve(self, api_key: str) -> Optional[int]:
+        """
+        Verifies a per-node key.
+
+        Returns:
+            The ID of the node the key belongs to, or None if the key is not valid
+        """
+        match = _KEY_SHAPE.fullmatch(api_key)
+        if match is None:
+            return None
+        prefix = match.group(1)
+        now = time.monotonic()
+        unknown = self._unknown.get(prefix)
+        if unknown is not None and unknown >= now:
+            self._unknown.move_to_end(prefix)
+            return None
+        entry = self._entries.get(prefix)
+        if entry is None or entry[2] < now:
+            # Re-reading a known key's expired entry is not limited; made-up keys never have one
+            if entry is None and not self._allow_lookup(now):
+                return None
+            async with ReadSessionLocal() as session:
+                row = (await session.execute(
+                    select(models.Node.id, models.Node.api_key_hash)
+                    .where(models.Node.api_key_prefix == prefix)
+                )).one_or_none()
+            self.remember(prefix, *(row or (None, None)))
+            entry = self._entries.get(prefix)
+            if entry is None:
+                return None
+        node_id, key_hash, _ = entry
+        if key_hash is None or not secrets.compare_digest(key_hash, hash_key(api_key)):
+            return None
+        return node_id
+
+    def _allow_lookup(self, now: float) -> bool:
+        """Counts a database lookup against the per-second budget."""
+        if self.lookup_rate <= 0:
+            return True
+        if now >= self._window_end:
+            if self.rejected_lookups:
+                logger.warning(f"Rejected {self.rejected_lookups} agent keys over the lookup rate limit")
+                self.rejected_lookups = 0
+            self._window_end = now + 1.0
+            self._lookups = 0
+        if self._lookups >= self.lookup_rate:
+            self.rejected_lookups += 1
+            return False
+        self._lookups += 1
+        return True
+
+    async def start(self):
+        """Cache the stored node keys."""
+        async with ReadSessionLocal() as session:
+            await self.load(session)
+        logger.info(f"AgentKeyIndex cached {len(self._entries)} node keys")
+
+
+# Global instance
+agent_keys = AgentKeyIndex(
+    ttl=AGENT_KEY_CACHE_TTL,
+    max_entries=AGENT_KEY_CACHE_SIZE,
+    max_unknown=AGENT_KEY_NEGATIVE_CACHE_SIZE,
+    lookup_rate=AGENT_KEY_LOOKUP_RATE,
+)
@@ -2,7 +2,7 @@
 
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,10 +14,20 @@ import nodes
 import policies
 import auth_routes  # NEW authentication
 import agent_routes  # Agent package builder
-from db import engine
-from models import Base
+import agent_channel  # Persistent agent WebSocket
+from db import dispose_engines, init_db, write_queue
 from websocket import manager
 from heartbeat_monitor import heartbeat_monitor
+from heartbeats import heartbeat_buffer
+from baselines import baseline_tracker
+from partitions import partition_manager
+from search import search_index
+from rollups import rollup_compactor
+from compression import details_codec
+from authentication import password_hasher
+from agent_keys import agent_keys
+from response_cache import response_cache
+from policy_bundles import policy_bundles
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,23 +39,48 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     """ Handles application startup and shutdown events. """
     logger.info("Application startup...")
     logger.info("Initializing database and creating tables...")
-    async with engine.begin() as conn:
-        try:
-            await conn.run_sync(Base.metadata.create_all)
-            logger.info("Database tables created successfully.")
-        except Exception as e:
-            logger.error(f"Error creating database tables: {e}")
-            raise
+    try:
+        await init_db()
+        logger.info("Database tables created successfully.")
+    except Exception as e:
+        logger.error(f"Error creating database tables: {e}")
+        raise
     
+    # Start the batched writer (WAL storage mode only)
+    await write_queue.start()
+    # Start the WebSocket fan-out to the per-client send queues
+    await manager.start()
+
+    # Create upcoming event partitions and apply retention (if enabled)
+    await partition_manager.start()
+    # Prune expired minute/hour statistics rollups
+    await rollup_compactor.start()
+    # Load the trained dictionaries for compressed event details
+    await details_codec.start()
+
+    # Cache the per-node agent API keys
+    await agent_keys.start()
+    # Cache the nodes and start flushing coalesced heartbeats (if enabled)
+    await heartbeat_buffer.start()
     # Start heartbeat monitor
     await heartbeat_monitor.start()
+    # Load persisted per-node baselines and start saving them periodically
+    await baseline_tracker.start()
 
     yield
 
     logger.info("Application shutdown...")
     # Stop heartbeat monitor
     await heartbeat_monitor.stop()
-    await engine.dispose()
+    await heartbeat_buffer.stop()
+    await baseline_tracker.stop()
+    await partition_manager.stop()
+    await rollup_compactor.stop()
+    await details_codec.stop()
+    await write_queue.stop()
+    await manager.stop()
+    password_hasher.stop()
+    await dispose_engines()
     logger.info("Shutdown complete.")
 
 
@@ -66,6 +101,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the dashboard read the pagination cursor of GET /logs
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -77,6 +114,7 @@ app.include_router(logs.router, prefix=API_V1_PREFIX)
 app.include_router(policies.router, prefix=API_V1_PREFIX)
 app.include_router(auth_routes.router, prefix=API_V1_PREFIX)  # NEW authentication
 app.include_router(agent_routes.router, prefix=API_V1_PREFIX)  # Agent package builder
+app.include_router(agent_channel.router, prefix=API_V1_PREFIX)  # Persistent agent WebSocket
 
 
 # --- Health Check Endpoint ---
@@ -92,23 +130,44 @@ async def health_check() -> HealthStatus:
     return HealthStatus(status="ok")
 
 
+@app.get(
+    "/health/cache",
+    tags=["Health"],
+    response_model=dict,
+)
+async def response_cache_stats() -> dict:
+    """Hit rates of the list endpoint response cache and policy bundle counts (this worker process)."""
+    return {**response_cache.stats(), "policy_bundles": policy_bundles.stats()}
+
+
+@app.get(
+    "/health/search",
+    tags=["Health"],
+    response_model=dict,
+)
+async def search_index_stats() -> dict:
+    """Per-event cost of full-text index maintenance at ingest (this worker process)."""
+    return {"enabled": search_index.enabled, **search_index.stats()}
+
+
 # --- WebSocket Endpoint ---
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, resume_from: Optional[int] = None, stream: Optional[str] = None):
     """
     WebSocket endpoint for real-time updates.
     Clients connect here to receive live node and event updates.
+    A reconnecting client passes `stream` and `resume_from` to receive the updates it missed.
     """
     await manager.connect(websocket)
+    if resume_from is not None:
+        manager.resume(websocket, resume_from, stream)
     try:
         while True:
-            # Keep connection alive and receive any client messages
+            # Subscription changes; any other message is a keepalive answered with a pong
             data = await websocket.receive_text()
-            # Echo back or handle client messages if needed
-            await manager.send_personal_message(
-                {"type": "pong", "message": "Connection alive"}, 
-                websocket
-            )
+            await manager.handle_client_message(websocket, data)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        logger.info("WebSocket client disconnected")
\ No newline at end of file
+        logger.info("WebSocket client disconnected")
+    finally:
+        # Also on unexpected errors, so the client's writer task never outlives it
+        manager.disconnect(websocket)
\ No newline at end of file
@@ -9,12 +9,11 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import get_db
+from db import ReadSessionLocal
 from models import User
 from schemas import Token
-from authentication import verify_password, create_access_token, get_current_user
+from authentication import password_hasher, create_access_token, get_current_user
 
 logger = logging.getLogger(__name__)
 
@@ -24,14 +23,12 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 @router.post("/login", response_model=Token)
 async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: AsyncSession = Depends(get_db)
 ):
     """
     Login endpoint - authenticate and return JWT token.
     
     Args:
         form_data: Username and password from form
-        db: Database session
         
     Returns:
         Access token and token type
@@ -41,11 +38,13 @@ async def login(
     """
     logger.info(f"Login attempt: username={form_data.username}")
     
-    # Get user from database
-    result = await db.execute(
-        select(User).where(User.username == form_data.username)
-    )
-    user = result.scalar_one_or_none()
+    # Get user from database; the session is closed before bcrypt runs, so
+    # a login never holds a database connection while the password is checked
+    async with ReadSessionLocal() as db:
+        result = await db.execute(
+            select(User).where(User.username == form_data.username)
+        )
+        user = result.scalar_one_or_none()
     
     # Validate user exists
     if not user:
@@ -66,7 +65,7 @@ async def login(
         )
     
     # Verify password
-    if not verify_password(form_data.password, user.hashed_password):
+    if not await password_hasher.verify(form_data.password, user.hashed_password):
         logger.warning(f"Login failed: invalid password - {form_data.username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -3,11 +3,14 @@ authentication.py - Brand New Authentication System
 Simple, reliable password hashing and JWT token management.
 """
 
+import asyncio
 import os
 import secrets
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional, TypeVar
 
 import bcrypt
 from jose import jwt, JWTError
@@ -17,6 +20,10 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from agent_keys import agent_keys, is_node_key
+from db import ReadSessionLocal
+from models import User
+
 load_dotenv()
 
 # Configuration
@@ -24,6 +31,17 @@ SECRET_KEY = os.getenv("SECRET_KEY", "")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 AGENT_API_KEY = os.getenv("AGENT_API_KEY", "")
+# Reject the shared AGENT_API_KEY for ingestion; agents must use their own node key
+AGENT_NODE_KEYS_REQUIRED = os.getenv("AGENT_NODE_KEYS_REQUIRED", "false").lower() in ("1", "true", "yes", "on")
+# bcrypt runs on its own thread pool: threads, requests allowed to wait for one,
+# and the longest a request waits for its result (seconds)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "32"))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+# Niceness of the bcrypt threads, so the event loop wins when CPU is short (Linux)
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "10"))
+
+T = TypeVar("T")
 
 # OAuth2 scheme for JWT token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
@@ -78,6 +96,134 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
+class PasswordHasher:
+    """
+    Runs bcrypt off the event loop, on a small dedicated thread pool.
+
+    One bcrypt call at rounds=12 takes about 250ms of CPU. Made directly in an
+    async handler, it would stall ingest, heartbeats and WebSockets for that
+    long. bcrypt releases the GIL, so on the pool it only costs CPU time. At
+    most `workers` calls run at once and `queue_size` more may wait. Requests
+    beyond that, or whose result takes longer than `timeout`, fail fast with
+    503 instead of piling up. The threads run at a lower priority, so on a
+    busy host they only use CPU time the event loop leaves idle.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 32, timeout: float = 10.0, nice: int = 10):
+        """
+        Args:
+            workers: Threads running bcrypt
+            queue_size: Calls allowed to wait for a free thread
+            timeout: Longest wait for a result, queueing included (seconds)
+            nice: Niceness added to the bcrypt threads (Linux only; 0 leaves them as is)
+        """
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.nice = nice
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+
+    async def hash(self, password: str) -> str:
+        """Hash a password (see `hash_password`) on the bcrypt pool."""
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password (see `verify_password`) on the bcrypt pool."""
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def _run(self, fn: Callable[..., T], *args) -> T:
+        """
+        Raises:
+            HTTPException: 503 if the pool is saturated or the call timed out
+        """
+        if self._in_flight >= self.workers + self.queue_size:
+            raise _auth_busy()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="bcrypt", initializer=self._lower_priority
+            )
+
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(fn, *args)
+        self._in_flight += 1
+        # A call only frees its slot once its thread is done with it
+        future.add_done_callback(lambda _: self._release_soon(loop))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise _auth_busy()
+
+    def _lower_priority(self):
+        # On Linux each thread has its own nice value
+        if self.nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except (AttributeError, OSError):
+                pass
+
+    def _release_soon(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The loop closed while a call was still running (shutdown)
+            pass
+
+    def _release(self):
+        self._in_flight -= 1
+
+    def stop(self):
+        """Shut the pool down, dropping calls that have not started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _auth_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
+# Global instance
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    queue_size=PASSWORD_HASH_QUEUE_SIZE,
+    timeout=PASSWORD_HASH_TIMEOUT,
+    nice=PASSWORD_HASH_NICE,
+)
+
+
+async def verify_admin_password(password: str) -> None:
+    """
+    Confirms a destructive action with the admin password.
+
+    The admin user is read on a session that is closed before bcrypt runs, so
+    no database connection (in the WAL storage mode, the single writer
+    connection) is held while the password is checked.
+
+    Raises:
+        HTTPException: 500 if there is no admin user, 401 if the password is wrong
+    """
+    async with ReadSessionLocal() as session:
+        result = await session.execute(select(User.hashed_password).where(User.username == "admin"))
+        hashed_password = result.scalar_one_or_none()
+
+    if hashed_password is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Admin user not found"
+        )
+
+    if not await password_hasher.verify(password, hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin password"
+        )
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token.
@@ -160,36 +306,83 @@ async def get_current_user(
     }
 
 
-async def verify_api_key(x_api_key: Optional[str] = Header(None)) -> bool:
+async def authenticate_agent(api_key: Optional[str]) -> Optional[int]:
     """
-    Verify agent API key for log ingestion endpoints.
-    Used as a FastAPI dependency for agent/node authentication.
+    Authenticate an agent by its API key: a per-node key, or the shared AGENT_API_KEY.
     
     Args:
-        x_api_key: API key from X-API-Key header
+        api_key: API key presented by the agent
         
     Returns:
-        True if API key is valid
+        The ID of the node the key belongs to, or None for the shared key
+        (and in development mode, when no API key is configured)
         
     Raises:
-        HTTPException: If API key is missing or invalid
+        HTTPException: If the API key is missing or invalid
     """
+    if is_node_key(api_key):
+        node_id = await agent_keys.resolve(api_key)
+        if node_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API key",
+                headers={"WWW-Authenticate": "ApiKey"},
+            )
+        return node_id
+
+    if AGENT_NODE_KEYS_REQUIRED:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Per-node API key required",
+            headers={"WWW-Authenticate": "ApiKey"},
+        )
+
     if not AGENT_API_KEY:
         # If no API key is configured, allow access (development mode)
-        return True
+        return None
     
-    if x_api_key is None:
+    if api_key is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API key required",
             headers={"WWW-Authenticate": "ApiKey"},
         )
     
-    if x_api_key != AGENT_API_KEY:
+    if not secrets.compare_digest(api_key.encode(), AGENT_API_KEY.encode()):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
             headers={"WWW-Authenticate": "ApiKey"},
         )
     
-    return True
+    return None
+
+
+async def verify_api_key(x_api_key: Optional[str] = Header(None)) -> Optional[int]:
+    """
+    Verify agent API key for log ingestion endpoints.
+    Used as a FastAPI dependency for agent/node authentication.
+    
+    Args:
+        x_api_key: API key from X-API-Key header
+        
+    Returns:
+        The node ID bound to a per-node key, or None for the shared key
+        
+    Raises:
+        HTTPException: If API key is missing or invalid
+    """
+    return await authenticate_agent(x_api_key)
+
+
+def is_shared_api_key(api_key: Optional[str]) -> bool:
+    """
+    Check whether an API key is the configured shared AGENT_API_KEY.
+    
+    Args:
+        api_key: API key presented by the agent
+        
+    Returns:
+        True only if a shared key is configured and `api_key` matches it
+    """
+    return bool(AGENT_API_KEY) and api_key is not None and secrets.compare_digest(api_key.encode(), AGENT_API_KEY.encode())
@@ -0,0 +1,379 @@
+"""
+Baselines - Per-node, per-event-type behavioral baselines
+
+Each (node_id, event_type) pair gets a "slot" holding a handful of floats that
+describe its normal event rate: an EWMA of the per-bucket event count and an
+EWMA of its variance. Every event costs O(1): it bumps the count of the current
+time bucket and, when a bucket closes, folds that count into the running
+statistics. A detector fires when the count of the current bucket climbs more
+than `z_threshold` standard deviations above the learned mean.
+
+All state lives in flat `array` columns indexed by slot, so a fleet of
+thousands of nodes costs a few dozen bytes per node and event type. A node
+keeps at most `max_slots_per_node` event types, and its slots are dropped when
+the node is deleted. The arrays are periodically snapshotted to disk and
+reloaded at startup so the learned baselines survive restarts. Every worker
+process learns from the events it ingests and claims a file of its own
+(BASELINE_FILE, then baselines.1.json, ...), locked while the process runs.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import math
+import os
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, every process uses its own PID's file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+BASELINE_FILE = os.getenv("BASELINE_FILE", "baselines.json")
+BASELINE_BUCKET_SECONDS = int(os.getenv("BASELINE_BUCKET_SECONDS", "60"))
+BASELINE_ALPHA = float(os.getenv("BASELINE_ALPHA", "0.05"))
+BASELINE_Z_THRESHOLD = float(os.getenv("BASELINE_Z_THRESHOLD", "4.0"))
+BASELINE_MIN_BUCKETS = int(os.getenv("BASELINE_MIN_BUCKETS", "30"))
+BASELINE_MIN_COUNT = int(os.getenv("BASELINE_MIN_COUNT", "20"))
+BASELINE_SAVE_INTERVAL = int(os.getenv("BASELINE_SAVE_INTERVAL", "300"))
+BASELINE_MAX_TYPES_PER_NODE = int(os.getenv("BASELINE_MAX_TYPES_PER_NODE", "256"))
+
+# Float columns ('d') and integer columns ('q') making up one slot.
+_FLOAT_FIELDS = ("mean", "var")
+_INT_FIELDS = ("bucket", "count", "seen", "fired")
+
+SlotKey = Tuple[int, str]
+
+
+class BaselineTracker:
+    """
+    Maintains EWMA mean/variance of per-bucket event counts for every
+    (node_id, event_type) pair and flags buckets that deviate from them.
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: int = 60,
+        alpha: float = 0.05,
+        z_threshold: float = 4.0,
+        min_buckets: int = 30,
+        min_count: int = 20,
+        path: Optional[str] = None,
+        save_interval: int = 300,
+        max_slots_per_node: int = 256,
+    ):
+        """
+        Args:
+            bucket_seconds: Width of the counting bucket (seconds)
+            alpha: EWMA smoothing factor applied once per closed bucket
+            z_threshold: Standard deviations above the mean that count as a deviation
+            min_buckets: Closed buckets required before a slot may fire (warm-up)
+            min_count: Minimum events in a bucket before it may fire
+            path: File the baselines are persisted to (None disables persistence);
+                further worker processes use numbered files next to it
+            save_interval: How often the baselines are written to disk (seconds)
+            max_slots_per_node: Event types tracked per node at most (0 for no limit)
+        """
+        self.bucket_seconds = bucket_seconds
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_buckets = min_buckets
+        self.min_count = min_count
+        self.base_path = Path(path) if path else None
+        # The file this process claimed (see _claim_path)
+        self.path: Optional[Path] = None
+        self._lock_fd: Optional[int] = None
+        self.save_interval = save_interval
+        self.max_slots_per_node = max_slots_per_node
+
+        self._slots: Dict[SlotKey, int] = {}
+        # Slot -> key, and the number of slots of each node
+        self._keys: List[SlotKey] = []
+        self._node_slots: Dict[int, int] = {}
+        self._mean = array("d")
+        self._var = array("d")
+        self._bucket = array("q")
+        self._count = array("q")
+        self._seen = array("q")
+        self._fired = array("q")
+
+        self.running = False
+        self.task = None
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # --------------------------------------------------------------------------
+    # Streaming updates
+    # --------------------------------------------------------------------------
+
+    def _columns(self) -> List[array]:
+        return [getattr(self, f"_{name}") for name in _FLOAT_FIELDS + _INT_FIELDS]
+
+    def _slot_for(self, key: SlotKey, bucket: int) -> Optional[int]:
+        """Returns the key's slot, creating it unless its node is at the limit."""
+        slot = self._slots.get(key)
+        if slot is None:
+            node_id = key[0]
+            slots = self._node_slots.get(node_id, 0)
+            if self.max_slots_per_node and slots >= self.max_slots_per_node:
+                return None
+            self._node_slots[node_id] = slots + 1
+            slot = len(self._keys)
+            self._slots[key] = slot
+            self._keys.append(key)
+            self._mean.append(0.0)
+            self._var.append(0.0)
+            self._bucket.append(bucket)
+            self._count.append(0)
+            self._seen.append(0)
+            self._fired.append(-1)
+        return slot
+
+    def _remove_slot(self, slot: int) -> None:
+        """Frees a slot by moving the last slot into its place."""
+        key = self._keys[slot]
+        last = len(self._keys) - 1
+        if slot != last:
+            moved = self._keys[last]
+            self._keys[slot] = moved
+            self._slots[moved] = slot
+            for column in self._columns():
+                column[slot] = column[last]
+        self._keys.pop()
+        for column in self._columns():
+            column.pop()
+        del self._slots[key]
+
+    def forget_node(self, node_id: int) -> None:
+        """Drops every baseline of a deleted node."""
+        if self._node_slots.pop(node_id, None) is None:
+            return
+        for slot in sorted((slot for key, slot in self._slots.items() if key[0] == node_id), reverse=True):
+            self._remove_slot(slot)
+
+    def _fold(self, slot: int, value: float) -> None:
+        """Folds one closed bucket's count into the EWMA mean and variance."""
+        diff = value - self._mean[slot]
+        incr = self.alpha * diff
+        self._mean[slot] += incr
+        self._var[slot] = (1.0 - self.alpha) * (self._var[slot] + diff * incr)
+
+    def _fold_empty(self, slot: int, buckets: int) -> None:
+        """
+        Folds `buckets` empty buckets at once. With d = (1 - alpha) ** buckets,
+        folding zeros repeatedly works out to mean' = d * mean and
+        var' = d * (var + (1 - d) * mean ** 2).
+        """
+        decay = (1.0 - self.alpha) ** buckets
+        mean = self._mean[slot]
+        self._var[slot] = decay * (self._var[slot] + (1.0 - decay) * mean * mean)
+        self._mean[slot] = decay * mean
+
+    def _roll(self, slot: int, bucket: int) -> None:
+        """Closes the slot's current bucket and any empty buckets since then."""
+        gap = bucket - self._bucket[slot]
+        if gap <= 0:
+            return
+        self._fold(slot, float(self._count[slot]))
+        if gap > 1:
+            self._fold_empty(slot, gap - 1)
+        self._seen[slot] += gap
+        self._bucket[slot] = bucket
+        self._count[slot] = 0
+
+    def observe(self, node_id: int, event_type: str, now: Optional[float] = None) -> Optional[float]:
+        """
+        Records one event and checks it against the slot's baseline.
+
+        Returns:
+            The z-score of the current bucket the first time it crosses the
+            threshold within that bucket, None otherwise.
+        """
+        if now is None:
+            now = time.time()
+        bucket = int(now // self.bucket_seconds)
+        slot = self._slot_for((node_id, event_type), bucket)
+        if slot is None:
+            return None
+        if bucket != self._bucket[slot]:
+            self._roll(slot, bucket)
+        self._count[slot] += 1
+
+        if self._seen[slot] < self.min_buckets or self._fired[slot] == bucket:
+            return None
+        count = self._count[slot]
+        if count < self.min_count:
+            return None
+
+        mean = self._mean[slot]
+        # A perfectly regular source has ~zero variance; floor the deviation
+        # at a Poisson-like sqrt(mean) so it does not fire on +1 events.
+        std = max(math.sqrt(self._var[slot]), math.sqrt(max(mean, 1.0)))
+        z = (count - mean) / std
+        if z > self.z_threshold:
+            self._fired[slot] = bucket
+            logger.warning(
+                f"Baseline deviation for node_id={node_id}, type={event_type}: "
+                f"{count} events in current bucket vs mean={mean:.1f} (z={z:.1f})"
+            )
+            return z
+        return None
+
+    def get_baseline(self, node_id: int, event_type: str) -> Optional[Dict[str, float]]:
+        """Returns the learned statistics for a (node_id, event_type) pair."""
+        slot = self._slots.get((node_id, event_type))
+        if slot is None:
+            return None
+        return {
+            "mean": self._mean[slot],
+            "std": math.sqrt(self._var[slot]),
+            "buckets_seen": self._seen[slot],
+            "current_count": self._count[slot],
+        }
+
+    # --------------------------------------------------------------------------
+    # Persistence
+    # --------------------------------------------------------------------------
+
+    def _snapshot(self) -> dict:
+        columns = {name: getattr(self, f"_{name}") for name in _FLOAT_FIELDS + _INT_FIELDS}
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "keys": [[node_id, event_type] for node_id, event_type in self._keys],
+            "columns": {
+                name: base64.b64encode(column.tobytes()).decode("ascii")
+                for name, column in columns.items()
+            },
+        }
+
+    def _restore(self, data: dict) -> None:
+        if data.get("bucket_seconds") != self.bucket_seconds:
+            logger.warning("Baseline bucket size changed; discarding persisted baselines")
+            return
+        columns = {}
+        for name in _FLOAT_FIELDS + _INT_FIELDS:
+            column = array("d" if name in _FLOAT_FIELDS else "q")
+            column.frombytes(base64.b64decode(data["columns"][name]))
+            columns[name] = column
+        keys = [(int(node_id), str(event_type)) for node_id, event_type in data["keys"]]
+        if any(len(column) != len(keys) for column in columns.values()):
+            raise ValueError("baseline columns do not match key count")
+        self._slots = {key: slot for slot, key in enumerate(keys)}
+        self._keys = keys
+        self._node_slots = {}
+        for node_id, _ in keys:
+            self._node_slots[node_id] = self._node_slots.get(node_id, 0) + 1
+        for name, column in columns.items():
+            setattr(self, f"_{name}", column)
+
+    def _claim_path(self) -> Optional[Path]:
+        """
+        Picks the first baselines file no other running process holds: the
+        configured file, then numbered ones next to it. Restarted workers
+        claim the same files again, so each keeps learning from its own.
+        """
+        if self.base_path is None:
+            return None
+        if fcntl is None:
+            return self.base_path.with_name(f"{self.base_path.stem}.{os.getpid()}{self.base_path.suffix}")
+        for index in range(1024):
+            path = self.base_path if index == 0 else self.base_path.with_name(
+                f"{self.base_path.stem}.{index}{self.base_path.suffix}"
+            )
+            fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            self._lock_fd = fd
+            return path
+        raise RuntimeError(f"No free baselines file next to {self.base_path}")
+
+    def _release_path(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.path = None
+
+    def save(self) -> None:
+        """Writes the baselines to disk atomically."""
+        if self.path is None:
+            return
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(self._snapshot()))
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        """Loads previously persisted baselines, if any."""
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            self._restore(json.loads(self.path.read_text()))
+            logger.info(f"Loaded {len(self._slots)} baselines from {self.path}")
+        except Exception as e:
+            logger.error(f"Could not load baselines from {self.path}: {e}")
+
+    async def _save_async(self) -> None:
+        snapshot = self._snapshot()
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        await asyncio.to_thread(tmp_path.write_text, json.dumps(snapshot))
+        os.replace(tmp_path, self.path)
+
+    async def start(self):
+        """Claim a baselines file, load it and start the periodic save task."""
+        if self.running:
+            return
+        self.path = self._claim_path()
+        self.load()
+        self.running = True
+        if self.path is not None:
+            self.task = asyncio.create_task(self._save_loop())
+
+    async def stop(self):
+        """Stop the periodic save task and flush the baselines to disk."""
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        try:
+            self.save()
+        except Exception as e:
+            logger.error(f"Could not save baselines: {e}")
+        self._release_path()
+
+    async def _save_loop(self):
+        while self.running:
+            try:
+                await asyncio.sleep(self.save_interval)
+                await self._save_async()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error saving baselines: {e}")
+
+
+# Global instance
+baseline_tracker = BaselineTracker(
+    bucket_seconds=BASELINE_BUCKET_SECONDS,
+    alpha=BASELINE_ALPHA,
+    z_threshold=BASELINE_Z_THRESHOLD,
+    min_buckets=BASELINE_MIN_BUCKETS,
+    min_count=BASELINE_MIN_COUNT,
+    path=BASELINE_FILE or None,
+    save_interval=BASELINE_SAVE_INTERVAL,
+    max_slots_per_node=BASELINE_MAX_TYPES_PER_NODE,
+)
@@ -0,0 +1,118 @@
+"""
+Measures ingest latency during a login storm.
+
+Usage:
+    python benchmark_auth.py [--seconds 5] [--logins 4]
+    SQLITE_STORAGE_MODE=wal python benchmark_auth.py   # with the single WAL writer connection
+
+Runs the app in-process on a scratch SQLite database and sends single-event
+ingest requests one after another for `--seconds`, recording the latency of
+each, in three phases:
+
+  - idle:   no logins
+  - pool:   `--logins` clients logging in back to back, with bcrypt on the
+            PasswordHasher thread pool (the server's behaviour)
+  - inline: the same storm with bcrypt called directly in the handler, as
+            before the pool existed
+
+For each phase it prints ingest p50/p99/max and the logins completed.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+# Point the app at a scratch database before any project module reads the environment
+BENCH_DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix="aegis-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DATABASE_FILE}"
+os.environ.pop("AGENT_API_KEY", None)
+
+import httpx
+
+import authentication
+from app import app, lifespan
+from db import AsyncSessionLocal
+from models import User
+
+PASSWORD = "bench-password"
+
+
+async def inline_verify(plain_password: str, hashed_password: str) -> bool:
+    return authentication.verify_password(plain_password, hashed_password)
+
+
+async def login_loop(client: httpx.AsyncClient, stop: asyncio.Event, counts: dict):
+    while not stop.is_set():
+        response = await client.post("/api/v1/auth/login", data={"username": "bench", "password": PASSWORD})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def run_phase(client: httpx.AsyncClient, node_id: int, seconds: float, logins: int) -> dict:
+    stop = asyncio.Event()
+    counts: dict = {}
+    storm = [asyncio.create_task(login_loop(client, stop, counts)) for _ in range(logins)]
+    await asyncio.sleep(0.5)  # let the storm build up
+
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < deadline:
+        n += 1
+        started = time.perf_counter()
+        response = await client.post("/api/v1/logs/ingest", json={
+            "node_id": node_id, "event_type": "process_created", "severity": "low", "details": {"n": n},
+        })
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        await asyncio.sleep(0.005)
+
+    stop.set()
+    await asyncio.gather(*storm)
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max": latencies[-1],
+        "logins": counts,
+    }
+
+
+async def main(seconds: float, logins: int):
+    async with lifespan(app):
+        async with AsyncSessionLocal() as session:
+            session.add(User(
+                username="bench", email="bench@aegis.local",
+                hashed_password=authentication.hash_password(PASSWORD),
+            ))
+            await session.commit()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            response = await client.post("/api/v1/nodes/register", json={"hostname": "bench", "ip_address": "127.0.0.1"})
+            node_id = response.json()["id"]
+
+            print(f"{seconds:g}s of ingest per phase, {logins} concurrent login clients, "
+                  f"{authentication.password_hasher.workers} bcrypt threads, {os.cpu_count()} CPUs")
+            print(f"{'phase':<8}{'ingests':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}  logins (status: count)")
+            phases = [("idle", 0, None), ("pool", logins, None), ("inline", logins, inline_verify)]
+            for name, concurrency, verify in phases:
+                original = authentication.password_hasher.verify
+                if verify is not None:
+                    authentication.password_hasher.verify = verify
+                try:
+                    result = await run_phase(client, node_id, seconds, concurrency)
+                finally:
+                    authentication.password_hasher.verify = original
+                print(f"{name:<8}{result['requests']:>9}{result['p50']:>9.1f}{result['p99']:>9.1f}{result['max']:>9.1f}  {result['logins']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--logins", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.logins))
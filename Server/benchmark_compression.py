@@ -0,0 +1,157 @@
+"""
+Compares compressed and plain JSON storage of event details.
+
+Usage:
+    python benchmark_compression.py [--events 20000] [--batch-size 200]
+
+Ingests the same synthetic events into throwaway SQLite databases storing
+details as plain JSON, as zstd without a dictionary, and as zstd with
+per-event_type trained dictionaries. For each it prints the average stored
+size of `details`, the database size, the ingest time per event and the time
+per event to read the events back as API responses.
+Requires the `zstandard` package.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+# Point the app at a scratch database before any project module reads the environment
+BENCH_DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix="aegis-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DATABASE_FILE}"
+
+import compression
+import schemas
+from compression import details_codec
+from db import AsyncSessionLocal, engine, ensure_indexes
+from logs import _insert_events
+from models import Base, Event, Node
+from partitions import partition_manager
+from search import search_index
+from sqlalchemy import func, select
+
+EVENT_TYPES = ["process_created", "network_connection", "registry_change"]
+PROCESSES = ["svchost.exe", "powershell.exe", "cmd.exe", "chrome.exe", "explorer.exe", "OneDrive.exe"]
+
+
+def make_details(rng: random.Random, event_type: str) -> dict:
+    process = rng.choice(PROCESSES)
+    if event_type == "network_connection":
+        return {
+            "direction": "established",
+            "protocol": "tcp",
+            "local_address": "192.168.1.20",
+            "local_port": rng.randint(49152, 65535),
+            "remote_address": f"10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+            "remote_port": rng.choice([80, 443, 445, 3389]),
+            "state": "Established",
+            "process_name": process,
+        }
+    if event_type == "registry_change":
+        return {
+            "change_type": rng.choice(["created", "modified", "deleted"]),
+            "registry_path": "HKLM\\Software\\Microsoft\\Windows\\CurrentVersion\\Run",
+            "value_name": f"Updater{rng.randint(0, 20)}",
+            "value_data": f"C:\\Program Files\\Vendor{rng.randint(0, 9)}\\{process}",
+            "description": "Registry autorun entry changed",
+        }
+    return {
+        "process_name": process,
+        "process_id": rng.randint(100, 30000),
+        "parent_process_name": rng.choice(PROCESSES),
+        "executable_path": f"C:\\Windows\\System32\\{process}",
+        "command_line": f"{process} -k netsvcs -p -s task{rng.randint(0, 500)}",
+        "user": f"CORP\\user{rng.randint(0, 50)}",
+        "start_time": f"2025-01-01T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z",
+    }
+
+
+def make_events(rng: random.Random, node_id: int, count: int):
+    events = []
+    for _ in range(count):
+        event_type = rng.choice(EVENT_TYPES)
+        events.append(schemas.EventIngestRequest(
+            node_id=node_id, event_type=event_type, severity="low", details=make_details(rng, event_type)
+        ))
+    return events
+
+
+async def run(mode: str, events: int, batch_size: int) -> dict:
+    await engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(BENCH_DATABASE_FILE + suffix):
+            os.remove(BENCH_DATABASE_FILE + suffix)
+
+    # A fresh codec state for every run; dictionaries are trained up front
+    details_codec.enabled = mode != "json"
+    details_codec._compressors.clear()
+    details_codec._samples.clear()
+    details_codec.dict_samples = events + 1
+    search_index.enabled = False
+
+    async with engine.begin() as conn:
+        await conn.run_sync(partition_manager.prepare_schema)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(ensure_indexes)
+    async with AsyncSessionLocal() as session:
+        session.add(Node(hostname="bench", ip_address="127.0.0.1"))
+        await session.commit()
+        node_id = (await session.execute(select(Node.id))).scalar_one()
+
+    if mode == "zstd+dict":
+        training_rng = random.Random(7)
+        for event_type in EVENT_TYPES:
+            samples = [json.dumps(make_details(training_rng, event_type)).encode() for _ in range(1000)]
+            await details_codec.train(event_type, samples)
+
+    rng = random.Random(42)
+    batches = [make_events(rng, node_id, min(batch_size, events - offset)) for offset in range(0, events, batch_size)]
+    started = time.perf_counter()
+    for batch in batches:
+        async with AsyncSessionLocal() as session:
+            await _insert_events(session, batch)
+            await session.commit()
+    ingest_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        result = await session.stream_scalars(select(Event).execution_options(yield_per=1000))
+        async for event in result:
+            schemas.EventResponse.model_validate(event)
+    read_seconds = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as session:
+        avg_details = (await session.execute(select(func.avg(func.length(Event.details))))).scalar()
+
+    await engine.dispose()
+    return {
+        "avg_details_bytes": avg_details,
+        "db_bytes": os.path.getsize(BENCH_DATABASE_FILE),
+        "ingest_us": ingest_seconds * 1e6 / events,
+        "read_us": read_seconds * 1e6 / events,
+    }
+
+
+async def main(events: int, batch_size: int):
+    print(f"{events} events, batches of {batch_size}")
+    print(f"  {'storage':<10} {'details B':>10} {'db MB':>8} {'ingest us/ev':>13} {'read us/ev':>11}")
+    for mode in ("json", "zstd", "zstd+dict"):
+        stats = await run(mode, events, batch_size)
+        print(
+            f"  {mode:<10} {stats['avg_details_bytes']:10.1f} {stats['db_bytes'] / 1e6:8.2f} "
+            f"{stats['ingest_us']:13.1f} {stats['read_us']:11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compressed event details storage.")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    if compression.zstandard is None:
+        raise SystemExit("benchmark_compression.py requires the 'zstandard' package (pip install zstandard).")
+    asyncio.run(main(args.events, args.batch_size))
@@ -0,0 +1,102 @@
+"""
+Measures what the full-text index costs at ingest time.
+
+Usage:
+    python benchmark_search.py [--events 20000] [--batch-size 200]
+
+Ingests the same synthetic events into two throwaway SQLite databases, one
+with EVENT_SEARCH disabled and one with it enabled, and prints the ingest time
+per event and the database size for each.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+# Point the app at a scratch database before any project module reads the environment
+BENCH_DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix="aegis-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DATABASE_FILE}"
+
+import schemas
+from db import AsyncSessionLocal, engine, ensure_indexes
+from logs import _insert_events
+from models import Base, Node
+from partitions import partition_manager
+from search import search_index
+
+PROCESSES = ["svchost.exe", "powershell.exe", "cmd.exe", "chrome.exe", "mimikatz.exe", "explorer.exe"]
+
+
+def make_details(rng: random.Random) -> dict:
+    process = rng.choice(PROCESSES)
+    return {
+        "process_name": process,
+        "parent_process_name": rng.choice(PROCESSES),
+        "process_path": f"C:\\Windows\\System32\\{process}",
+        "command_line": f"{process} /c task{rng.randint(0, 500)}",
+        "user": f"user{rng.randint(0, 50)}",
+        "dst_ip": f"10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+        "dst_port": rng.choice([22, 80, 443, 445, 3389]),
+    }
+
+
+async def run(enabled: bool, events: int, batch_size: int) -> dict:
+    await engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(BENCH_DATABASE_FILE + suffix):
+            os.remove(BENCH_DATABASE_FILE + suffix)
+
+    search_index.enabled = enabled
+    search_index.indexed_events = search_index.indexed_chars = 0
+    search_index.index_seconds = 0.0
+    async with engine.begin() as conn:
+        await conn.run_sync(partition_manager.prepare_schema)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(ensure_indexes)
+        await conn.run_sync(search_index.prepare_schema)
+    async with AsyncSessionLocal() as session:
+        session.add(Node(hostname="bench", ip_address="127.0.0.1"))
+        await session.commit()
+        node_id = (await session.execute(Node.__table__.select())).first().id
+
+    rng = random.Random(42)
+    started = time.perf_counter()
+    for offset in range(0, events, batch_size):
+        batch = [
+            schemas.EventIngestRequest(node_id=node_id, event_type="process", severity="low", details=make_details(rng))
+            for _ in range(min(batch_size, events - offset))
+        ]
+        async with AsyncSessionLocal() as session:
+            await _insert_events(session, batch)
+            await session.commit()
+    elapsed = time.perf_counter() - started
+
+    await engine.dispose()
+    return {
+        "us_per_event": elapsed * 1e6 / events,
+        "db_bytes": os.path.getsize(BENCH_DATABASE_FILE),
+        "index": search_index.stats() if enabled else None,
+    }
+
+
+async def main(events: int, batch_size: int):
+    baseline = await run(False, events, batch_size)
+    indexed = await run(True, events, batch_size)
+
+    print(f"{events} events, batches of {batch_size}")
+    print(f"  without search index: {baseline['us_per_event']:8.1f} us/event  {baseline['db_bytes'] / 1e6:8.2f} MB")
+    print(f"  with search index:    {indexed['us_per_event']:8.1f} us/event  {indexed['db_bytes'] / 1e6:8.2f} MB")
+    stats = indexed["index"]
+    print(f"  index maintenance:    {stats['avg_microseconds_per_event']:8.1f} us/event, "
+          f"{stats['avg_chars_per_event']:.0f} chars/event indexed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full-text index ingest cost.")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.batch_size))
@@ -0,0 +1,200 @@
+"""
+Measures dashboard WebSocket bandwidth per event.
+
+Usage:
+    python benchmark_websocket.py [--events 2000] [--batch-size 100]
+
+Starts the app under uvicorn on a scratch SQLite database and connects four
+dashboard clients to /ws: full and summary subscriptions, each with and
+without permessage-deflate. Every client connects through a local TCP relay
+that counts the bytes the server sends it, so the figures are wire bytes
+(frame headers and compression included). It then ingests synthetic events
+through POST /logs/ingest/batch and prints the average bytes per
+event_created message for each client.
+Requires the `websockets` package (installed with uvicorn[standard]).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+
+# Point the app at a scratch database before any project module reads the environment
+BENCH_DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix="aegis-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DATABASE_FILE}"
+os.environ.pop("AGENT_API_KEY", None)
+# Every client must receive every event, however fast they are ingested
+os.environ["WS_SEND_QUEUE_SIZE"] = "1000000"
+
+import httpx
+import uvicorn
+from websockets.asyncio.client import connect
+
+from app import app
+
+EVENT_TYPES = ["process_created", "network_connection", "registry_change"]
+SEVERITIES = ["low", "low", "low", "medium", "high", "critical"]
+PROCESSES = ["svchost.exe", "powershell.exe", "cmd.exe", "chrome.exe", "explorer.exe", "OneDrive.exe"]
+
+CLIENTS = [
+    ("full", False),
+    ("full", True),
+    ("summary", False),
+    ("summary", True),
+]
+
+
+def make_details(rng: random.Random, event_type: str) -> dict:
+    process = rng.choice(PROCESSES)
+    if event_type == "network_connection":
+        return {
+            "direction": "established",
+            "protocol": "tcp",
+            "local_address": "192.168.1.20",
+            "local_port": rng.randint(49152, 65535),
+            "remote_address": f"10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+            "remote_port": rng.choice([80, 443, 445, 3389]),
+            "state": "Established",
+            "process_name": process,
+        }
+    if event_type == "registry_change":
+        return {
+            "change_type": rng.choice(["created", "modified", "deleted"]),
+            "registry_path": "HKLM\\Software\\Microsoft\\Windows\\CurrentVersion\\Run",
+            "value_name": f"Updater{rng.randint(0, 20)}",
+            "value_data": f"C:\\Program Files\\Vendor{rng.randint(0, 9)}\\{process}",
+            "description": "Registry autorun entry changed",
+        }
+    return {
+        "process_name": process,
+        "process_id": rng.randint(100, 30000),
+        "parent_process_name": rng.choice(PROCESSES),
+        "executable_path": f"C:\\Windows\\System32\\{process}",
+        "command_line": f"{process} -k netsvcs -p -s task{rng.randint(0, 500)}",
+        "user": f"CORP\\user{rng.randint(0, 50)}",
+        "start_time": f"2025-01-01T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z",
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class CountingRelay:
+    """TCP relay to the server that counts the bytes sent to the client."""
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.received = 0
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._relay, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+
+    async def _relay(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+
+        async def pipe(reader, writer, count: bool):
+            try:
+                while data := await reader.read(65536):
+                    if count:
+                        self.received += len(data)
+                    writer.write(data)
+                    await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        await asyncio.gather(pipe(client_reader, server_writer, False), pipe(server_reader, client_writer, True))
+
+
+async def watch(websocket, relay: CountingRelay, events: int, counted: asyncio.Event) -> int:
+    """Receives until `events` events arrived; returns the bytes received for them."""
+    baseline = relay.received
+    counted.set()
+    seen = 0
+    while seen < events:
+        message = json.loads(await websocket.recv())
+        if message.get("type") == "event_created":
+            seen += 1
+    return relay.received - baseline
+
+
+async def main(events: int, batch_size: int):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, ws="websockets", log_level="warning"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{port}/api/v1"
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+        response = await http.post("/nodes/register", json={"hostname": "bench", "ip_address": "127.0.0.1"})
+        node_id = response.json()["id"]
+
+        relays, sockets, watchers = [], [], []
+        for mode, deflate in CLIENTS:
+            relay = CountingRelay(port)
+            await relay.start()
+            websocket = await connect(
+                f"ws://127.0.0.1:{relay.port}/ws",
+                compression="deflate" if deflate else None,
+                max_size=None,
+            )
+            await websocket.recv()  # hello
+            await websocket.send(json.dumps({"type": "subscribe", "filters": {}, "mode": mode}))
+            await websocket.recv()  # subscribed
+            counted = asyncio.Event()
+            watchers.append(asyncio.create_task(watch(websocket, relay, events, counted)))
+            await counted.wait()
+            relays.append(relay)
+            sockets.append(websocket)
+
+        rng = random.Random(42)
+        for offset in range(0, events, batch_size):
+            batch = []
+            for _ in range(min(batch_size, events - offset)):
+                event_type = rng.choice(EVENT_TYPES)
+                batch.append({
+                    "node_id": node_id,
+                    "event_type": event_type,
+                    "severity": rng.choice(SEVERITIES),
+                    "details": make_details(rng, event_type),
+                })
+            response = await http.post("/logs/ingest/batch", json={"events": batch})
+            response.raise_for_status()
+
+        totals = await asyncio.gather(*watchers)
+
+    print(f"{events} event_created messages, wire bytes per event (frame headers included)")
+    print(f"{'mode':<10}{'deflate':<10}{'bytes/event':>12}{'vs full':>10}")
+    baseline = totals[0] / events
+    for (mode, deflate), total in zip(CLIENTS, totals):
+        per_event = total / events
+        print(f"{mode:<10}{'yes' if deflate else 'no':<10}{per_event:>12.1f}{per_event / baseline:>10.1%}")
+
+    for websocket in sockets:
+        await websocket.close()
+    for relay in relays:
+        await relay.stop()
+    server.should_exit = True
+    await serve_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.batch_size))
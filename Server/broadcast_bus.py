@@ -0,0 +1,334 @@
+"""
+Broadcast Bus - Fans WebSocket broadcasts out to every worker process
+
+The dashboard ConnectionManager only knows the clients connected to its own
+process. With several uvicorn workers, each broadcast is also published on a
+bus, and every other worker delivers it to its own clients. Selected with
+WS_BUS:
+
+  - local: single process, nothing is published (default)
+  - unix:  workers on one host; each listens on a Unix socket in WS_BUS_PATH
+           and streams its broadcasts to the sockets of the others
+  - redis: workers on any number of hosts, through Redis PUBLISH/SUBSCRIBE on
+           WS_BUS_CHANNEL (requires the optional `redis` package; any server
+           speaking the Redis protocol works)
+
+publish() never waits: messages are queued and sent by a background task,
+several at a time. At most WS_BUS_QUEUE_SIZE messages wait to be sent; beyond
+that the oldest are dropped. A Unix socket peer that has not accepted a batch
+within WS_BUS_SEND_TIMEOUT seconds is disconnected (and reconnected at the
+next directory refresh), so one stalled worker cannot hold up the others.
+Every message is tagged with the publishing process, which
+ignores its own messages when they come back.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # The Redis bus is optional
+    aioredis = None
+
+# --- Configuration ---
+WS_BUS = os.getenv("WS_BUS", "local").lower()
+WS_BUS_PATH = os.getenv("WS_BUS_PATH", "/tmp/aegis-bus")
+WS_BUS_REDIS_URL = os.getenv("WS_BUS_REDIS_URL", "redis://localhost:6379/0")
+WS_BUS_CHANNEL = os.getenv("WS_BUS_CHANNEL", "aegis:broadcast")
+WS_BUS_QUEUE_SIZE = int(os.getenv("WS_BUS_QUEUE_SIZE", "10000"))
+WS_BUS_SEND_TIMEOUT = float(os.getenv("WS_BUS_SEND_TIMEOUT", "5"))
+
+# Identifies this process on the bus
+PROCESS_ID = uuid.uuid4().hex
+
+# Called with (message, attributes) for every message published by another process
+DeliverFn = Callable[[dict, Optional[dict]], None]
+
+
+def encode_envelope(message: dict, attributes: Optional[dict]) -> bytes:
+    return json.dumps({"origin": PROCESS_ID, "message": message, "attributes": attributes}).encode()
+
+
+class BroadcastBus:
+    """Single-process bus: nothing to publish, nothing to receive."""
+
+    name = "local"
+
+    def __init__(self, max_queue: int = 10000):
+        """
+        Args:
+            max_queue: Messages waiting to be sent at most (the oldest are dropped)
+        """
+        self.running = False
+        self.task = None
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._deliver: Optional[DeliverFn] = None
+        self._outbox: Optional[asyncio.Queue] = None
+
+    def publish(self, message: dict, attributes: Optional[dict] = None) -> None:
+        """Queues a broadcast for the other processes (returns immediately)."""
+        if self._outbox is None:
+            return
+        if self._outbox.full():
+            self._outbox.get_nowait()
+            self.dropped += 1
+        self._outbox.put_nowait(encode_envelope(message, attributes))
+
+    def _receive(self, data: bytes) -> None:
+        """Hands a message published by another process to the local clients."""
+        try:
+            envelope = json.loads(data)
+        except ValueError:
+            logger.warning("Ignoring malformed broadcast bus message")
+            return
+        if envelope.get("origin") != PROCESS_ID and self._deliver is not None:
+            self._deliver(envelope["message"], envelope.get("attributes"))
+
+    async def _next_batch(self) -> List[bytes]:
+        batch = [await self._outbox.get()]
+        while not self._outbox.empty():
+            batch.append(self._outbox.get_nowait())
+        return batch
+
+    async def start(self, deliver: DeliverFn):
+        """Start receiving messages from (and sending to) the other processes."""
+        self._deliver = deliver
+
+    async def stop(self):
+        """Stop the bus."""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.dropped:
+            logger.warning(f"Broadcast bus dropped {self.dropped} messages it could not send in time")
+
+
+# ==============================================================================
+# Unix sockets (one host)
+# ==============================================================================
+
+class UnixSocketBus(BroadcastBus):
+    """
+    Every worker listens on `<directory>/<process id>.sock` and keeps a
+    connection to the socket of every other worker, found by listing the
+    directory. Messages are newline-delimited JSON.
+    """
+
+    name = "unix"
+
+    def __init__(
+        self,
+        directory: str,
+        refresh_interval: float = 2.0,
+        send_timeout: float = 5.0,
+        max_queue: int = 10000,
+    ):
+        """
+        Args:
+            directory: Directory shared by the workers' sockets
+            refresh_interval: How often the directory is listed for new workers (seconds)
+            send_timeout: How long a peer may take to accept a batch before it is disconnected (seconds)
+            max_queue: Messages waiting to be sent at most (the oldest are dropped)
+        """
+        super().__init__(max_queue)
+        self.directory = directory
+        self.path = os.path.join(directory, f"{PROCESS_ID}.sock")
+        self.refresh_interval = refresh_interval
+        self.send_timeout = send_timeout
+        self._server = None
+        self._peers: Dict[str, asyncio.StreamWriter] = {}
+        self._readers: set = set()
+        self._last_refresh = 0.0
+
+    async def start(self, deliver: DeliverFn):
+        await super().start(deliver)
+        os.makedirs(self.directory, exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._on_peer, path=self.path)
+        self._outbox = asyncio.Queue(maxsize=self.max_queue)
+        self.running = True
+        self.task = asyncio.create_task(self._send_loop())
+        logger.info(f"Broadcast bus listening on {self.path}")
+
+    async def stop(self):
+        await super().stop()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for reader_task in list(self._readers):
+            reader_task.cancel()
+        for writer in self._peers.values():
+            writer.close()
+        self._peers.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._outbox = None
+
+    async def _on_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._readers.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._receive(line)
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._readers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _refresh_peers(self):
+        """Connects to workers that started since the last refresh."""
+        loop = asyncio.get_running_loop()
+        if loop.time() - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = loop.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or path == self.path or path in self._peers:
+                continue
+            try:
+                _, writer = await asyncio.open_unix_connection(path)
+                self._peers[path] = writer
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that exited without cleaning up
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                logger.warning(f"Could not connect to broadcast bus peer {path}: {e}")
+
+    async def _send_to_peer(self, path: str, writer: asyncio.StreamWriter, payload: bytes):
+        """Writes a batch to one peer, disconnecting it if it fails or stalls."""
+        try:
+            writer.write(payload)
+            await asyncio.wait_for(writer.drain(), self.send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Broadcast bus peer {path} stalled for {self.send_timeout}s; disconnecting it")
+        except (ConnectionError, OSError):
+            pass
+        else:
+            return
+        writer.close()
+        if self._peers.get(path) is writer:
+            del self._peers[path]
+
+    async def _send_loop(self):
+        while self.running:
+            try:
+                batch = await self._next_batch()
+                await self._refresh_peers()
+                payload = b"".join(data + b"\n" for data in batch)
+                # Concurrently, so a slow peer delays only itself
+                await asyncio.gather(*(
+                    self._send_to_peer(path, writer, payload)
+                    for path, writer in list(self._peers.items())
+                ))
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error publishing on the broadcast bus: {e}")
+
+
+# ==============================================================================
+# Redis (any number of hosts)
+# ==============================================================================
+
+class RedisBus(BroadcastBus):
+    """Publishes on and subscribes to one Redis pub/sub channel."""
+
+    name = "redis"
+
+    def __init__(self, url: str, channel: str, max_queue: int = 10000):
+        """
+        Args:
+            url: Redis server URL
+            channel: Pub/sub channel shared by the workers
+            max_queue: Messages waiting to be sent at most (the oldest are dropped)
+        """
+        super().__init__(max_queue)
+        self.url = url
+        self.channel = channel
+        self._client = None
+        self._pubsub = None
+        self._listener = None
+
+    async def start(self, deliver: DeliverFn):
+        await super().start(deliver)
+        self._client = aioredis.from_url(self.url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._outbox = asyncio.Queue(maxsize=self.max_queue)
+        self.running = True
+        self.task = asyncio.create_task(self._send_loop())
+        self._listener = asyncio.create_task(self._listen_loop())
+        logger.info(f"Broadcast bus subscribed to Redis channel '{self.channel}'")
+
+    async def stop(self):
+        await super().stop()
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+        self._outbox = None
+
+    async def _send_loop(self):
+        while self.running:
+            try:
+                batch = await self._next_batch()
+                async with self._client.pipeline(transaction=False) as pipe:
+                    for data in batch:
+                        pipe.publish(self.channel, data)
+                    await pipe.execute()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error publishing on the broadcast bus: {e}")
+
+    async def _listen_loop(self):
+        while self.running:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") == "message":
+                        self._receive(message["data"])
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error receiving from the broadcast bus: {e}")
+                await asyncio.sleep(1)
+
+
+def create_bus() -> BroadcastBus:
+    """Builds the bus selected by WS_BUS."""
+    if WS_BUS == "unix":
+        return UnixSocketBus(WS_BUS_PATH, send_timeout=WS_BUS_SEND_TIMEOUT, max_queue=WS_BUS_QUEUE_SIZE)
+    if WS_BUS == "redis":
+        if aioredis is None:
+            logger.error("WS_BUS=redis requires the 'redis' package; broadcasts stay local to each worker")
+            return BroadcastBus()
+        return RedisBus(WS_BUS_REDIS_URL, WS_BUS_CHANNEL, max_queue=WS_BUS_QUEUE_SIZE)
+    if WS_BUS != "local":
+        logger.error(f"Unknown WS_BUS '{WS_BUS}'; broadcasts stay local to each worker")
+    return BroadcastBus()
+
+
+# Global instance
+broadcast_bus = create_bus()
@@ -0,0 +1,94 @@
+"""
+Checks that the WAL-mode write queue really group-commits its batches.
+
+Runs against a throwaway database in a temporary directory. Three writes are
+queued as one batch:
+
+  1. registers node "batch-1"
+  2. checks, on a reader connection, that node "batch-1" is NOT visible yet
+     (the batch has not committed), then registers node "batch-2"
+  3. registers a node and then fails (only its own SAVEPOINT is rolled back)
+
+Afterwards both "batch-1" and "batch-2" must be visible and the failed node
+must not be. Exits with status 1 if any check fails.
+
+Usage:
+    python check_write_batching.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp.name, 'check.db')}"
+os.environ["SQLITE_STORAGE_MODE"] = "wal"
+# Long enough for all three writes to land in one batch
+os.environ["WRITE_BATCH_WINDOW_MS"] = "200"
+
+from sqlalchemy import select  # noqa: E402
+
+import models  # noqa: E402
+from db import ReadSessionLocal, engine, read_engine, write_queue  # noqa: E402
+from models import Base  # noqa: E402
+
+
+async def _visible(hostname: str) -> bool:
+    async with ReadSessionLocal() as session:
+        result = await session.execute(select(models.Node.id).where(models.Node.hostname == hostname))
+        return result.scalar_one_or_none() is not None
+
+
+def _node(hostname: str) -> models.Node:
+    return models.Node(hostname=hostname, ip_address=hostname, status="online")
+
+
+async def main() -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await write_queue.start()
+    failures = []
+
+    async def first(session):
+        session.add(_node("batch-1"))
+        await session.flush()
+
+    async def second(session):
+        if await _visible("batch-1"):
+            failures.append("a reader saw the first write before the batch committed")
+        session.add(_node("batch-2"))
+        await session.flush()
+
+    async def failing(session):
+        session.add(_node("batch-failed"))
+        await session.flush()
+        raise RuntimeError("expected failure")
+
+    results = await asyncio.gather(
+        write_queue.submit(first),
+        write_queue.submit(second),
+        write_queue.submit(failing),
+        return_exceptions=True,
+    )
+    await write_queue.stop()
+
+    if not isinstance(results[2], RuntimeError):
+        failures.append("the failing write did not report its error")
+    for hostname in ("batch-1", "batch-2"):
+        if not await _visible(hostname):
+            failures.append(f"{hostname} is missing after the batch committed")
+    if await _visible("batch-failed"):
+        failures.append("the failed write was committed")
+
+    await engine.dispose()
+    await read_engine.dispose()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK: the batch was committed as one transaction")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
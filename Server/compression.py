@@ -0,0 +1,201 @@
+"""
+Compression - Optional zstd compression of event details
+
+With DETAILS_COMPRESSION=zstd (SQLite only; requires the `zstandard`
+package), the JSON details of each event are stored as a zstd frame instead of
+JSON text. Events of the same type repeat the same keys and many of the same
+values, so after the first DETAILS_DICT_SAMPLES events of a type a zstd
+dictionary is trained on them (in a worker thread), stored in the
+`details_dictionaries` table, and used for every later event of that type.
+Payloads smaller than DETAILS_COMPRESSION_MIN_BYTES stay plain JSON.
+
+Blobs are returned from the database undecoded and only decompressed when the
+details are actually read (API responses, exports), via `expand()`. Each zstd
+frame records the ID of its dictionary, so decoding needs no event type.
+
+PostgreSQL stores details as JSONB, whose large values are already compressed
+by TOAST, so the option is ignored there. See benchmark_compression.py for
+size, ingest and read cost against plain JSON.
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, Iterable, List, Set
+
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from db import AsyncSessionLocal, IS_POSTGRES, write_queue
+
+try:
+    import zstandard
+except ImportError:  # Compression is optional
+    zstandard = None
+
+# --- Configuration ---
+DETAILS_COMPRESSION = os.getenv("DETAILS_COMPRESSION", "none").lower()
+DETAILS_COMPRESSION_LEVEL = int(os.getenv("DETAILS_COMPRESSION_LEVEL", "3"))
+DETAILS_COMPRESSION_MIN_BYTES = int(os.getenv("DETAILS_COMPRESSION_MIN_BYTES", "64"))
+DETAILS_DICT_SIZE = int(os.getenv("DETAILS_DICT_SIZE", "16384"))
+DETAILS_DICT_SAMPLES = int(os.getenv("DETAILS_DICT_SAMPLES", "1000"))
+
+
+class DetailsCodec:
+    """Compresses event details per event type and decodes them on read."""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        level: int = 3,
+        min_bytes: int = 64,
+        dict_size: int = 16384,
+        dict_samples: int = 1000,
+    ):
+        """
+        Args:
+            enabled: Compress details of newly ingested events
+            level: zstd compression level
+            min_bytes: Serialized details smaller than this are stored as plain JSON
+            dict_size: Target size of each trained dictionary (bytes)
+            dict_samples: Events of a type collected before its dictionary is trained
+        """
+        if enabled and zstandard is None:
+            logger.error("DETAILS_COMPRESSION=zstd requires the 'zstandard' package; storing details uncompressed")
+            enabled = False
+        if enabled and IS_POSTGRES:
+            logger.info("DETAILS_COMPRESSION is ignored on PostgreSQL (JSONB values are compressed by TOAST)")
+            enabled = False
+        self.enabled = enabled
+        self.level = level
+        self.min_bytes = min_bytes
+        self.dict_size = dict_size
+        self.dict_samples = dict_samples
+
+        # Decompressors by frame dictionary ID (0 = no dictionary), compressors by event type
+        self._decompressors: Dict[int, Any] = {}
+        self._compressors: Dict[str, Any] = {}
+        self._plain_compressor = None
+        if zstandard is not None:
+            self._decompressors[0] = zstandard.ZstdDecompressor()
+            self._plain_compressor = zstandard.ZstdCompressor(level=level)
+
+        self._samples: Dict[str, List[bytes]] = {}
+        self._training: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    # --------------------------------------------------------------------------
+    # Encoding (ingest)
+    # --------------------------------------------------------------------------
+
+    def encode(self, event_type: str, details: Any) -> Any:
+        """
+        Returns the value to store for an event's details: a zstd frame, or
+        the details unchanged when compression is off or not worth it.
+        """
+        if not self.enabled or details is None:
+            return details
+        raw = json.dumps(details).encode()
+        if len(raw) < self.min_bytes:
+            return details
+        compressor = self._compressors.get(event_type)
+        if compressor is None:
+            self._collect_sample(event_type, raw)
+            compressor = self._plain_compressor
+        return compressor.compress(raw)
+
+    def _collect_sample(self, event_type: str, raw: bytes) -> None:
+        if event_type in self._training:
+            return
+        samples = self._samples.setdefault(event_type, [])
+        samples.append(raw)
+        if len(samples) >= self.dict_samples:
+            del self._samples[event_type]
+            self._training.add(event_type)
+            task = asyncio.create_task(self.train(event_type, samples))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def train(self, event_type: str, samples: List[bytes]) -> None:
+        """Trains, stores and activates the dictionary for `event_type`."""
+        try:
+            dictionary = await asyncio.to_thread(
+                zstandard.train_dictionary, self.dict_size, samples, level=self.level
+            )
+            dict_id, data = dictionary.dict_id(), dictionary.as_bytes()
+
+            async def _store(session: AsyncSession) -> None:
+                session.add(models.DetailsDictionary(id=dict_id, event_type=event_type, data=data))
+
+            await write_queue.submit(_store)
+            self._register(dict_id, event_type, data)
+            logger.info(f"Trained details dictionary {dict_id} for '{event_type}' from {len(samples)} events")
+        except Exception as e:
+            logger.error(f"Could not train details dictionary for '{event_type}': {e}")
+        finally:
+            self._training.discard(event_type)
+
+    def _register(self, dict_id: int, event_type: str, data: bytes) -> None:
+        dictionary = zstandard.ZstdCompressionDict(data)
+        self._decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        self._compressors[event_type] = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+
+    # --------------------------------------------------------------------------
+    # Decoding (reads)
+    # --------------------------------------------------------------------------
+
+    def expand(self, value: Any) -> Any:
+        """Returns the details for a stored value, decompressing it if needed."""
+        if not isinstance(value, bytes):
+            return value
+        if zstandard is None:
+            raise RuntimeError("Compressed event details require the 'zstandard' package")
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            raise LookupError(f"Details dictionary {dict_id} is not loaded")
+        return json.loads(decompressor.decompress(value))
+
+    async def load(self, session: AsyncSession) -> None:
+        """Loads every stored dictionary (the newest per event type is used for compression)."""
+        if zstandard is None:
+            return
+        result = await session.execute(
+            select(models.DetailsDictionary).order_by(models.DetailsDictionary.created_at)
+        )
+        for dictionary in result.scalars():
+            self._register(dictionary.id, dictionary.event_type, dictionary.data)
+
+    async def ensure_dictionaries(self, session: AsyncSession, values: Iterable[Any]) -> None:
+        """
+        Reloads the dictionaries if any of `values` was compressed with one
+        this process has not seen (e.g. trained by another worker).
+        """
+        if zstandard is None:
+            return
+        for value in values:
+            if isinstance(value, bytes) and zstandard.get_frame_parameters(value).dict_id not in self._decompressors:
+                await self.load(session)
+                return
+
+    async def start(self):
+        """Load the stored dictionaries."""
+        async with AsyncSessionLocal() as session:
+            await self.load(session)
+
+    async def stop(self):
+        """Wait for any dictionary still being trained."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# Global instance
+details_codec = DetailsCodec(
+    enabled=DETAILS_COMPRESSION == "zstd",
+    level=DETAILS_COMPRESSION_LEVEL,
+    min_bytes=DETAILS_COMPRESSION_MIN_BYTES,
+    dict_size=DETAILS_DICT_SIZE,
+    dict_samples=DETAILS_DICT_SAMPLES,
+)
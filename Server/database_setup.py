@@ -7,16 +7,15 @@ import asyncio
 import sys
 from sqlalchemy import select
 
-from db import engine, AsyncSessionLocal
-from models import Base, User
+from db import engine, init_db, AsyncSessionLocal
+from models import User
 from authentication import generate_password, hash_password
 
 
 async def create_tables():
     """Create all database tables."""
     print("Creating database tables...")
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await init_db()
     print("[OK] Tables created successfully")
 
 
@@ -1,8 +1,13 @@
 # db.py
 
+import asyncio
+import logging
 import os
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Awaitable, Callable, List, Optional, Tuple, TypeVar
 
+from dotenv import load_dotenv
+from sqlalchemy import Table, event, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -13,22 +18,145 @@ from sqlalchemy.ext.asyncio import (
 # and inherit from a common 'Base' declarative base class.
 from models import Base
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
 # --- Database Configuration ---
 
 # Use an environment variable for the database file, with a sensible default.
 DATABASE_FILE = os.getenv("DATABASE_FILE", "aegis.db")
-SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///./{DATABASE_FILE}"
+
+# DATABASE_URL selects the backend. Unset, it falls back to the local SQLite file.
+# Driverless URLs are mapped onto the async drivers: sqlite:// onto aiosqlite and
+# postgresql:// (or postgres://) onto asyncpg.
+DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
+
+
+_ASYNC_DRIVER_PREFIXES = {
+    "sqlite://": "sqlite+aiosqlite://",
+    "postgres://": "postgresql+asyncpg://",
+    "postgresql://": "postgresql+asyncpg://",
+}
+
+
+def _normalize_database_url(url: str) -> str:
+    """Maps driverless database URLs onto their asyncio drivers."""
+    for prefix, async_prefix in _ASYNC_DRIVER_PREFIXES.items():
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+SQLALCHEMY_DATABASE_URL = _normalize_database_url(DATABASE_URL) or f"sqlite+aiosqlite:///./{DATABASE_FILE}"
+DATABASE_BACKEND = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name()
+IS_SQLITE = DATABASE_BACKEND == "sqlite"
+IS_POSTGRES = DATABASE_BACKEND == "postgresql"
+
+# Connection pool tuning for server databases (ignored for SQLite).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Storage mode for SQLite:
+# - "single": one default engine shared by reads and writes (original behaviour).
+# - "wal":    WAL journaling, one dedicated writer connection that serializes and
+#             batches all writes, and a separate pool of read-only connections
+#             for dashboard queries. Readers never block the writer.
+SQLITE_STORAGE_MODE = os.getenv("SQLITE_STORAGE_MODE", "single").lower()
+SQLITE_READER_POOL_SIZE = int(os.getenv("SQLITE_READER_POOL_SIZE", "4"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Group commit: how many queued writes share one transaction, and how long the
+# writer waits for more work before committing a partial batch.
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "256"))
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", "2"))
+
+WAL_MODE = IS_SQLITE and SQLITE_STORAGE_MODE == "wal"
 
 # --- SQLAlchemy Engine and Session Setup ---
 
 # Create the asynchronous engine for SQLAlchemy.
 # - echo=False is recommended for production to avoid logging every SQL statement.
 # - future=True is the default in SQLAlchemy 2.0 and enables the new API style.
+# In WAL mode this is the writer engine: a single pooled connection, so every
+# write in the process is serialized without contending for the file lock.
+if IS_SQLITE:
+    _engine_options = {"pool_size": 1, "max_overflow": 0} if WAL_MODE else {}
+else:
+    # Server databases handle concurrent writers natively; size the pool instead.
+    _engine_options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
 engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     echo=False,  # Set to True for debugging SQL queries
+    **_engine_options,
 )
 
+# In WAL mode, dashboard queries get their own pool of read-only connections.
+read_engine = (
+    create_async_engine(
+        SQLALCHEMY_DATABASE_URL,
+        echo=False,
+        pool_size=SQLITE_READER_POOL_SIZE,
+        max_overflow=0,
+    )
+    if WAL_MODE
+    else engine
+)
+
+
+def _apply_sqlite_pragmas(dbapi_connection, read_only: bool) -> None:
+    """Tunes a freshly opened SQLite connection for the WAL storage mode."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    if not read_only:
+        # journal_mode is persistent in the file; setting it on the writer is enough.
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    # Negative cache_size is interpreted by SQLite as KiB rather than pages.
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if WAL_MODE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_writer_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection, read_only=False)
+        # pysqlite's legacy transaction handling only BEGINs before DML, so a
+        # SAVEPOINT would open (and its RELEASE commit) the transaction itself
+        # and DDL would autocommit. Take over transaction control instead
+        # (SQLAlchemy's pysqlite/aiosqlite SAVEPOINT recipe).
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _on_writer_begin(conn):
+        # IMMEDIATE takes the write lock up front, so writers of other worker
+        # processes wait for it instead of failing with SQLITE_BUSY on upgrade
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_reader_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection, read_only=True)
+
+
 # Create an async session factory (SessionLocal).
 # This factory will be used to create new AsyncSession objects for each request.
 # - expire_on_commit=False prevents attributes from being expired after commit,
@@ -41,17 +169,200 @@ AsyncSessionLocal = async_sessionmaker(
     autoflush=False,
 )
 
+# Session factory for read-only dashboard queries (same as AsyncSessionLocal
+# unless the WAL storage mode is enabled).
+ReadSessionLocal = async_sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autocommit=False,
+    autoflush=False,
+)
+
 
 async def init_db():
     """
     Initializes the database by creating all tables defined in the models.
     This function should be called during application startup (e.g., in a
-    FastAPI lifespan event).
+    FastAPI lifespan event) and by database_setup.py, so both set up the
+    same schema.
     """
+    # Imported here: these modules import db themselves
+    from fleet import ensure_fleet_version
+    from partitions import partition_manager
+    from search import search_index
+
     async with engine.begin() as conn:
         # The `run_sync` method allows running synchronous SQLAlchemy
         # functions (like metadata creation) within an async context.
+        # Partitioned event storage must be set up before the plain tables
+        await conn.run_sync(partition_manager.prepare_schema)
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(ensure_columns)
+        await conn.run_sync(ensure_indexes)
+        await conn.run_sync(ensure_fleet_version)
+        await conn.run_sync(search_index.prepare_schema)
+
+
+def add_missing_columns(sync_conn, table: Table) -> List[str]:
+    """
+    Adds the nullable columns of `table` that an existing database table lacks.
+
+    Returns:
+        The names of the columns that were added
+    """
+    inspector = inspect(sync_conn)
+    if not inspector.has_table(table.name):
+        return []
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    preparer = sync_conn.dialect.identifier_preparer
+    added = []
+    for column in table.columns:
+        if column.name in existing or not column.nullable:
+            continue
+        sync_conn.exec_driver_sql(
+            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+            f"{preparer.format_column(column)} {column.type.compile(dialect=sync_conn.dialect)}"
+        )
+        added.append(column.name)
+    if added:
+        logger.info(f"Added columns to {table.name}: {', '.join(added)}")
+    return added
+
+
+def ensure_columns(sync_conn) -> None:
+    """
+    Adds nullable columns declared on the models that are missing from an
+    existing database (create_all() does not alter existing tables).
+    """
+    for table in Base.metadata.sorted_tables:
+        add_missing_columns(sync_conn, table)
+
+
+def ensure_indexes(sync_conn) -> None:
+    """
+    Creates any index declared on the models that is missing from an existing
+    database (create_all() skips tables that already exist, indexes included).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+async def dispose_engines():
+    """Closes every pooled connection of the writer and reader engines."""
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
+# --- Batched Writer ---
+
+WriteFn = Callable[[AsyncSession], Awaitable[T]]
+
+
+class WriteQueue:
+    """
+    Serializes writes onto the writer engine and commits them in batches.
+
+    Callers submit an async function that receives a session, performs its
+    writes (flushing if it needs generated values such as IDs) and returns a
+    result. In WAL mode a single background task drains the queue, runs each
+    function inside its own SAVEPOINT so one failing write does not poison
+    the others, and commits the whole batch at once. When the queue is not
+    running (single mode, scripts, tests) each write gets its own session and
+    commit, exactly as before.
+    """
+
+    def __init__(self, max_batch: int = 256, window_ms: float = 2.0):
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.running = False
+        self.task = None
+        self._queue: Optional[asyncio.Queue] = None
+
+    async def submit(self, fn: "WriteFn[T]") -> T:
+        """Runs `fn` in a write transaction and returns its result once committed."""
+        if not self.running:
+            async with AsyncSessionLocal() as session:
+                result = await fn(session)
+                await session.commit()
+                return result
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, future))
+        return await future
+
+    async def start(self):
+        """Start the writer task (only used in the WAL storage mode)."""
+        if self.running or not WAL_MODE:
+            return
+        self._queue = asyncio.Queue()
+        self.running = True
+        self.task = asyncio.create_task(self._writer_loop())
+        logger.info(f"WriteQueue started: max_batch={self.max_batch}, window={self.window * 1000:.1f}ms")
+
+    async def stop(self):
+        """Stop the writer task after draining any queued writes."""
+        if not self.running:
+            return
+        self.running = False
+        await self._queue.put(None)
+        if self.task:
+            await self.task
+        logger.info("WriteQueue stopped")
+
+    async def _collect_batch(self) -> Tuple[List[tuple], bool]:
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = asyncio.get_running_loop().time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            try:
+                item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _writer_loop(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect_batch()
+            if batch:
+                await self._run_batch(batch)
+
+    async def _run_batch(self, batch: List[tuple]):
+        outcomes = []
+        async with AsyncSessionLocal() as session:
+            try:
+                for fn, future in batch:
+                    try:
+                        async with session.begin_nested():
+                            outcomes.append((future, await fn(session), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Batched write of {len(batch)} operations failed: {e}")
+                await session.rollback()
+                outcomes = [(future, None, e) for _, future in batch]
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+# Global write queue instance
+write_queue = WriteQueue(max_batch=WRITE_BATCH_SIZE, window_ms=WRITE_BATCH_WINDOW_MS)
 
 
 # --- FastAPI Dependency ---
@@ -80,4 +391,18 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             raise
         finally:
             # The session is automatically closed on exiting the `async with` block.
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    FastAPI dependency that provides a read-only session for dashboard queries.
+
+    In the WAL storage mode the session is served from the reader pool, so
+    long dashboard queries never hold the writer connection.
+    """
+    async with ReadSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
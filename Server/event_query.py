@@ -0,0 +1,98 @@
+"""
+Event Query - Filters shared by the event listing and export endpoints
+
+`EventFilters` is a FastAPI dependency holding the filter query parameters
+accepted by `GET /logs`, so every endpoint that reads raw events exposes the
+same filter set and applies it the same way.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Query
+from sqlalchemy import Select, select
+
+from models import InternedString
+from promoted import INTERNED_FIELDS, PROMOTED_COLUMNS
+from search import search_index
+
+
+class EventFilters:
+    """Filter query parameters for raw event queries."""
+
+    def __init__(
+        self,
+        node_id: Optional[int] = Query(None, description="Filter events by a specific Node ID."),
+        severity: Optional[str] = Query(None, description="Filter events by severity (e.g., 'high', 'medium')."),
+        event_type: Optional[str] = Query(None, description="Filter by a specific event type."),
+        start_time: Optional[datetime] = Query(None, description="The start of the time range to query (ISO 8601 format)."),
+        end_time: Optional[datetime] = Query(None, description="The end of the time range to query (ISO 8601 format)."),
+        search: Optional[str] = Query(None, description="Only events whose details contain all of these words (full-text search)."),
+        # --- Promoted details fields (indexed columns) ---
+        # Longer values are never promoted, so they are rejected rather than matching nothing
+        process_name: Optional[str] = Query(
+            None, max_length=PROMOTED_COLUMNS["process_name"][1], description="Filter by details process name."
+        ),
+        parent_process_name: Optional[str] = Query(
+            None, max_length=PROMOTED_COLUMNS["parent_process_name"][1], description="Filter by details parent process name."
+        ),
+        process_path: Optional[str] = Query(
+            None, max_length=PROMOTED_COLUMNS["process_path"][1], description="Filter by details process/executable path."
+        ),
+        destination_ip: Optional[str] = Query(
+            None, max_length=PROMOTED_COLUMNS["destination_ip"][1], description="Filter by details destination (remote) IP address."
+        ),
+        destination_port: Optional[int] = Query(None, description="Filter by details destination (remote) port."),
+        registry_key: Optional[str] = Query(
+            None, max_length=PROMOTED_COLUMNS["registry_key"][1], description="Filter by details registry key."
+        ),
+    ):
+        self.node_id = node_id
+        self.severity = severity
+        self.event_type = event_type
+        self.start_time = start_time
+        self.end_time = end_time
+        self.search = search
+        self.promoted = {
+            "process_name": process_name,
+            "parent_process_name": parent_process_name,
+            "process_path": process_path,
+            "destination_ip": destination_ip,
+            "destination_port": destination_port,
+            "registry_key": registry_key,
+        }
+
+    def apply(self, stmt: Select, Event) -> Select:
+        """
+        Adds the WHERE clauses for the set filters to `stmt`.
+
+        Args:
+            stmt: The SELECT to filter
+            Event: The event entity being selected from (`models.Event` or a
+                partition alias returned by `partition_manager.event_source`)
+
+        Returns:
+            The filtered SELECT
+        """
+        if self.node_id is not None:
+            stmt = stmt.where(Event.node_id == self.node_id)
+        if self.severity is not None:
+            stmt = stmt.where(Event.severity == self.severity)
+        if self.event_type is not None:
+            stmt = stmt.where(Event.event_type == self.event_type)
+        if self.start_time is not None:
+            stmt = stmt.where(Event.timestamp >= self.start_time)
+        if self.end_time is not None:
+            stmt = stmt.where(Event.timestamp <= self.end_time)
+        for field, value in self.promoted.items():
+            if value is None:
+                continue
+            if field in INTERNED_FIELDS:
+                # Resolved to the interned string ID by a unique index lookup
+                string_id = select(InternedString.id).where(InternedString.value == value).scalar_subquery()
+                stmt = stmt.where(getattr(Event, INTERNED_FIELDS[field]) == string_id)
+            else:
+                stmt = stmt.where(getattr(Event, field) == value)
+        if self.search and self.search.strip():
+            stmt = stmt.where(search_index.match(Event, self.search))
+        return stmt
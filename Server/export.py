@@ -0,0 +1,196 @@
+"""
+Export - Streaming bulk export of stored events
+
+Events are read with a server-side cursor (`AsyncSession.stream` with
+`yield_per`) and encoded one chunk at a time, so an export of millions of rows
+uses the same memory as an export of a thousand. Supported formats:
+
+  - ndjson:  one JSON object per line
+  - csv:     header row plus one row per event; `details` is a JSON string
+  - parquet: one row group per chunk (requires the optional `pyarrow` package)
+
+The API endpoint (`GET /logs/export`) and the `export_events.py` CLI both use
+`stream_events`.
+"""
+
+import csv
+import io
+import json
+import os
+from typing import AsyncIterator, List, Sequence
+
+from sqlalchemy import select
+
+from compression import details_codec
+from db import ReadSessionLocal
+from event_query import EventFilters
+from partitions import partition_manager
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+# --- Configuration ---
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+EXPORT_COLUMNS = ("id", "timestamp", "node_id", "event_type", "severity", "details")
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def parquet_available() -> bool:
+    """Whether the optional pyarrow dependency is installed."""
+    return pyarrow is not None
+
+
+# ==============================================================================
+# Encoders
+# ==============================================================================
+# Each encoder turns a chunk of result rows into bytes and emits any trailer
+# (e.g. the Parquet footer) from finish().
+
+class NDJSONEncoder:
+    def encode(self, rows: Sequence) -> bytes:
+        lines = [
+            json.dumps({
+                "id": row.id,
+                "timestamp": row.timestamp.isoformat(),
+                "node_id": row.node_id,
+                "event_type": row.event_type,
+                "severity": row.severity,
+                "details": details_codec.expand(row.details),
+            })
+            for row in rows
+        ]
+        lines.append("")
+        return "\n".join(lines).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class CSVEncoder:
+    def __init__(self):
+        self._header_written = False
+
+    def encode(self, rows: Sequence) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self._header_written:
+            writer.writerow(EXPORT_COLUMNS)
+            self._header_written = True
+        writer.writerows(
+            (row.id, row.timestamp.isoformat(), row.node_id, row.event_type,
+             row.severity, json.dumps(details_codec.expand(row.details)))
+            for row in rows
+        )
+        return buffer.getvalue().encode()
+
+    def finish(self) -> bytes:
+        # An empty export still gets a header row
+        return b"" if self._header_written else self.encode([])
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ParquetEncoder:
+    def __init__(self):
+        self._schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("timestamp", pyarrow.timestamp("us")),
+            ("node_id", pyarrow.int64()),
+            ("event_type", pyarrow.string()),
+            ("severity", pyarrow.string()),
+            ("details", pyarrow.string()),
+        ])
+        self._sink = _ChunkSink()
+        self._writer = pyarrow.parquet.ParquetWriter(
+            pyarrow.PythonFile(self._sink, mode="w"), self._schema
+        )
+
+    def encode(self, rows: Sequence) -> bytes:
+        batch = pyarrow.record_batch(
+            [
+                [row.id for row in rows],
+                [row.timestamp for row in rows],
+                [row.node_id for row in rows],
+                [row.event_type for row in rows],
+                [row.severity for row in rows],
+                [json.dumps(details_codec.expand(row.details)) for row in rows],
+            ],
+            schema=self._schema,
+        )
+        self._writer.write_batch(batch)
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {
+    "ndjson": NDJSONEncoder,
+    "csv": CSVEncoder,
+    "parquet": ParquetEncoder,
+}
+
+
+# ==============================================================================
+# Streaming
+# ==============================================================================
+
+async def stream_events(
+    filters: EventFilters,
+    fmt: str = "ndjson",
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Yields the encoded export of all events matching `filters`, oldest first.
+
+    The generator owns its read session so it stays open for as long as the
+    response is being streamed, after the request handler has returned.
+
+    Args:
+        filters: The event filters to apply
+        fmt: One of EXPORT_MEDIA_TYPES
+        chunk_size: Rows fetched from the cursor and encoded at a time
+    """
+    encoder = ENCODERS[fmt]()
+    async with ReadSessionLocal() as session:
+        Event = await partition_manager.event_source(session, filters.start_time, filters.end_time)
+        stmt = filters.apply(select(*(getattr(Event, column) for column in EXPORT_COLUMNS)), Event)
+        stmt = stmt.order_by(Event.timestamp, Event.id).execution_options(yield_per=chunk_size)
+
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            await details_codec.ensure_dictionaries(session, (row.details for row in rows))
+            yield encoder.encode(rows)
+    yield encoder.finish()
@@ -0,0 +1,61 @@
+"""
+Bulk-exports stored events straight from the database.
+
+Usage:
+    python export_events.py --format csv --node-id 3 --start-time 2025-01-01T00:00:00 -o node3.csv
+    python export_events.py --severity high > high.ndjson
+
+Reads through the same server-side cursor as `GET /logs/export`, so memory use
+stays constant regardless of how many events are exported.
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+import export
+from event_query import EventFilters
+from promoted import PROMOTED_COLUMNS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export stored events as NDJSON, CSV or Parquet.")
+    parser.add_argument("--format", choices=sorted(export.EXPORT_MEDIA_TYPES), default="ndjson")
+    parser.add_argument("--node-id", type=int)
+    parser.add_argument("--severity")
+    parser.add_argument("--event-type")
+    parser.add_argument("--start-time", type=datetime.fromisoformat, help="ISO 8601 timestamp")
+    parser.add_argument("--end-time", type=datetime.fromisoformat, help="ISO 8601 timestamp")
+    parser.add_argument("--search", help="Only events whose details contain all of these words")
+    for column, (python_type, _) in PROMOTED_COLUMNS.items():
+        parser.add_argument(f"--{column.replace('_', '-')}", type=python_type)
+    parser.add_argument("--chunk-size", type=int, default=export.EXPORT_CHUNK_SIZE)
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    return parser.parse_args()
+
+
+async def export_events(args):
+    filters = EventFilters(
+        node_id=args.node_id,
+        severity=args.severity,
+        event_type=args.event_type,
+        start_time=args.start_time,
+        end_time=args.end_time,
+        search=args.search,
+        **{column: getattr(args, column) for column in PROMOTED_COLUMNS},
+    )
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in export.stream_events(filters, args.format, args.chunk_size):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.format == "parquet" and not export.parquet_available():
+        sys.exit("Parquet export requires the 'pyarrow' package (pip install pyarrow).")
+    asyncio.run(export_events(args))
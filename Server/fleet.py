@@ -0,0 +1,35 @@
+"""
+Fleet - Version counter of the node list
+
+`GET /nodes` answers `If-None-Match` from a version number instead of
+comparing node rows. The version lives in the one-row `fleet_version` table
+and is incremented in the same transaction as every change a node listing
+shows: registration, edits, deletion and status changes (online/offline).
+Heartbeats that only advance `last_seen` do not change it. Being stored in
+the database, it is shared by every worker process.
+"""
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+_fleet = models.fleet_version
+
+
+def ensure_fleet_version(sync_conn) -> None:
+    """Creates the version row if it does not exist yet."""
+    exists = sync_conn.execute(select(_fleet.c.id).where(_fleet.c.id == 1)).first()
+    if exists is None:
+        sync_conn.execute(insert(_fleet).values(id=1, version=0))
+
+
+async def bump_fleet_version(session: AsyncSession) -> None:
+    """Records a change to the node list (as part of the session's transaction)."""
+    await session.execute(update(_fleet).where(_fleet.c.id == 1).values(version=_fleet.c.version + 1))
+
+
+async def read_fleet_version(session: AsyncSession) -> int:
+    """Returns the current version of the node list."""
+    result = await session.execute(select(_fleet.c.version).where(_fleet.c.id == 1))
+    return result.scalar_one_or_none() or 0
@@ -1,47 +1,133 @@
 """
 Heartbeat Monitor - Background task to detect offline nodes
+
+Every online node has an expiry time (last heartbeat + timeout) kept in a
+min-heap. A heartbeat pushes the node's new deadline in O(log n); superseded
+entries stay in the heap and are skipped when they surface. The monitor
+sleeps until the earliest deadline, so a node goes offline close to its
+actual timeout rather than on the next table scan.
+
+Nodes expiring within `batch_window` of each other are handled together:
+one bulk UPDATE marks them offline and one `nodes_updated` WebSocket message
+announces them. The UPDATE only applies to nodes whose stored last_seen is
+also older than the timeout, so a node kept alive through another worker
+process is re-armed from the database instead. The online nodes are reloaded
+from the database every `resync_interval` to pick up such nodes.
 """
 
 import asyncio
+import heapq
+import os
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
 from loguru import logger
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import models
-from db import AsyncSessionLocal
+from db import ReadSessionLocal, write_queue
+from fleet import bump_fleet_version
+from heartbeats import heartbeat_buffer
 from websocket import manager
 
+# --- Configuration ---
+HEARTBEAT_TIMEOUT = int(os.getenv("HEARTBEAT_TIMEOUT", "90"))
+HEARTBEAT_RESYNC_INTERVAL = int(os.getenv("HEARTBEAT_RESYNC_INTERVAL", "600"))
+
+# Node IDs per UPDATE statement (keeps large batches under SQLite's variable limit)
+_UPDATE_CHUNK_SIZE = 1000
+
+_nodes_table = models.Node.__table__
+
 
 class HeartbeatMonitor:
     """Monitors node heartbeats and marks nodes offline if no heartbeat received."""
-    
-    def __init__(self, check_interval: int = 30, timeout: int = 90):
+
+    def __init__(self, timeout: int = 90, batch_window: float = 1.0, resync_interval: int = 600):
         """
         Args:
-            check_interval: How often to check for stale nodes (seconds)
             timeout: How long without heartbeat before marking offline (seconds)
+            batch_window: Nodes expiring this close together are marked offline together (seconds)
+            resync_interval: How often the online nodes are reloaded from the database (seconds)
         """
-        self.check_interval = check_interval
-        self.timeout = timeout
+        self.timeout = timedelta(seconds=timeout)
+        self.batch_window = batch_window
+        self.resync_interval = resync_interval
         self.running = False
         self.task = None
-    
+
+        # Current deadline per node, and a heap of (deadline, node_id) that may
+        # hold superseded entries
+        self._deadlines: Dict[int, datetime] = {}
+        self._heap: List[Tuple[datetime, int]] = []
+        self._wakeup = asyncio.Event()
+
+    # --------------------------------------------------------------------------
+    # Deadlines
+    # --------------------------------------------------------------------------
+
+    def touch(self, node_id: int, last_seen: Optional[datetime] = None) -> None:
+        """Records that a node was seen online at `last_seen` (default: now)."""
+        deadline = (last_seen or datetime.utcnow()) + self.timeout
+        current = self._deadlines.get(node_id)
+        if current is not None and current >= deadline:
+            return
+        self._deadlines[node_id] = deadline
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            # Drop superseded entries before they pile up
+            self._heap = [(node_deadline, node) for node, node_deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        else:
+            heapq.heappush(self._heap, (deadline, node_id))
+        if self._heap[0] == (deadline, node_id):
+            self._wakeup.set()
+
+    def forget(self, node_id: int) -> None:
+        """Stops tracking a deleted node."""
+        self._deadlines.pop(node_id, None)
+
+    def _pop_expired(self, now: datetime) -> List[int]:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, node_id = heapq.heappop(self._heap)
+            if self._deadlines.get(node_id) == deadline:
+                del self._deadlines[node_id]
+                expired.append(node_id)
+        return expired
+
+    async def _load(self, session: AsyncSession) -> None:
+        """Tracks every node the database lists as online."""
+        result = await session.execute(
+            select(models.Node.id, models.Node.last_seen).where(models.Node.status == "online")
+        )
+        for node_id, last_seen in result.all():
+            self.touch(node_id, last_seen)
+
+    # --------------------------------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------------------------------
+
     async def start(self):
         """Start the heartbeat monitoring task."""
         if self.running:
             logger.warning("HeartbeatMonitor is already running")
             return
-        
+
+        async with ReadSessionLocal() as session:
+            await self._load(session)
         self.running = True
         self.task = asyncio.create_task(self._monitor_loop())
-        logger.info(f"HeartbeatMonitor started: check_interval={self.check_interval}s, timeout={self.timeout}s")
-    
+        logger.info(
+            f"HeartbeatMonitor started: timeout={self.timeout.total_seconds():.0f}s, "
+            f"tracking {len(self._deadlines)} online nodes"
+        )
+
     async def stop(self):
         """Stop the heartbeat monitoring task."""
         if not self.running:
             return
-        
+
         self.running = False
         if self.task:
             self.task.cancel()
@@ -49,64 +135,114 @@ class HeartbeatMonitor:
                 await self.task
             except asyncio.CancelledError:
                 pass
-        
+
         logger.info("HeartbeatMonitor stopped")
-    
+
     async def _monitor_loop(self):
-        """Main monitoring loop."""
+        """Main monitoring loop: sleep until the next deadline, then expire nodes."""
+        loop = asyncio.get_running_loop()
+        next_resync = loop.time() + self.resync_interval
         while self.running:
             try:
-                await self._check_stale_nodes()
-                await asyncio.sleep(self.check_interval)
+                wait = next_resync - loop.time()
+                if self._heap:
+                    until_deadline = (self._heap[0][0] - datetime.utcnow()).total_seconds() + self.batch_window
+                    wait = min(wait, until_deadline)
+                self._wakeup.clear()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), wait)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+
+                expired = self._pop_expired(datetime.utcnow())
+                if expired:
+                    await self._mark_offline(expired)
+                if loop.time() >= next_resync:
+                    async with ReadSessionLocal() as session:
+                        await self._load(session)
+                    next_resync = loop.time() + self.resync_interval
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error in heartbeat monitor: {e}")
-                await asyncio.sleep(self.check_interval)
-    
-    async def _check_stale_nodes(self):
-        """Check for nodes that haven't sent heartbeats recently."""
-        async with AsyncSessionLocal() as session:
-            try:
-                # Calculate the cutoff time
-                cutoff_time = datetime.utcnow() - timedelta(seconds=self.timeout)
-                
-                # Find all nodes that are marked online but haven't updated recently
-                stmt = select(models.Node).where(
-                    models.Node.status == "online",
-                    models.Node.last_seen < cutoff_time
+                await asyncio.sleep(self.batch_window)
+
+    async def _mark_offline(self, node_ids: List[int]):
+        """Marks expired nodes offline in bulk and announces them in one message."""
+        cutoff = datetime.utcnow() - self.timeout
+
+        async def _update(session: AsyncSession):
+            marked, alive = [], []
+            for offset in range(0, len(node_ids), _UPDATE_CHUNK_SIZE):
+                chunk = node_ids[offset:offset + _UPDATE_CHUNK_SIZE]
+                # Only nodes that are stale in the database too; last_seen is
+                # written back unchanged so its onupdate default does not fire
+                stmt = (
+                    update(_nodes_table)
+                    .where(
+                        _nodes_table.c.id.in_(chunk),
+                        _nodes_table.c.status == "online",
+                        _nodes_table.c.last_seen < cutoff,
+                    )
+                    .values(status="offline", last_seen=_nodes_table.c.last_seen)
+                    .returning(
+                        _nodes_table.c.id, _nodes_table.c.hostname, _nodes_table.c.ip_address,
+                        _nodes_table.c.group, _nodes_table.c.last_seen,
+                    )
                 )
-                result = await session.execute(stmt)
-                stale_nodes = result.scalars().all()
-                
-                if stale_nodes:
-                    logger.info(f"Found {len(stale_nodes)} stale nodes")
-                    
-                    for node in stale_nodes:
-                        # Mark as offline
-                        node.status = "offline"
-                        logger.info(f"Node '{node.hostname}' marked offline (last seen: {node.last_seen})")
-                        
-                        # Broadcast status change via WebSocket
-                        await manager.broadcast({
-                            "type": "node_updated",
-                            "data": {
-                                "id": node.id,
-                                "hostname": node.hostname,
-                                "ip_address": node.ip_address,
-                                "group": node.group,
-                                "status": "offline",
-                                "last_seen": node.last_seen.isoformat() if node.last_seen else None,
-                            }
-                        })
-                    
-                    await session.commit()
-                    logger.info(f"Marked {len(stale_nodes)} nodes as offline")
-                
-            except Exception as e:
-                logger.error(f"Error checking stale nodes: {e}")
-                await session.rollback()
+                marked.extend((await session.execute(stmt)).all())
+                # Nodes still online in the database were seen through another worker
+                marked_ids = {row.id for row in marked}
+                remaining = [node_id for node_id in chunk if node_id not in marked_ids]
+                if remaining:
+                    result = await session.execute(
+                        select(models.Node.id, models.Node.last_seen).where(
+                            models.Node.id.in_(remaining), models.Node.status == "online"
+                        )
+                    )
+                    alive.extend(result.all())
+            if marked:
+                await bump_fleet_version(session)
+            return marked, alive
+
+        try:
+            marked, alive = await write_queue.submit(_update)
+        except Exception:
+            # Expire them again on the next round unless a heartbeat arrives first
+            for node_id in node_ids:
+                self.touch(node_id, cutoff)
+            raise
+        for node_id, last_seen in alive:
+            self.touch(node_id, last_seen)
+        # A heartbeat that arrived during the update re-armed the node; its
+        # flush will set it online again
+        marked = [row for row in marked if row.id not in self._deadlines]
+        if not marked:
+            return
+
+        for row in marked:
+            heartbeat_buffer.mark_offline(row.id)
+            logger.info(f"Node '{row.hostname}' marked offline (last seen: {row.last_seen})")
+        logger.info(f"Marked {len(marked)} nodes as offline")
+
+        # Broadcast all status changes via WebSocket in one message
+        await manager.broadcast({
+            "type": "nodes_updated",
+            "data": [
+                {
+                    "id": row.id,
+                    "hostname": row.hostname,
+                    "ip_address": row.ip_address,
+                    "group": row.group,
+                    "status": "offline",
+                    "last_seen": row.last_seen.isoformat() if row.last_seen else None,
+                }
+                for row in marked
+            ],
+        })
 
 
 # Global instance
-heartbeat_monitor = HeartbeatMonitor(check_interval=30, timeout=90)
+heartbeat_monitor = HeartbeatMonitor(timeout=HEARTBEAT_TIMEOUT, resync_interval=HEARTBEAT_RESYNC_INTERVAL)
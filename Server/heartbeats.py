@@ -0,0 +1,298 @@
+"""
+Heartbeats - Write-coalescing node liveness
+
+In the default "direct" mode every `POST /nodes/heartbeat` runs its own
+select, UPDATE and commit. With HEARTBEAT_MODE=coalesced, heartbeats are
+recorded in memory instead: the endpoint answers from an in-process copy of
+the node table without touching the database, and every
+HEARTBEAT_FLUSH_INTERVAL seconds the nodes that checked in since the last
+flush are written in one bulk UPDATE.
+
+Each heartbeat also re-arms the node's deadline in the HeartbeatMonitor, and
+GET /nodes overlays the unflushed heartbeats, so liveness stays accurate
+between flushes. Nodes registered by another worker process are looked up on
+their first heartbeat. Cached nodes are looked up again once their entry is
+HEARTBEAT_CACHE_TTL seconds old, so nodes deleted or renamed through another
+worker stop being answered from the cache. A flush that updates fewer rows
+than it had heartbeats also forgets the nodes that no longer exist.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import schemas
+from db import ReadSessionLocal, write_queue
+from fleet import bump_fleet_version
+
+# --- Configuration ---
+HEARTBEAT_MODE = os.getenv("HEARTBEAT_MODE", "direct").lower()
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "5"))
+HEARTBEAT_CACHE_TTL = float(os.getenv("HEARTBEAT_CACHE_TTL", "300"))
+
+_nodes_table = models.Node.__table__
+
+# One statement, executed with one parameter set per node
+_FLUSH_STMT = (
+    update(_nodes_table)
+    .where(_nodes_table.c.id == bindparam("node_id"))
+    .values(last_seen=bindparam("seen"), status="online")
+)
+
+
+class HeartbeatBuffer:
+    """Records heartbeats in memory and writes them to the database in bulk."""
+
+    def __init__(self, enabled: bool = False, flush_interval: float = 5.0, cache_ttl: float = 300.0):
+        """
+        Args:
+            enabled: Coalesce heartbeats (otherwise every component is a no-op)
+            flush_interval: How often recorded heartbeats are written (seconds)
+            cache_ttl: How long a cached node is trusted before it is read again (seconds)
+        """
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.running = False
+        self.task = None
+
+        # Cached node state by hostname, and hostname by node ID
+        self._nodes: Dict[str, schemas.NodeResponse] = {}
+        self._hostnames: Dict[int, str] = {}
+        # Node ID -> when its cached state was read (monotonic)
+        self._loaded: Dict[int, float] = {}
+        # Node ID -> last heartbeat not written to the database yet
+        self._pending: Dict[int, datetime] = {}
+        # Nodes brought back online in memory but still offline in the table
+        # (part of the node list's ETag until the flush bumps the fleet version)
+        self._revived: Set[int] = set()
+        # What the running flush is writing; still overlaid until it has committed
+        self._flushing_pending: Dict[int, datetime] = {}
+        self._flushing_revived: Set[int] = set()
+        # Flushes started so far, and whether one is running (see flush_state)
+        self.flushes = 0
+        self.flushing = False
+
+    # --------------------------------------------------------------------------
+    # Node cache
+    # --------------------------------------------------------------------------
+
+    def remember(self, node) -> None:
+        """Caches the current state of a node (a models.Node or NodeResponse)."""
+        if not self.enabled:
+            return
+        response = schemas.NodeResponse.model_validate(node)
+        previous = self._hostnames.get(response.id)
+        if previous is not None and previous != response.hostname:
+            self._nodes.pop(previous, None)
+        pending = self._pending.get(response.id)
+        if pending is not None and pending > response.last_seen:
+            response.last_seen = pending
+            response.status = "online"
+        self._nodes[response.hostname] = response
+        self._hostnames[response.id] = response.hostname
+        self._loaded[response.id] = time.monotonic()
+
+    def forget(self, node_id: int) -> None:
+        """Drops a deleted node, including any heartbeat not written yet."""
+        hostname = self._hostnames.pop(node_id, None)
+        if hostname is not None:
+            self._nodes.pop(hostname, None)
+        self._loaded.pop(node_id, None)
+        self._pending.pop(node_id, None)
+
+    async def load(self, session: AsyncSession) -> None:
+        """Caches every node."""
+        result = await session.execute(select(models.Node))
+        for node in result.scalars():
+            self.remember(node)
+        logger.info(f"HeartbeatBuffer cached {len(self._nodes)} nodes")
+
+    # --------------------------------------------------------------------------
+    # Heartbeats
+    # --------------------------------------------------------------------------
+
+    async def record(self, hostname: str) -> Optional[schemas.NodeResponse]:
+        """
+        Records a heartbeat from `hostname`.
+
+        Returns:
+            The node's updated state, or None if no such node exists
+        """
+        node = self._nodes.get(hostname)
+        if node is None or time.monotonic() - self._loaded.get(node.id, 0) > self.cache_ttl:
+            # Not cached (registered through another worker since the cache was
+            # loaded), or cached long enough to have been changed by another worker
+            async with ReadSessionLocal() as session:
+                result = await session.execute(select(models.Node).where(models.Node.hostname == hostname))
+                db_node = result.scalar_one_or_none()
+            if node is not None and (db_node is None or db_node.id != node.id):
+                self.forget(node.id)
+            if db_node is None:
+                return None
+            self.remember(db_node)
+            node = self._nodes[hostname]
+
+        if node.status != "online":
+            self._revived.add(node.id)
+        node.last_seen = datetime.utcnow()
+        node.status = "online"
+        self._pending[node.id] = node.last_seen
+        return node.model_copy()
+
+    def mark_offline(self, node_id: int) -> None:
+        """Records that the heartbeat monitor marked a node offline."""
+        hostname = self._hostnames.get(node_id)
+        if hostname is not None:
+            self._nodes[hostname].status = "offline"
+        self._revived.discard(node_id)
+
+    def revived(self) -> Set[int]:
+        """IDs of the nodes that are online in memory but not yet in the table."""
+        return self._revived | self._flushing_revived
+
+    def version_tag(self) -> str:
+        """
+        Identifies the status changes held in memory: a digest of the nodes
+        online here but not yet in the table, or empty if there are none. It
+        depends only on that state, so workers holding the same changes (and
+        all workers once they are flushed) produce the same tag.
+        """
+        revived = self.revived()
+        if not revived:
+            return ""
+        return hashlib.sha256(",".join(map(str, sorted(revived))).encode()).hexdigest()[:12]
+
+    def flush_state(self) -> Optional[int]:
+        """
+        Marks the start of a read whose result may be cached.
+
+        Returns:
+            A token for `unchanged_since`, or None while a flush is running
+            (the table is about to change under the same fleet version)
+        """
+        return None if self.flushing else self.flushes
+
+    def unchanged_since(self, token: Optional[int]) -> bool:
+        """Whether no flush has started since `flush_state` returned `token`."""
+        return token is not None and not self.flushing and self.flushes == token
+
+    def overlay(self, nodes: Iterable[schemas.NodeResponse]) -> List[schemas.NodeResponse]:
+        """Applies heartbeats that are not written yet to nodes read from the database."""
+        nodes = list(nodes)
+        if self._pending or self._flushing_pending:
+            for node in nodes:
+                seen = max(
+                    (seen for seen in (self._pending.get(node.id), self._flushing_pending.get(node.id)) if seen),
+                    default=None,
+                )
+                if seen is not None and seen > node.last_seen:
+                    node.last_seen = seen
+                    node.status = "online"
+        return nodes
+
+    async def flush(self) -> int:
+        """
+        Writes every recorded heartbeat in one bulk UPDATE.
+
+        Returns:
+            The number of nodes written
+        """
+        if not self._pending or self.flushing:
+            return 0
+        pending, self._pending = self._pending, {}
+        revived, self._revived = self._revived, set()
+        self._flushing_pending, self._flushing_revived = pending, revived
+        self.flushes += 1
+        self.flushing = True
+        params = [{"node_id": node_id, "seen": seen} for node_id, seen in pending.items()]
+
+        async def _write(session: AsyncSession) -> Optional[int]:
+            result = await session.execute(_FLUSH_STMT, params)
+            if revived:
+                await bump_fleet_version(session)
+            return result.rowcount if session.bind.dialect.supports_sane_multi_rowcount else None
+
+        try:
+            written = await write_queue.submit(_write)
+        except BaseException:
+            # Keep the heartbeats for the next flush unless newer ones arrived meanwhile
+            for node_id, seen in pending.items():
+                self._pending.setdefault(node_id, seen)
+            self._revived |= revived
+            raise
+        finally:
+            self._flushing_pending, self._flushing_revived = {}, set()
+            self.flushing = False
+        if written is not None and written < len(params):
+            await self._forget_deleted(pending)
+        logger.debug(f"Flushed heartbeats of {len(params)} nodes")
+        return len(params)
+
+    async def _forget_deleted(self, node_ids: Iterable[int]) -> None:
+        """Forgets the nodes among `node_ids` that no longer exist (deleted by another worker)."""
+        node_ids = list(node_ids)
+        async with ReadSessionLocal() as session:
+            result = await session.execute(select(models.Node.id).where(models.Node.id.in_(node_ids)))
+            existing = set(result.scalars())
+        for node_id in node_ids:
+            if node_id not in existing:
+                logger.info(f"Node {node_id} no longer exists; dropping it from the heartbeat cache")
+                self.forget(node_id)
+
+    # --------------------------------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------------------------------
+
+    async def start(self):
+        """Cache the nodes and start the periodic flush (coalesced mode only)."""
+        if self.running or not self.enabled:
+            return
+        async with ReadSessionLocal() as session:
+            await self.load(session)
+        self.running = True
+        self.task = asyncio.create_task(self._flush_loop())
+        logger.info(f"HeartbeatBuffer started: flush_interval={self.flush_interval}s")
+
+    async def stop(self):
+        """Stop the flush task and write any remaining heartbeats."""
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing heartbeats on shutdown: {e}")
+        logger.info("HeartbeatBuffer stopped")
+
+    async def _flush_loop(self):
+        while self.running:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error flushing heartbeats: {e}")
+
+
+# Global instance
+heartbeat_buffer = HeartbeatBuffer(
+    enabled=HEARTBEAT_MODE == "coalesced",
+    flush_interval=HEARTBEAT_FLUSH_INTERVAL,
+    cache_ttl=HEARTBEAT_CACHE_TTL,
+)
@@ -0,0 +1,167 @@
+"""
+Interning - Dictionary table for repeated event strings
+
+Promoted string fields (process names and paths, IP addresses, registry keys)
+repeat millions of times. Each distinct value is stored once in
+`interned_strings`, and events reference it by a small integer ID, which
+shrinks both the event rows and the indexes on those columns.
+
+Lookups in either direction go through in-process LRU caches, so a steady
+stream of events with familiar values costs no extra queries. A value first
+seen inside a write transaction is only cached once that transaction has
+committed, so a rolled-back insert can never leave a dangling ID in the cache.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Sequence
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+from db import IS_POSTGRES
+from promoted import INTERNED_FIELDS
+
+# --- Configuration ---
+INTERN_CACHE_SIZE = int(os.getenv("INTERN_CACHE_SIZE", "100000"))
+
+# Session.info key holding values interned by a transaction that has not committed yet
+_PENDING_KEY = "interned_pending"
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+
+class StringInterner:
+    """Maps strings to and from their IDs in `interned_strings`."""
+
+    def __init__(self, cache_size: int = 100000):
+        """
+        Args:
+            cache_size: Entries kept in each direction's LRU cache
+        """
+        self._ids = LRUCache(cache_size)
+        self._values = LRUCache(cache_size)
+
+    def _remember(self, mapping: Dict[str, int]) -> None:
+        for value, string_id in mapping.items():
+            self._ids.put(value, string_id)
+            self._values.put(string_id, value)
+
+    async def intern(self, session: AsyncSession, values: Iterable[str]) -> Dict[str, int]:
+        """
+        Returns the ID of every value, adding the ones not stored yet.
+
+        Runs inside the caller's write transaction; see forget_pending() for
+        the caller's side of a failed transaction.
+        """
+        pending: Dict[str, int] = session.info.setdefault(_PENDING_KEY, {})
+        ids: Dict[str, int] = {}
+        missing = []
+        for value in set(values):
+            string_id = self._ids.get(value) or pending.get(value)
+            if string_id is None:
+                missing.append(value)
+            else:
+                ids[value] = string_id
+        if not missing:
+            return ids
+
+        table = models.InternedString
+        stmt = select(table.value, table.id).where(table.value.in_(missing))
+        found = dict((await session.execute(stmt)).all())
+        self._remember(found)
+        ids.update(found)
+
+        new_values = [value for value in missing if value not in found]
+        if new_values:
+            dialect_insert = postgres_insert if IS_POSTGRES else sqlite_insert
+            await session.execute(
+                dialect_insert(table).on_conflict_do_nothing(index_elements=["value"]),
+                [{"value": value} for value in new_values],
+            )
+            stmt = select(table.value, table.id).where(table.value.in_(new_values))
+            created = dict((await session.execute(stmt)).all())
+            pending.update(created)
+            ids.update(created)
+        return ids
+
+    def forget_pending(self, session: AsyncSession, values: Iterable[str]) -> None:
+        """Drops uncommitted IDs of `values` after the work that created them failed."""
+        pending = session.info.get(_PENDING_KEY)
+        if pending:
+            for value in values:
+                pending.pop(value, None)
+
+    async def lookup(self, session: AsyncSession, ids: Iterable[int]) -> Dict[int, str]:
+        """Returns the string for every ID."""
+        values: Dict[int, str] = {}
+        missing = []
+        for string_id in set(ids):
+            value = self._values.get(string_id)
+            if value is None:
+                missing.append(string_id)
+            else:
+                values[string_id] = value
+        if missing:
+            table = models.InternedString
+            stmt = select(table.value, table.id).where(table.id.in_(missing))
+            found = dict((await session.execute(stmt)).all())
+            self._remember(found)
+            values.update({string_id: value for value, string_id in found.items()})
+        return values
+
+    async def expand_events(self, session: AsyncSession, events: Sequence[models.Event]) -> None:
+        """Sets the promoted string fields (e.g. `process_name`) on loaded events."""
+        ids = {
+            getattr(event_row, column)
+            for event_row in events
+            for column in INTERNED_FIELDS.values()
+        }
+        ids.discard(None)
+        values = await self.lookup(session, ids) if ids else {}
+        for event_row in events:
+            for field, column in INTERNED_FIELDS.items():
+                setattr(event_row, field, values.get(getattr(event_row, column)))
+
+
+# Global instance
+string_interner = StringInterner(cache_size=INTERN_CACHE_SIZE)
+
+
+# --- Transaction hooks ---
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_strings(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        string_interner._remember(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_uncommitted_strings(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,19 +1,31 @@
 # logs.py
 
-from datetime import datetime
-from typing import List, Optional
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import literal, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
 # --- Corrected Project-specific Imports for a flat structure ---
+import export
 import models
+import rollups
 import rules
 import schemas
 from authentication import get_current_user, verify_api_key
-from db import get_db
+from compression import details_codec
+from db import get_read_db, write_queue
+from event_query import EventFilters
+from partitions import partition_manager
+from interning import string_interner
+from promoted import INTERNED_FIELDS, extract_promoted, promoted_columns
+from search import search_index
 from websocket import manager
 
 router = APIRouter(
@@ -29,6 +41,122 @@ class EventIngestResponse(BaseModel):
     triggered_rules: List[str]
 
 
+class EventBatchIngestResponse(BaseModel):
+    results: List[EventIngestResponse]
+
+
+async def _insert_events(
+    session: AsyncSession, events_in: List[schemas.EventIngestRequest]
+) -> List[models.Event]:
+    """
+    Validates the source nodes and stores a list of events.
+
+    All referenced nodes are checked with one query, and the events are written
+    with a single multi-row INSERT (per partition), so a batch costs the same
+    number of round trips as a single event on both SQLite and PostgreSQL.
+    The rollup counters are incremented with one upsert and the details are
+    added to the full-text index.
+    """
+    node_ids = {event_in.node_id for event_in in events_in}
+    result = await session.execute(
+        select(models.Node.id, models.Node.group).where(models.Node.id.in_(node_ids))
+    )
+    node_groups = dict(result.all())
+    missing = node_ids - set(node_groups)
+    if missing:
+        missing_ids = ", ".join(str(node_id) for node_id in sorted(missing))
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Node with ID {missing_ids} not found. Cannot ingest event.",
+        )
+
+    # Promoted string fields are stored as interned string IDs
+    promoted = [extract_promoted(event_in.details) for event_in in events_in]
+    strings = {values[field] for values in promoted for field in INTERNED_FIELDS if values[field] is not None}
+    string_ids = await string_interner.intern(session, strings)
+
+    try:
+        rows = [
+            {
+                "node_id": event_in.node_id,
+                "event_type": event_in.event_type,
+                "severity": event_in.severity,
+                "details": details_codec.encode(event_in.event_type, event_in.details),
+                **promoted_columns(values, string_ids),
+            }
+            for event_in, values in zip(events_in, promoted)
+        ]
+        # Routed to the right time partition when event partitioning is enabled
+        new_events = await partition_manager.insert_events(session, rows)
+        # Hand the uncompressed details and expanded strings back to the rules, index and response
+        for new_event, event_in, values in zip(new_events, events_in, promoted):
+            set_committed_value(new_event, "details", event_in.details)
+            for field in INTERNED_FIELDS:
+                setattr(new_event, field, values[field])
+            # Lets the WebSocket broadcast route the event by node group
+            new_event.node_group = node_groups[new_event.node_id]
+
+        # Keep the statistics rollups and the full-text index in step, in the same transaction
+        await rollups.record_events(session, new_events, node_groups)
+        await search_index.index_events(session, new_events)
+    except Exception:
+        string_interner.forget_pending(session, strings)
+        raise
+    return new_events
+
+
+async def _publish_event(event_in: schemas.EventIngestRequest, new_event: models.Event) -> EventIngestResponse:
+    """Evaluates a stored event against the detection rules and broadcasts it."""
+    # Convert Pydantic model to a dict for the rule engine
+    event_dict = event_in.model_dump()
+    triggered_rules = rules.evaluate_event(event_dict)
+
+    # Broadcast new event via WebSocket
+    await manager.broadcast({
+        "type": "event_created",
+        "data": schemas.EventResponse.model_validate(new_event).model_dump(mode="json"),
+        "triggered_rules": triggered_rules
+    }, attributes={"group": getattr(new_event, "node_group", None)})
+
+    return EventIngestResponse(
+        created_event=new_event,
+        triggered_rules=triggered_rules
+    )
+
+
+async def ingest_events(events_in: List[schemas.EventIngestRequest]) -> List[EventIngestResponse]:
+    """
+    Stores a batch of events in one transaction, then evaluates and broadcasts each.
+
+    Shared by the batch ingest endpoint and the persistent agent channel.
+    """
+    async def _store_events(session: AsyncSession) -> List[models.Event]:
+        return await _insert_events(session, events_in)
+
+    new_events = await write_queue.submit(_store_events)
+
+    return [
+        await _publish_event(event_in, new_event)
+        for event_in, new_event in zip(events_in, new_events)
+    ]
+
+
+def _check_key_node(events_in: List[schemas.EventIngestRequest], key_node_id: Optional[int]) -> None:
+    """
+    Ensures an agent authenticated with a per-node key only submits events for its own node.
+
+    Raises:
+        HTTPException: If an event names another node
+    """
+    if key_node_id is None:
+        return
+    if any(event_in.node_id != key_node_id for event_in in events_in):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The API key does not belong to the node the events are for.",
+        )
+
+
 @router.post(
     "/ingest",
     response_model=EventIngestResponse,
@@ -38,96 +166,232 @@ class EventIngestResponse(BaseModel):
 )
 async def ingest_log(
     event_in: schemas.EventIngestRequest,
-    db: AsyncSession = Depends(get_db),
     # This endpoint is protected. Only agents with a valid API key can submit logs.
-    is_valid_key: bool = Depends(verify_api_key),
+    # A per-node key resolves to its node, which the events must belong to.
+    key_node_id: Optional[int] = Depends(verify_api_key),
 ):
     """
     Ingests, analyzes, and stores a security event.
 
     1.  Validates that the source node exists.
-    2.  Converts the incoming Pydantic schema to a dictionary for rule evaluation.
+    2.  Creates a new Event record in the database (via the batched write queue).
     3.  Passes the event to the `evaluate_event` function.
-    4.  Creates a new Event record in the database.
-    5.  Returns the created event and a list of any triggered rule names.
+    4.  Returns the created event and a list of any triggered rule names.
+    """
+    _check_key_node([event_in], key_node_id)
+
+    # 1-2. Writes go through the shared write queue so concurrent ingests are
+    # committed together on the writer connection.
+    async def _store_event(session: AsyncSession) -> models.Event:
+        return (await _insert_events(session, [event_in]))[0]
+
+    new_event = await write_queue.submit(_store_event)
+
+    # 3-4. Evaluate, broadcast and return the comprehensive response
+    return await _publish_event(event_in, new_event)
+
+
+@router.post(
+    "/ingest/batch",
+    response_model=EventBatchIngestResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Ingest a Batch of Security Events from an Agent",
+    description="Stores many events with one multi-row insert and evaluates each against detection rules.",
+)
+async def ingest_log_batch(
+    batch_in: schemas.EventBatchIngestRequest,
+    # This endpoint is protected. Only agents with a valid API key can submit logs.
+    # A per-node key resolves to its node, which the events must belong to.
+    key_node_id: Optional[int] = Depends(verify_api_key),
+):
     """
-    # 1. Validate that the node exists before ingesting its event
-    node_exists = await db.get(models.Node, event_in.node_id)
-    if not node_exists:
+    Ingests a batch of events in one transaction.
+
+    The batch is all-or-nothing: if any referenced node does not exist, no
+    events are stored.
+    """
+    _check_key_node(batch_in.events, key_node_id)
+    results = await ingest_events(batch_in.events)
+    return EventBatchIngestResponse(results=results)
+
+
+@router.get(
+    "/stats",
+    response_model=schemas.EventStatsResponse,
+    summary="Event Statistics",
+    description="Time-bucketed histogram and top-N breakdowns of event counts, served from rollup tables.",
+)
+async def get_log_stats(
+    start_time: Optional[datetime] = Query(None, description="Start of the time range (default: 24 hours before end_time)."),
+    end_time: Optional[datetime] = Query(None, description="End of the time range (default: now)."),
+    interval: Optional[Literal["minute", "hour", "day"]] = Query(None, description="Bucket size (default: chosen from the range and what is still retained)."),
+    node_id: Optional[int] = Query(None, description="Only count events from this Node ID."),
+    group: Optional[str] = Query(None, description="Only count events from nodes in this group."),
+    severity: Optional[str] = Query(None, description="Only count events with this severity."),
+    event_type: Optional[str] = Query(None, description="Only count events of this type."),
+    top: int = Query(10, ge=1, le=100, description="Number of entries in each breakdown."),
+    db: AsyncSession = Depends(get_read_db),
+    # This endpoint is protected. Only authenticated dashboard users can view stats.
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Answers dashboard statistics from the rollup tables, without touching raw events.
+    """
+    end_time = end_time or datetime.utcnow()
+    start_time = start_time or end_time - timedelta(hours=24)
+    if start_time > end_time:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Node with ID {event_in.node_id} not found. Cannot ingest event.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_time must be before end_time.",
+        )
+    if interval is not None and not rollups.is_retained(interval, start_time):
+        # Pruned buckets would read as zero counts
+        oldest = rollups.retained_from(interval)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                f"Per-{interval} statistics are only kept from {oldest.isoformat(timespec='seconds')} on; "
+                "use a later start_time or a coarser interval."
+            ),
         )
 
-    # 2. Evaluate the event against detection rules
-    # Convert Pydantic model to a dict for the rule engine
-    event_dict = event_in.model_dump()
-    triggered_rules = rules.evaluate_event(event_dict)
-
-    # 3. Create and store the new event record
-    new_event = models.Event(
-        node_id=event_in.node_id,
-        event_type=event_in.event_type,
-        severity=event_in.severity,
-        details=event_in.details,
+    return await rollups.query_stats(
+        db,
+        start_time=start_time,
+        end_time=end_time,
+        granularity=interval or rollups.choose_granularity(start_time, end_time),
+        node_id=node_id,
+        group=group,
+        severity=severity,
+        event_type=event_type,
+        top=top,
     )
-    db.add(new_event)
-    await db.commit()
-    await db.refresh(new_event)
-    
-    # Broadcast new event via WebSocket
-    await manager.broadcast({
-        "type": "event_created",
-        "data": schemas.EventResponse.model_validate(new_event).model_dump(),
-        "triggered_rules": triggered_rules
-    })
 
-    # 4. Return the comprehensive response
-    return EventIngestResponse(
-        created_event=new_event,
-        triggered_rules=triggered_rules
-    )
+
+# --- Keyset Pagination Cursors ---
+# A cursor is the (timestamp, id) of the last event on the previous page,
+# encoded as opaque URL-safe base64 so clients do not depend on its shape.
+
+def _encode_cursor(event: models.Event) -> str:
+    raw = json.dumps({"t": event.timestamp.isoformat(), "i": event.id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), int(data["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor.",
+        )
 
 
 @router.get(
     "",
     response_model=List[schemas.EventResponse],
     summary="Query Stored Events",
-    description="Retrieves a list of events with powerful filtering options.",
+    description=(
+        "Retrieves a list of events with powerful filtering options. When more events match, "
+        "the response carries an `X-Next-Cursor` header; pass it back as `cursor` for the next page."
+    ),
 )
 async def get_logs(
+    response: Response,
     # --- Filtering Query Parameters ---
-    node_id: Optional[int] = Query(None, description="Filter events by a specific Node ID."),
-    severity: Optional[str] = Query(None, description="Filter events by severity (e.g., 'high', 'medium')."),
-    event_type: Optional[str] = Query(None, description="Filter by a specific event type."),
-    start_time: Optional[datetime] = Query(None, description="The start of the time range to query (ISO 8601 format)."),
-    end_time: Optional[datetime] = Query(None, description="The end of the time range to query (ISO 8601 format)."),
+    filters: EventFilters = Depends(),
     limit: int = Query(100, ge=1, le=1000, description="The maximum number of events to return."),
-    db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous page's X-Next-Cursor header."),
+    db: AsyncSession = Depends(get_read_db),
     # This endpoint is protected. Only authenticated dashboard users can view logs.
     current_user: dict = Depends(get_current_user),
 ):
     """
     Queries the database for events, allowing for flexible filtering.
+    Only the event partitions overlapping start_time/end_time are read.
+
+    Pages are ordered by (timestamp, id) descending and continue strictly after
+    the cursor, so every page is an index range scan of the same cost no matter
+    how deep it is.
     """
-    stmt = select(models.Event)
+    Event = await partition_manager.event_source(db, filters.start_time, filters.end_time)
+    stmt = filters.apply(select(Event), Event)
 
-    # Dynamically build the WHERE clause based on provided filters
-    if node_id is not None:
-        stmt = stmt.where(models.Event.node_id == node_id)
-    if severity is not None:
-        stmt = stmt.where(models.Event.severity == severity)
-    if event_type is not None:
-        stmt = stmt.where(models.Event.event_type == event_type)
-    if start_time is not None:
-        stmt = stmt.where(models.Event.timestamp >= start_time)
-    if end_time is not None:
-        stmt = stmt.where(models.Event.timestamp <= end_time)
+    if cursor is not None:
+        cursor_time, cursor_id = _decode_cursor(cursor)
+        # Bind the cursor with the column's type so it is stored-format compatible
+        stmt = stmt.where(
+            tuple_(Event.timestamp, Event.id)
+            < tuple_(literal(cursor_time, Event.timestamp.type), literal(cursor_id, Event.id.type))
+        )
 
-    # Order by most recent events first and apply the limit
-    stmt = stmt.order_by(models.Event.timestamp.desc()).limit(limit)
+    # Order by most recent events first; fetch one extra row to detect a next page
+    stmt = stmt.order_by(Event.timestamp.desc(), Event.id.desc()).limit(limit + 1)
 
     result = await db.execute(stmt)
     events = result.scalars().all()
+    await details_codec.ensure_dictionaries(db, (event.details for event in events))
+    await string_interner.expand_events(db, events)
+
+    if len(events) > limit:
+        events = events[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(events[-1])
 
-    return events
\ No newline at end of file
+    return events
+
+
+@router.get(
+    "/export",
+    summary="Export Stored Events",
+    description=(
+        "Streams every event matching the filters, oldest first, as NDJSON, CSV or Parquet. "
+        "Accepts the same filters as `GET /logs` and has no row limit."
+    ),
+    response_class=StreamingResponse,
+)
+async def export_logs(
+    filters: EventFilters = Depends(),
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson", description="Output format."),
+    # This endpoint is protected. Only authenticated dashboard users can export logs.
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Streams a bulk export of events with constant memory.
+
+    Rows are read through a server-side cursor and written to the response
+    chunk by chunk; see `export.stream_events`.
+    """
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Parquet export requires the 'pyarrow' package on the server.",
+        )
+
+    return StreamingResponse(
+        export.stream_events(filters, format),
+        media_type=export.EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="events.{format}"'},
+    )
+
+
+@router.get(
+    "/{event_id}",
+    response_model=schemas.EventResponse,
+    summary="Get a Single Event",
+    description="Retrieves one event with its full details, e.g. for an event received in WebSocket summary mode.",
+)
+async def get_log(
+    event_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    # This endpoint is protected. Only authenticated dashboard users can view logs.
+    current_user: dict = Depends(get_current_user),
+):
+    Event = await partition_manager.event_source(db)
+    event = (await db.execute(select(Event).where(Event.id == event_id))).scalar_one_or_none()
+    if event is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Event not found")
+    await details_codec.ensure_dictionaries(db, [event.details])
+    await string_interner.expand_events(db, [event])
+    return event
@@ -3,20 +3,68 @@
 from __future__ import annotations
 
 import datetime
+import json
 from typing import List
 
 from sqlalchemy import (
+    BigInteger,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     JSON,
+    LargeBinary,
     String,
     Table,
     Column,
+    Text,
+    TypeDecorator,
+    UniqueConstraint,
     func,
 )
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+# JSON documents are stored as TEXT on SQLite and as binary JSONB on PostgreSQL.
+JSONDocument = JSON().with_variant(JSONB(), "postgresql")
+
+
+class EventDetailsType(TypeDecorator):
+    """
+    JSON document column that can also hold a compressed blob.
+
+    Dicts are stored as JSON text. Bytes (zstd frames written by
+    compression.py) are stored and returned untouched, so they are only
+    decoded where the details are actually read (DetailsCodec.expand).
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return json.loads(value)
+
+
+# Event details: JSON text or a compressed blob on SQLite, JSONB on PostgreSQL
+# (which compresses large values itself through TOAST).
+EventDetails = EventDetailsType().with_variant(JSONB(), "postgresql")
+
+# SQLite keeps datetimes as text and CURRENT_TIMESTAMP defaults have no
+# fractional seconds. Event timestamps written explicitly use the same format,
+# so text comparisons (range filters, keyset cursors) stay consistent; ties
+# within a second are ordered by id.
+EventTimestamp = DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 
 class Base(DeclarativeBase):
     """Base class for all SQLAlchemy ORM models."""
@@ -54,6 +102,14 @@ node_policy_association = Table(
     Column("policy_id", Integer, ForeignKey("policies.id"), primary_key=True),
 )
 
+# Single row (id=1) whose version changes whenever the node list does
+fleet_version = Table(
+    "fleet_version",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", BigInteger, nullable=False, default=0),
+)
+
 
 class Node(Base):
     """
@@ -72,6 +128,9 @@ class Node(Base):
         doc="Timestamp of the last check-in from the node."
     )
     status: Mapped[str] = mapped_column(String(50), default="offline", nullable=False)
+    # Per-node agent API key: its public prefix and the SHA-256 of the whole key
+    api_key_prefix: Mapped[str] = mapped_column(String(32), nullable=True, unique=True, index=True)
+    api_key_hash: Mapped[str] = mapped_column(String(64), nullable=True)
 
     # --- Relationships ---
 
@@ -102,8 +161,8 @@ class Policy(Base):
     type: Mapped[str] = mapped_column(String(100), nullable=False, doc="e.g., firewall, ids, file_integrity")
     
     # Using JSON type for flexible rule storage.
-    # For SQLite, SQLAlchemy handles this by storing it as TEXT.
-    rules_json: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # For SQLite, SQLAlchemy handles this by storing it as TEXT; PostgreSQL uses JSONB.
+    rules_json: Mapped[dict] = mapped_column(JSONDocument, nullable=False)
 
     # --- Relationships ---
 
@@ -123,18 +182,44 @@ class Event(Base):
     """
     __tablename__ = "events"
 
+    # Composite indexes matching the filters GET /logs builds. Each ends in
+    # (timestamp, id) so keyset pagination can walk them in order; they also
+    # cover plain timestamp, event_type and severity lookups.
+    __table_args__ = (
+        Index("ix_events_timestamp_id", "timestamp", "id"),
+        Index("ix_events_node_id_timestamp_id", "node_id", "timestamp", "id"),
+        Index("ix_events_severity_timestamp_id", "severity", "timestamp", "id"),
+        Index("ix_events_event_type_timestamp_id", "event_type", "timestamp", "id"),
+        # Promoted details fields (see promoted.py)
+        Index("ix_events_process_name_id_timestamp_id", "process_name_id", "timestamp", "id"),
+        Index("ix_events_parent_process_name_id_timestamp_id", "parent_process_name_id", "timestamp", "id"),
+        Index("ix_events_process_path_id_timestamp_id", "process_path_id", "timestamp", "id"),
+        Index("ix_events_destination_ip_id_timestamp_id", "destination_ip_id", "timestamp", "id"),
+        Index("ix_events_destination_port_timestamp_id", "destination_port", "timestamp", "id"),
+        Index("ix_events_registry_key_id_timestamp_id", "registry_key_id", "timestamp", "id"),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     timestamp: Mapped[datetime.datetime] = mapped_column(
-        DateTime, 
+        EventTimestamp, 
         server_default=func.now(), 
         nullable=False,
-        index=True
     )
-    event_type: Mapped[str] = mapped_column(String(100), nullable=False, index=True)
-    severity: Mapped[str] = mapped_column(String(50), nullable=False, index=True, doc="e.g., low, medium, high, critical")
+    event_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    severity: Mapped[str] = mapped_column(String(50), nullable=False, doc="e.g., low, medium, high, critical")
     
     # Flexible field to store event-specific data.
-    details: Mapped[dict] = mapped_column(JSON, nullable=True)
+    details: Mapped[dict] = mapped_column(EventDetails, nullable=True)
+
+    # Frequently queried details fields, copied out of `details` at ingest time
+    # so they can be filtered through an index instead of a JSON scan. String
+    # fields hold the ID of the value in `interned_strings` (see interning.py).
+    process_name_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    parent_process_name_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    process_path_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    destination_ip_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    destination_port: Mapped[int] = mapped_column(Integer, nullable=True)
+    registry_key_id: Mapped[int] = mapped_column(Integer, nullable=True)
 
     # --- Foreign Keys and Relationships ---
 
@@ -148,6 +233,72 @@ class Event(Base):
     def __repr__(self) -> str:
         return f"<Event(id={self.id}, type='{self.event_type}', node_id={self.node_id})>"
 
+
+class EventRollup(Base):
+    """
+    Pre-aggregated event counts for one time bucket, maintained at ingest time.
+
+    One row per (granularity, bucket, node, group, severity, event_type), where
+    granularity is 'minute', 'hour' or 'day' and bucket is the start of the
+    period. Statistics are answered from these rows instead of raw events.
+    """
+    __tablename__ = "event_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "bucket", "node_id", "group", "severity", "event_type",
+            name="uq_event_rollups_key",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    granularity: Mapped[str] = mapped_column(String(10), nullable=False)
+    bucket: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False)
+    node_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    # The node's group at ingest time; empty string when the node has no group.
+    group: Mapped[str] = mapped_column(String(100), nullable=False, default="")
+    severity: Mapped[str] = mapped_column(String(50), nullable=False)
+    event_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<EventRollup({self.granularity} {self.bucket}, node_id={self.node_id}, count={self.count})>"
+
+
+class InternedString(Base):
+    """
+    One distinct string value referenced by events.
+
+    Process names, paths, IP addresses and registry keys repeat across
+    millions of events; each distinct value is stored once here and events
+    store its small integer ID.
+    """
+    __tablename__ = "interned_strings"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[str] = mapped_column(String(1024), unique=True, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<InternedString(id={self.id}, value='{self.value}')>"
+
+
+class DetailsDictionary(Base):
+    """
+    A zstd dictionary trained on the details of one event type.
+
+    The ID is the dictionary ID zstd writes into every frame compressed with
+    it, so a stored blob identifies the dictionary needed to decode it.
+    """
+    __tablename__ = "details_dictionaries"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    event_type: Mapped[str] = mapped_column(String(100), nullable=False, index=True)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<DetailsDictionary(id={self.id}, event_type='{self.event_type}')>"
+
+
 # --- Example of how to initialize the database (for context) ---
 # This part is typically executed from your main application entrypoint
 # or a database initialization script.
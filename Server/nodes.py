@@ -1,84 +1,343 @@
 # nodes.py (With Password Confirmation for Deletions)
 
-from typing import List
+import base64
+import json
+import os
+import time
+from datetime import datetime
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from pydantic import TypeAdapter
+from sqlalchemy import func, literal, or_, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import models
+import rollups
 import schemas
 import authentication
-from db import get_db
+from agent_keys import agent_keys, generate_key
+from baselines import baseline_tracker
+from db import IS_SQLITE, get_read_db, write_queue
+from fleet import bump_fleet_version, read_fleet_version
+from heartbeat_monitor import heartbeat_monitor
+from heartbeats import heartbeat_buffer
+from partitions import partition_manager
+from policy_bundles import policy_bundles
+from response_cache import NODE_POLICIES, NODES, POLICIES, response_cache
+from search import search_index
 from websocket import manager
 
+# --- Configuration ---
+# Longest time (seconds) a node list answered with 304 can show stale last_seen values (0: no limit)
+NODES_ETAG_MAX_AGE = int(os.getenv("NODES_ETAG_MAX_AGE", "60"))
+
 router = APIRouter(
     prefix="/nodes",
     tags=["Nodes"],
 )
 
+# --- Node List Sorting and Cursors ---
+SORT_COLUMNS = {
+    "hostname": models.Node.hostname,
+    "last_seen": models.Node.last_seen,
+    "group": models.Node.group,
+    "status": models.Node.status,
+    "id": models.Node.id,
+}
+
+
+def _sort_key(sort_by: str, value):
+    """The expression nodes are ordered by, for a column or a bound cursor value."""
+    if sort_by == "group":
+        # Nodes without a group sort as the empty string
+        return func.coalesce(value, "")
+    if sort_by == "last_seen" and IS_SQLITE:
+        # SQLite keeps timestamps as text, with or without fractional seconds
+        # depending on who wrote them; compare them in one format
+        return func.strftime("%Y-%m-%d %H:%M:%f", value)
+    return value
+
+# A cursor is the sort value and id of the last node on the previous page,
+# encoded as opaque URL-safe base64 like the event cursors in logs.py.
+
+def _encode_cursor(node: models.Node, sort_by: str) -> str:
+    value = getattr(node, sort_by)
+    if sort_by == "group":
+        value = value or ""
+    elif sort_by == "last_seen":
+        value = value.isoformat()
+    raw = json.dumps({"v": value, "i": node.id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort_by: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        value = data["v"]
+        if sort_by == "last_seen":
+            value = datetime.fromisoformat(value)
+        elif sort_by == "id":
+            value = int(value)
+        elif not isinstance(value, str):
+            raise TypeError("cursor value must be a string")
+        return value, int(data["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor.",
+        )
+
+
+_NODE_LIST = TypeAdapter(List[schemas.NodeResponse])
+
+
+def _node_list_etag(version: int) -> str:
+    """
+    Weak ETag of the node list: the persisted fleet version, plus the status
+    changes held in memory and not flushed yet, plus a time bucket so
+    `last_seen` is never more than NODES_ETAG_MAX_AGE seconds stale. Every
+    worker produces the same ETag for the same state.
+    """
+    parts = [str(version)]
+    tag = heartbeat_buffer.version_tag()
+    if tag:
+        parts.append(tag)
+    if NODES_ETAG_MAX_AGE > 0:
+        parts.append(str(int(time.time() // NODES_ETAG_MAX_AGE)))
+    return 'W/"' + ".".join(parts) + '"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison: W/"x" and "x" match
+    opaque = etag.removeprefix("W/")
+    return "*" in candidates or any(candidate.removeprefix("W/") == opaque for candidate in candidates)
+
+
 @router.get(
     "",
     response_model=List[schemas.NodeResponse],
     summary="List All Nodes",
+    description=(
+        "Lists nodes, optionally filtered and sorted. With `limit`, a response that has more "
+        "nodes carries an `X-Next-Cursor` header; pass it back as `cursor` for the next page. "
+        "Responses carry an `ETag`; send it back in `If-None-Match` to get `304 Not Modified` "
+        "while the node list is unchanged."
+    ),
 )
-async def list_nodes(db: AsyncSession = Depends(get_db)):
-    """ Fetches all nodes from the database. """
-    stmt = select(models.Node).order_by(models.Node.hostname)
+async def list_nodes(
+    group: Optional[str] = Query(None, description="Only nodes in this group."),
+    node_status: Optional[str] = Query(None, alias="status", description="Only nodes with this status (e.g. 'online', 'offline')."),
+    hostname_prefix: Optional[str] = Query(None, description="Only nodes whose hostname starts with this."),
+    sort_by: Literal["hostname", "last_seen", "group", "status", "id"] = Query("hostname"),
+    order: Literal["asc", "desc"] = Query("asc"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="The maximum number of nodes to return (all if omitted)."),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous page's X-Next-Cursor header."),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Fetches nodes from the database.
+
+    The fleet version is read first, so a changed node list always gets a new
+    ETag even if the change lands while the page is being read. Pages are
+    ordered by (sort column, id) and continue strictly after the cursor.
+    Serialized pages are cached per ETag and parameters, except when a
+    heartbeat flush ran during the read (the table may have changed under the
+    same ETag).
+    """
+    flush_state = heartbeat_buffer.flush_state()
+    etag = _node_list_etag(await read_fleet_version(db))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cache_key = (etag, group, node_status, hostname_prefix, sort_by, order, limit, cursor)
+    cached = response_cache.get(NODES, cache_key)
+    if cached is not None:
+        return cached.response()
+    generation = response_cache.generation(NODES)
+
+    stmt = select(models.Node)
+    if group is not None:
+        stmt = stmt.where(models.Node.group == group)
+    if hostname_prefix:
+        stmt = stmt.where(models.Node.hostname.startswith(hostname_prefix, autoescape=True))
+    if node_status is not None:
+        # Nodes brought back online by heartbeats that are not written yet
+        # (coalesced heartbeat mode) are still offline in the table
+        revived = heartbeat_buffer.revived()
+        if node_status == "online" and revived:
+            stmt = stmt.where(or_(models.Node.status == "online", models.Node.id.in_(revived)))
+        elif revived:
+            stmt = stmt.where(models.Node.status == node_status, models.Node.id.not_in(revived))
+        else:
+            stmt = stmt.where(models.Node.status == node_status)
+
+    column = SORT_COLUMNS[sort_by]
+    sort_key = _sort_key(sort_by, column)
+    if cursor is not None:
+        cursor_value, cursor_id = _decode_cursor(cursor, sort_by)
+        position = tuple_(sort_key, models.Node.id)
+        # Bind the cursor with the column's type so it is stored-format compatible
+        after = tuple_(
+            _sort_key(sort_by, literal(cursor_value, column.type)),
+            literal(cursor_id, models.Node.id.type),
+        )
+        stmt = stmt.where(position > after if order == "asc" else position < after)
+
+    if order == "asc":
+        stmt = stmt.order_by(sort_key.asc(), models.Node.id.asc())
+    else:
+        stmt = stmt.order_by(sort_key.desc(), models.Node.id.desc())
+    if limit is not None:
+        # Fetch one extra row to detect a next page
+        stmt = stmt.limit(limit + 1)
+
     result = await db.execute(stmt)
     nodes = result.scalars().all()
-    return [schemas.NodeResponse.model_validate(node) for node in nodes]
+    if limit is not None and len(nodes) > limit:
+        nodes = nodes[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(nodes[-1], sort_by)
+
+    # Heartbeats not yet flushed (coalesced heartbeat mode) are newer than the table
+    body = _NODE_LIST.dump_json(
+        heartbeat_buffer.overlay(schemas.NodeResponse.model_validate(node) for node in nodes)
+    )
+    if not heartbeat_buffer.unchanged_since(flush_state):
+        return Response(content=body, media_type="application/json", headers=headers)
+    return response_cache.put(NODES, cache_key, body, headers, generation).response()
+
+def _assign_api_key(node: models.Node) -> str:
+    """Gives a node a new agent API key (replacing any previous one) and returns it."""
+    api_key, node.api_key_prefix, node.api_key_hash = generate_key()
+    return api_key
+
 
 @router.post(
     "/register",
-    response_model=schemas.NodeResponse,
+    response_model=schemas.NodeRegisterResponse,
     status_code=status.HTTP_201_CREATED,
     summary="Register a New Node",
 )
 async def register_node(
     node_in: schemas.NodeRegisterRequest,
-    db: AsyncSession = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
 ):
-    """ Handles node registration. """
-    stmt = select(models.Node).where(models.Node.hostname == node_in.hostname)
-    result = await db.execute(stmt)
-    existing_node = result.scalar_one_or_none()
+    """
+    Handles node registration.
+    An agent registering with the shared agent API key is issued its own
+    per-node key the first time (returned once, in `api_key`).
+    """
+    enroll = authentication.is_shared_api_key(x_api_key)
 
-    if existing_node:
-        from datetime import datetime
-        existing_node.ip_address = node_in.ip_address
-        if node_in.group is not None:
-            existing_node.group = node_in.group
-        existing_node.status = "online"
-        existing_node.last_seen = datetime.utcnow()  # Update last_seen on re-registration
-        await db.commit()
-        await db.refresh(existing_node)
-        
-        # Broadcast update via WebSocket
-        await manager.broadcast({
-            "type": "node_updated",
-            "data": schemas.NodeResponse.model_validate(existing_node).model_dump()
-        })
-        
-        return schemas.NodeResponse.model_validate(existing_node)
-
-    new_node = models.Node(
-        hostname=node_in.hostname,
-        ip_address=node_in.ip_address,
-        group=node_in.group,
-        status="online",
-    )
-    db.add(new_node)
-    await db.commit()
-    await db.refresh(new_node)
-    
-    # Broadcast new node via WebSocket
+    async def _register(session: AsyncSession):
+        api_key = None
+        stmt = select(models.Node).where(models.Node.hostname == node_in.hostname)
+        result = await session.execute(stmt)
+        node = result.scalar_one_or_none()
+        created = node is None
+
+        if node:
+            from datetime import datetime
+            node.ip_address = node_in.ip_address
+            if node_in.group is not None:
+                node.group = node_in.group
+            node.status = "online"
+            node.last_seen = datetime.utcnow()  # Update last_seen on re-registration
+            if enroll and node.api_key_prefix is None:
+                api_key = _assign_api_key(node)
+        else:
+            node = models.Node(
+                hostname=node_in.hostname,
+                ip_address=node_in.ip_address,
+                group=node_in.group,
+                status="online",
+            )
+            if enroll:
+                api_key = _assign_api_key(node)
+            session.add(node)
+        await bump_fleet_version(session)
+        await session.flush()
+        await session.refresh(node)
+        return node, api_key, created
+
+    # Registrations share batched commits with other writes via the write queue
+    node, api_key, created = await write_queue.submit(_register)
+    if created:
+        # A new node has no policies yet
+        response_cache.invalidate(NODES)
+    else:
+        # Nodes are embedded in the policy responses too
+        response_cache.invalidate(NODES, POLICIES, NODE_POLICIES)
+    if api_key is not None:
+        agent_keys.remember(node.api_key_prefix, node.id, node.api_key_hash)
+    heartbeat_buffer.remember(node)
+    heartbeat_monitor.touch(node.id, node.last_seen)
+
+    # Broadcast the new or updated node via WebSocket
     await manager.broadcast({
-        "type": "node_created",
-        "data": schemas.NodeResponse.model_validate(new_node).model_dump()
+        "type": "node_created" if created else "node_updated",
+        "data": schemas.NodeResponse.model_validate(node).model_dump(mode="json")
     })
-    
-    return schemas.NodeResponse.model_validate(new_node)
+
+    response = schemas.NodeRegisterResponse.model_validate(node)
+    response.api_key = api_key
+    return response
+
+async def record_heartbeat(hostname: str) -> schemas.NodeResponse:
+    """
+    Marks a node online and records when it was last seen.
+
+    Shared by the heartbeat endpoint and the persistent agent channel.
+
+    Raises:
+        HTTPException: If no node with `hostname` is registered
+    """
+    from loguru import logger
+
+    if heartbeat_buffer.enabled:
+        # Coalesced mode: answered from memory, written to the database in bulk later
+        node = await heartbeat_buffer.record(hostname)
+        if node is None:
+            logger.warning(f"Heartbeat from unknown node: {hostname}")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Node with hostname '{hostname}' not found.",
+            )
+        heartbeat_monitor.touch(node.id, node.last_seen)
+        return node
+
+    async def _touch_node(session: AsyncSession) -> schemas.NodeResponse:
+        stmt = select(models.Node).where(models.Node.hostname == hostname)
+        result = await session.execute(stmt)
+        node = result.scalar_one_or_none()
+
+        if not node:
+            logger.warning(f"Heartbeat from unknown node: {hostname}")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Node with hostname '{hostname}' not found.",
+            )
+
+        from datetime import datetime
+        if node.status != "online":
+            await bump_fleet_version(session)
+        node.status = "online"
+        node.last_seen = datetime.utcnow()  # Explicitly update last_seen
+        await session.flush()
+        return schemas.NodeResponse.model_validate(node)
+
+    # Heartbeats share batched commits with other writes via the write queue
+    node = await write_queue.submit(_touch_node)
+    heartbeat_monitor.touch(node.id, node.last_seen)
+    logger.debug(f"Heartbeat processed for node {node.id}: {node.hostname}")
+    return node
+
 
 @router.post(
     "/heartbeat",
@@ -87,30 +346,11 @@ async def register_node(
 )
 async def node_heartbeat(
     heartbeat_in: schemas.NodeHeartbeatRequest,
-    db: AsyncSession = Depends(get_db),
 ):
     """ Receives a heartbeat from an agent to indicate it is still active. """
     from loguru import logger
     logger.info(f"Heartbeat received from hostname: {heartbeat_in.hostname}")
-    
-    stmt = select(models.Node).where(models.Node.hostname == heartbeat_in.hostname)
-    result = await db.execute(stmt)
-    node = result.scalar_one_or_none()
-
-    if not node:
-        logger.warning(f"Heartbeat from unknown node: {heartbeat_in.hostname}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Node with hostname '{heartbeat_in.hostname}' not found.",
-        )
-
-    from datetime import datetime
-    node.status = "online"
-    node.last_seen = datetime.utcnow()  # Explicitly update last_seen
-    await db.commit()
-    await db.refresh(node)
-    logger.debug(f"Heartbeat processed for node {node.id}: {node.hostname}")
-    return schemas.NodeResponse.model_validate(node)
+    return await record_heartbeat(heartbeat_in.hostname)
 
 
 # --- NEW ENDPOINT: UPDATE A NODE ---
@@ -122,31 +362,37 @@ async def node_heartbeat(
 async def update_node(
     node_id: int,
     node_update: schemas.NodeUpdateRequest,
-    db: AsyncSession = Depends(get_db)
 ):
     """ Updates a node's editable fields (hostname, ip_address, group). """
-    db_node = await db.get(models.Node, node_id)
-    if not db_node:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
-
-    # Check for hostname conflict if hostname is being changed to a new value
-    if node_update.hostname and node_update.hostname != db_node.hostname:
-        stmt = select(models.Node).where(models.Node.hostname == node_update.hostname)
-        result = await db.execute(stmt)
-        if result.scalar_one_or_none():
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Hostname already registered by another node")
-        db_node.hostname = node_update.hostname
-
-    # Update IP address if a new one is provided
-    if node_update.ip_address:
-        db_node.ip_address = node_update.ip_address
-    
-    # Update group if provided
-    if node_update.group is not None:
-        db_node.group = node_update.group
-    
-    await db.commit()
-    await db.refresh(db_node)
+    async def _update(session: AsyncSession) -> models.Node:
+        db_node = await session.get(models.Node, node_id)
+        if not db_node:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
+
+        # Check for hostname conflict if hostname is being changed to a new value
+        if node_update.hostname and node_update.hostname != db_node.hostname:
+            stmt = select(models.Node).where(models.Node.hostname == node_update.hostname)
+            result = await session.execute(stmt)
+            if result.scalar_one_or_none():
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Hostname already registered by another node")
+            db_node.hostname = node_update.hostname
+
+        # Update IP address if a new one is provided
+        if node_update.ip_address:
+            db_node.ip_address = node_update.ip_address
+
+        # Update group if provided
+        if node_update.group is not None:
+            db_node.group = node_update.group
+
+        await bump_fleet_version(session)
+        await session.flush()
+        await session.refresh(db_node)
+        return db_node
+
+    db_node = await write_queue.submit(_update)
+    response_cache.invalidate(NODES, POLICIES, NODE_POLICIES)
+    heartbeat_buffer.remember(db_node)
     return schemas.NodeResponse.model_validate(db_node)
 
 
@@ -160,40 +406,41 @@ async def update_node(
 async def delete_node(
     node_id: int,
     delete_request: schemas.DeleteConfirmation,
-    db: AsyncSession = Depends(get_db)
 ):
     """ 
     Deletes a node by its unique ID.
     Requires admin password confirmation to prevent accidental deletions.
     """
-    # Verify admin password
-    result = await db.execute(
-        select(models.User).where(models.User.username == "admin")
-    )
-    admin_user = result.scalar_one_or_none()
-    
-    if not admin_user:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Admin user not found"
-        )
-    
-    if not authentication.verify_password(delete_request.password, admin_user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid admin password"
-        )
-    
-    # Find and delete the node
-    db_node = await db.get(models.Node, node_id)
-    if not db_node:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Node not found"
-        )
-    
-    await db.delete(db_node)
-    await db.commit()
+    # Verify admin password (before the write below is queued, so bcrypt never holds a connection)
+    await authentication.verify_admin_password(delete_request.password)
+
+    async def _delete(session: AsyncSession) -> Optional[str]:
+        # Find and delete the node
+        db_node = await session.get(models.Node, node_id)
+        if not db_node:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Node not found"
+            )
+
+        # Neither the full-text index nor partition tables are covered by the ORM cascade
+        Event = await partition_manager.event_source(session)
+        await search_index.delete_events(session, select(Event.id).where(Event.node_id == node_id))
+        await partition_manager.delete_node_events(session, node_id)
+        await rollups.delete_node_rollups(session, node_id)
+        api_key_prefix = db_node.api_key_prefix
+        await session.delete(db_node)
+        await bump_fleet_version(session)
+        await session.flush()
+        return api_key_prefix
+
+    api_key_prefix = await write_queue.submit(_delete)
+    response_cache.invalidate(NODES, POLICIES, NODE_POLICIES)
+    policy_bundles.invalidate([node_id])
+    agent_keys.forget(api_key_prefix)
+    heartbeat_buffer.forget(node_id)
+    heartbeat_monitor.forget(node_id)
+    baseline_tracker.forget_node(node_id)
     
     # Broadcast deletion via WebSocket
     await manager.broadcast({
@@ -201,4 +448,61 @@ async def delete_node(
         "data": {"id": node_id}
     })
     
-    return {"status": "success", "detail": f"Node with ID {node_id} has been deleted"}
\ No newline at end of file
+    return {"status": "success", "detail": f"Node with ID {node_id} has been deleted"}
+
+
+# --- Per-node agent API keys ---
+@router.post(
+    "/{node_id}/api-key",
+    response_model=schemas.NodeApiKeyResponse,
+    summary="Issue a Node's Agent API Key",
+)
+async def issue_node_api_key(
+    node_id: int,
+    current_user: dict = Depends(authentication.get_current_user),
+):
+    """
+    Issues a new agent API key for a node, revoking its previous key.
+    The key is only shown in this response.
+    """
+    async def _issue(session: AsyncSession):
+        db_node = await session.get(models.Node, node_id)
+        if not db_node:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
+
+        previous_prefix = db_node.api_key_prefix
+        api_key = _assign_api_key(db_node)
+        await session.flush()
+        return db_node, previous_prefix, api_key
+
+    db_node, previous_prefix, api_key = await write_queue.submit(_issue)
+    agent_keys.forget(previous_prefix)
+    agent_keys.remember(db_node.api_key_prefix, db_node.id, db_node.api_key_hash)
+    return schemas.NodeApiKeyResponse(node_id=node_id, api_key=api_key)
+
+
+@router.delete(
+    "/{node_id}/api-key",
+    status_code=status.HTTP_200_OK,
+    summary="Revoke a Node's Agent API Key",
+    response_model=dict,
+)
+async def revoke_node_api_key(
+    node_id: int,
+    current_user: dict = Depends(authentication.get_current_user),
+):
+    """ Revokes a node's agent API key; the agent must be issued a new one. """
+    async def _revoke(session: AsyncSession) -> Optional[str]:
+        db_node = await session.get(models.Node, node_id)
+        if not db_node:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
+
+        previous_prefix = db_node.api_key_prefix
+        db_node.api_key_prefix = None
+        db_node.api_key_hash = None
+        await session.flush()
+        return previous_prefix
+
+    previous_prefix = await write_queue.submit(_revoke)
+    agent_keys.forget(previous_prefix)
+    return {"status": "success", "detail": f"API key of node {node_id} has been revoked"}
@@ -0,0 +1,494 @@
+"""
+Partitions - Time-partitioned event storage with partition-drop retention
+
+With EVENT_PARTITIONING set to "daily" or "weekly", events are stored in one
+partition per period instead of a single ever-growing table:
+
+- PostgreSQL: `events` becomes a natively range-partitioned table on
+  `timestamp`. The planner prunes partitions from the query's time bounds, and
+  each period is a `PARTITION OF events` that can be dropped on its own.
+- SQLite: each period is its own `events_pYYYYMMDD` table with the same columns
+  and indexes as `events`. Event IDs come from a shared sequence table so they
+  stay unique across partitions, and queries read from a UNION ALL of only the
+  partitions that overlap the requested time range.
+
+Retention (EVENT_RETENTION_DAYS) drops whole partitions once they fall entirely
+outside the window, which takes constant time regardless of how many rows a
+partition holds and does not bloat the database like row-by-row DELETEs. On
+SQLite each partition's full-text index is its own FTS5 table, dropped along
+with it.
+"""
+
+import asyncio
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from loguru import logger
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    PrimaryKeyConstraint,
+    String,
+    Table,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+    union_all,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+import models
+from db import AsyncSessionLocal, IS_POSTGRES, IS_SQLITE, add_missing_columns, write_queue
+from search import SEARCH_TABLE, partition_search_table, search_index
+
+# --- Configuration ---
+EVENT_PARTITIONING = os.getenv("EVENT_PARTITIONING", "none").lower()
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "0"))
+PARTITION_PRECREATE = int(os.getenv("PARTITION_PRECREATE", "2"))
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+PARTITIONING_ENABLED = EVENT_PARTITIONING in ("daily", "weekly") and (IS_SQLITE or IS_POSTGRES)
+
+PARTITION_PREFIX = "events_p"
+_PARTITION_NAME = re.compile(rf"^{PARTITION_PREFIX}(\d{{8}})$")
+
+EVENTS_TABLE: Table = models.Event.__table__
+
+_SQLITE_PARTITIONS_QUERY = "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'events_p%'"
+
+
+# ==============================================================================
+# Partition Naming
+# ==============================================================================
+
+def period_start(value: datetime) -> date:
+    """Returns the first day of the partition period containing `value`."""
+    day = value.date()
+    if EVENT_PARTITIONING == "weekly":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_end(start: date) -> date:
+    """Returns the (exclusive) first day after the period starting at `start`."""
+    return start + timedelta(days=7 if EVENT_PARTITIONING == "weekly" else 1)
+
+
+def partition_name(start: date) -> str:
+    return f"{PARTITION_PREFIX}{start:%Y%m%d}"
+
+
+def parse_partition_name(name: str) -> Optional[date]:
+    match = _PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d").date()
+
+
+def _overlapping(starts: List[date], start_time: Optional[datetime], end_time: Optional[datetime]) -> List[date]:
+    """Prunes partitions that cannot contain rows between start_time and end_time."""
+    selected = []
+    for start in starts:
+        if start_time is not None and period_end(start) <= start_time.date():
+            continue
+        if end_time is not None and start > end_time.date():
+            continue
+        selected.append(start)
+    return selected
+
+
+# ==============================================================================
+# Partition Manager
+# ==============================================================================
+
+class PartitionManager:
+    """Creates, lists, routes to and drops event partitions."""
+
+    def __init__(self, retention_days: int = 0, precreate: int = 2, check_interval: int = 3600):
+        """
+        Args:
+            retention_days: Drop partitions older than this many days (0 keeps everything)
+            precreate: How many future periods to create ahead of time
+            check_interval: How often to run maintenance (seconds)
+        """
+        self.retention_days = retention_days
+        self.precreate = precreate
+        self.check_interval = check_interval
+        self.running = False
+        self.task = None
+
+        # SQLite partition tables live in their own MetaData so they never take
+        # part in Base.metadata.create_all().
+        self._metadata = MetaData()
+        models.Node.__table__.to_metadata(self._metadata)
+        self._tables: Dict[str, Table] = {}
+        # Partitions known to exist. One created by a transaction is added only
+        # once the transaction commits, because a rollback (or a rolled back
+        # SAVEPOINT) takes the CREATE TABLE with it.
+        self._known: Set[str] = set()
+        event.listen(Session, "after_commit", self._on_commit)
+        event.listen(Session, "after_soft_rollback", self._on_rollback)
+        if PARTITIONING_ENABLED and IS_SQLITE:
+            search_index.route_partitions(self._search_table_of, self._search_tables_of)
+        self._id_sequence = Table(
+            "event_id_sequence",
+            self._metadata,
+            Column("name", String(50), primary_key=True),
+            Column("next_id", Integer, nullable=False),
+        )
+
+    # --------------------------------------------------------------------------
+    # Schema
+    # --------------------------------------------------------------------------
+
+    def prepare_schema(self, sync_conn) -> None:
+        """
+        Creates the partitioning scaffolding. Must run before
+        Base.metadata.create_all() so that on PostgreSQL the `events` table is
+        created as a partitioned table rather than a plain one.
+        """
+        if not PARTITIONING_ENABLED:
+            return
+
+        if IS_POSTGRES:
+            exists = sync_conn.execute(
+                text("SELECT c.relkind FROM pg_class c WHERE c.relname = 'events' AND pg_table_is_visible(c.oid)")
+            ).scalar()
+            if exists is None:
+                # The parent references nodes, so that table has to exist first.
+                models.Node.__table__.create(sync_conn, checkfirst=True)
+                self._postgres_parent_table().create(sync_conn)
+                sync_conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}default PARTITION OF events DEFAULT"))
+                logger.info("Created partitioned events table")
+            elif exists != "p":
+                logger.warning("Table 'events' exists and is not partitioned; EVENT_PARTITIONING has no effect on it")
+            return
+
+        # SQLite: the sequence keeps event IDs unique across partition tables.
+        self._id_sequence.create(sync_conn, checkfirst=True)
+        start_id = 1
+        if inspect(sync_conn).has_table("events"):
+            # Continue after any rows written before partitioning was enabled.
+            start_id = sync_conn.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM events")).scalar()
+        sync_conn.execute(
+            text("INSERT OR IGNORE INTO event_id_sequence (name, next_id) VALUES ('events', :start_id)"),
+            {"start_id": start_id},
+        )
+
+        # Bring partition tables created by an older schema up to date
+        names = sync_conn.execute(text(_SQLITE_PARTITIONS_QUERY)).scalars().all()
+        for name in names:
+            if parse_partition_name(name) is None:
+                continue
+            table = self._sqlite_partition_table(name)
+            add_missing_columns(sync_conn, table)
+            for index in table.indexes:
+                index.create(sync_conn, checkfirst=True)
+            search_index.create_table(sync_conn, partition_search_table(name))
+
+    def _postgres_parent_table(self) -> Table:
+        metadata = MetaData()
+        models.Node.__table__.to_metadata(metadata)
+        parent = EVENTS_TABLE.to_metadata(metadata)
+        # The partition key must be part of the primary key on PostgreSQL.
+        parent.c.timestamp.primary_key = True
+        parent.append_constraint(PrimaryKeyConstraint("id", "timestamp"))
+        parent.c.id.autoincrement = True
+        parent.dialect_options["postgresql"]["partition_by"] = "RANGE (timestamp)"
+        return parent
+
+    def _sqlite_partition_table(self, name: str) -> Table:
+        table = self._tables.get(name)
+        if table is None:
+            table = EVENTS_TABLE.to_metadata(self._metadata, name=name)
+            for index in table.indexes:
+                # Explicitly named indexes must be unique per database.
+                if not index.name.startswith(f"ix_{name}"):
+                    index.name = f"{index.name}_{name}"
+            self._tables[name] = table
+        return table
+
+    # Session.info key: transaction -> partitions it created
+    _PENDING = "created_partitions"
+
+    def _on_commit(self, session: Session) -> None:
+        # Also fired when a SAVEPOINT is released; only the outermost commit counts
+        if session.in_nested_transaction():
+            return
+        pending = session.info.pop(self._PENDING, None)
+        if pending:
+            for names in pending.values():
+                self._known.update(names)
+
+    def _on_rollback(self, session: Session, previous_transaction) -> None:
+        pending = session.info.get(self._PENDING)
+        if not pending:
+            return
+        # Forget what the rolled back transaction and its SAVEPOINTs created
+        for transaction in list(pending):
+            ancestor = transaction
+            while ancestor is not None and ancestor is not previous_transaction:
+                ancestor = ancestor.parent
+            if ancestor is not None:
+                del pending[transaction]
+
+    async def _create_partition(self, session: AsyncSession, start: date) -> str:
+        name = partition_name(start)
+        if name in self._known:
+            return name
+        sync_session = session.sync_session
+        pending = sync_session.info.setdefault(self._PENDING, {})
+        if any(name in names for names in pending.values()):
+            return name
+        # All of the partition's DDL (table, indexes, FTS5 table) in one
+        # SAVEPOINT. pysqlite in its legacy transaction mode runs DDL without a
+        # transaction unless DML opened one, so each statement would otherwise
+        # commit on its own and an interrupted create would leave a table with
+        # only some of its indexes. A SAVEPOINT opens a transaction if none is
+        # open (and commits it when released); inside one it is nested.
+        async with session.begin_nested():
+            if IS_POSTGRES:
+                end = period_end(start)
+                await session.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF events "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+            else:
+                table = self._sqlite_partition_table(name)
+
+                def _create(sync_session):
+                    connection = sync_session.connection()
+                    search_index.create_table(connection, partition_search_table(name))
+                    table.create(connection, checkfirst=True)
+
+                await session.run_sync(_create)
+        transaction = sync_session.get_nested_transaction() or sync_session.get_transaction()
+        pending.setdefault(transaction, set()).add(name)
+        logger.info(f"Created event partition {name}")
+        return name
+
+    def _search_table_of(self, event: models.Event) -> str:
+        """The FTS5 table indexing a stored event (SQLite)."""
+        return partition_search_table(partition_name(period_start(event.timestamp)))
+
+    def _search_tables_of(self, Event) -> List[str]:
+        """
+        The FTS5 tables covering an event source returned by event_source():
+        the shared one (events stored before partitioning) plus one per partition.
+        """
+        tables = [SEARCH_TABLE]
+        union = getattr(inspect(Event).selectable, "element", None)
+        for part in getattr(union, "selects", ()):
+            name = part.get_final_froms()[0].name
+            if parse_partition_name(name) is not None:
+                tables.append(partition_search_table(name))
+        return tables
+
+    async def list_partitions(self, session: AsyncSession) -> List[date]:
+        """Returns the start date of every existing partition, oldest first."""
+        if IS_POSTGRES:
+            stmt = text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'events'"
+            )
+        else:
+            stmt = text(_SQLITE_PARTITIONS_QUERY)
+        names = (await session.execute(stmt)).scalars().all()
+        return sorted(start for start in map(parse_partition_name, names) if start is not None)
+
+    # --------------------------------------------------------------------------
+    # Reads and writes
+    # --------------------------------------------------------------------------
+
+    async def event_source(
+        self,
+        session: AsyncSession,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+    ):
+        """
+        Returns the entity to select events from for the given time range.
+
+        This is `models.Event` itself unless SQLite partitioning is enabled, in
+        which case it is an alias of `models.Event` over a UNION ALL of the
+        partitions overlapping the range (plus the legacy `events` table, which
+        keeps any rows written before partitioning was enabled). PostgreSQL
+        prunes its native partitions from the query's timestamp predicates.
+        """
+        if not PARTITIONING_ENABLED or IS_POSTGRES:
+            return models.Event
+
+        starts = _overlapping(await self.list_partitions(session), start_time, end_time)
+        selects = [select(EVENTS_TABLE)]
+        selects += [select(self._sqlite_partition_table(partition_name(start))) for start in starts]
+        return aliased(models.Event, union_all(*selects).subquery("events_union"))
+
+    async def _allocate_ids(self, session: AsyncSession, count: int) -> int:
+        """Reserves `count` consecutive event IDs and returns the first one."""
+        stmt = (
+            update(self._id_sequence)
+            .where(self._id_sequence.c.name == "events")
+            .values(next_id=self._id_sequence.c.next_id + count)
+            .returning(self._id_sequence.c.next_id)
+        )
+        next_id = (await session.execute(stmt)).scalar_one()
+        return next_id - count
+
+    async def insert_events(self, session: AsyncSession, rows: List[Dict[str, Any]]) -> List[models.Event]:
+        """
+        Stores event rows with one multi-row INSERT per partition and returns
+        them as Event objects (with IDs and timestamps filled in).
+        """
+        if not PARTITIONING_ENABLED:
+            stmt = insert(models.Event).returning(models.Event, sort_by_parameter_order=True)
+            return list((await session.scalars(stmt, rows)).all())
+
+        now = datetime.utcnow()
+        for row in rows:
+            row.setdefault("timestamp", now)
+
+        if IS_POSTGRES:
+            # Routing is native; only make sure the target partitions exist so
+            # rows do not land in the default partition.
+            for start in {period_start(row["timestamp"]) for row in rows}:
+                await self._create_partition(session, start)
+            stmt = insert(models.Event).returning(models.Event, sort_by_parameter_order=True)
+            return list((await session.scalars(stmt, rows)).all())
+
+        first_id = await self._allocate_ids(session, len(rows))
+        for offset, row in enumerate(rows):
+            row["id"] = first_id + offset
+
+        by_partition: Dict[date, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_partition.setdefault(period_start(row["timestamp"]), []).append(row)
+        for start, partition_rows in by_partition.items():
+            name = await self._create_partition(session, start)
+            await session.execute(insert(self._sqlite_partition_table(name)), partition_rows)
+
+        return [models.Event(**row) for row in rows]
+
+    async def delete_node_events(self, session: AsyncSession, node_id: int) -> None:
+        """Deletes a node's events from every SQLite partition table."""
+        if not PARTITIONING_ENABLED or IS_POSTGRES:
+            return
+        for start in await self.list_partitions(session):
+            name = partition_name(start)
+            table = self._sqlite_partition_table(name)
+            node_event_ids = select(table.c.id).where(table.c.node_id == node_id)
+            await search_index.delete_events(session, node_event_ids, partition_search_table(name))
+            await session.execute(delete(table).where(table.c.node_id == node_id))
+
+    # --------------------------------------------------------------------------
+    # Maintenance: pre-creation and retention
+    # --------------------------------------------------------------------------
+
+    async def drop_partitions_before(self, cutoff: datetime) -> List[str]:
+        """Drops every partition whose whole period ends on or before `cutoff`."""
+        async def _drop(session: AsyncSession) -> List[str]:
+            dropped = []
+            for start in await self.list_partitions(session):
+                if period_end(start) > cutoff.date():
+                    continue
+                name = partition_name(start)
+                if IS_SQLITE:
+                    await self._delete_shared_search_entries(session, name)
+                await session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                if IS_SQLITE:
+                    await session.execute(text(f"DROP TABLE IF EXISTS {partition_search_table(name)}"))
+                self._known.discard(name)
+                self._tables.pop(name, None)
+                dropped.append(name)
+            return dropped
+
+        dropped = await write_queue.submit(_drop)
+        if dropped:
+            logger.info(f"Retention dropped {len(dropped)} event partitions: {', '.join(dropped)}")
+        return dropped
+
+    async def _delete_shared_search_entries(self, session: AsyncSession, name: str) -> None:
+        """Removes a SQLite partition's events from the shared FTS5 table, if any are in it."""
+        if not search_index.enabled:
+            return
+        # Only events indexed before partitions had their own FTS5 table are in
+        # the shared one; look for any in the partition's ID range first, so
+        # dropping a partition indexed the current way stays constant-time
+        table = self._sqlite_partition_table(name)
+        low, high = (await session.execute(select(func.min(table.c.id), func.max(table.c.id)))).one()
+        if low is None:
+            return
+        legacy = await session.execute(
+            text(f"SELECT 1 FROM {SEARCH_TABLE} WHERE rowid BETWEEN :low AND :high LIMIT 1"),
+            {"low": low, "high": high},
+        )
+        if legacy.first() is not None:
+            await search_index.delete_events(session, select(table.c.id))
+
+    async def run_maintenance(self) -> None:
+        """Creates upcoming partitions and applies the retention window."""
+        today = datetime.utcnow()
+
+        async def _precreate(session: AsyncSession) -> None:
+            start = period_start(today)
+            for _ in range(self.precreate + 1):
+                await self._create_partition(session, start)
+                start = period_end(start)
+
+        await write_queue.submit(_precreate)
+        if self.retention_days > 0:
+            await self.drop_partitions_before(today - timedelta(days=self.retention_days))
+
+    async def start(self):
+        """Start the partition maintenance task."""
+        if self.running or not PARTITIONING_ENABLED:
+            return
+        async with AsyncSessionLocal() as session:
+            self._known = {partition_name(start) for start in await self.list_partitions(session)}
+        self.running = True
+        self.task = asyncio.create_task(self._maintenance_loop())
+        logger.info(
+            f"PartitionManager started: partitioning={EVENT_PARTITIONING}, "
+            f"retention={self.retention_days or 'unlimited'} days"
+        )
+
+    async def stop(self):
+        """Stop the partition maintenance task."""
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        logger.info("PartitionManager stopped")
+
+    async def _maintenance_loop(self):
+        while self.running:
+            try:
+                await self.run_maintenance()
+                await asyncio.sleep(self.check_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error in partition maintenance: {e}")
+                await asyncio.sleep(self.check_interval)
+
+
+# Global instance
+partition_manager = PartitionManager(
+    retention_days=EVENT_RETENTION_DAYS,
+    precreate=PARTITION_PRECREATE,
+    check_interval=PARTITION_MAINTENANCE_INTERVAL,
+)
@@ -1,9 +1,9 @@
 # policies.py (With Password Confirmation for Deletions)
 
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from pydantic import BaseModel, TypeAdapter
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
@@ -11,7 +11,11 @@ from sqlalchemy.orm import selectinload
 import models
 import schemas
 import authentication
-from db import get_db
+from agent_channel import agent_manager
+from db import get_read_db, write_queue
+from fleet import read_fleet_version
+from policy_bundles import policy_bundles
+from response_cache import NODE_POLICIES, POLICIES, response_cache
 
 router = APIRouter(
     prefix="/policies",
@@ -24,6 +28,9 @@ class PolicyAssignmentRequest(BaseModel):
     policy_id: int
 
 
+_POLICY_LIST = TypeAdapter(List[schemas.PolicyResponse])
+
+
 @router.post(
     "",
     response_model=schemas.PolicyResponse,
@@ -32,22 +39,27 @@ class PolicyAssignmentRequest(BaseModel):
 )
 async def create_policy(
     policy_in: schemas.PolicyRequest,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """ Creates a new policy in the database. """
-    stmt = select(models.Policy).where(models.Policy.name == policy_in.name)
-    result = await db.execute(stmt)
-    if result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"Policy with name '{policy_in.name}' already exists.",
-        )
+    async def _create(session: AsyncSession) -> int:
+        stmt = select(models.Policy).where(models.Policy.name == policy_in.name)
+        result = await session.execute(stmt)
+        if result.scalar_one_or_none():
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Policy with name '{policy_in.name}' already exists.",
+            )
+
+        new_policy = models.Policy(**policy_in.model_dump())
+        session.add(new_policy)
+        await session.flush()
+        return new_policy.id
 
-    new_policy = models.Policy(**policy_in.model_dump())
-    db.add(new_policy)
-    await db.commit()
     # Get the ID to re-fetch the object with relationships loaded
-    new_policy_id = new_policy.id
+    new_policy_id = await write_queue.submit(_create)
+    # A new policy is not assigned to any node yet
+    response_cache.invalidate(POLICIES)
 
     # Eagerly load the object to prevent MissingGreenlet error
     stmt = (
@@ -66,12 +78,23 @@ async def create_policy(
     response_model=List[schemas.PolicyResponse],
     summary="List All Policies",
 )
-async def list_policies(db: AsyncSession = Depends(get_db)):
-    """ Fetches all policies, preloading assigned nodes for efficiency. """
+async def list_policies(db: AsyncSession = Depends(get_read_db)):
+    """
+    Fetches all policies, preloading assigned nodes for efficiency.
+    The serialized list is cached per fleet version, since it embeds the
+    assigned nodes' status.
+    """
+    cache_key = await read_fleet_version(db)
+    cached = response_cache.get(POLICIES, cache_key)
+    if cached is not None:
+        return cached.response()
+    generation = response_cache.generation(POLICIES)
+
     stmt = select(models.Policy).options(selectinload(models.Policy.assigned_nodes))
     result = await db.execute(stmt)
     policies = result.scalars().unique().all()
-    return [schemas.PolicyResponse.model_validate(p) for p in policies]
+    body = _POLICY_LIST.dump_json([schemas.PolicyResponse.model_validate(p) for p in policies])
+    return response_cache.put(POLICIES, cache_key, body, generation=generation).response()
 
 
 @router.get(
@@ -79,8 +102,17 @@ async def list_policies(db: AsyncSession = Depends(get_db)):
     response_model=List[schemas.PolicyResponse],
     summary="Get Policies for a Specific Node",
 )
-async def get_policies_for_node(node_id: int, db: AsyncSession = Depends(get_db)):
-    """ Fetches a specific node and returns its list of assigned policies. """
+async def get_policies_for_node(node_id: int, db: AsyncSession = Depends(get_read_db)):
+    """
+    Fetches a specific node and returns its list of assigned policies.
+    Cached like list_policies, per node.
+    """
+    cache_key = (node_id, await read_fleet_version(db))
+    cached = response_cache.get(NODE_POLICIES, cache_key)
+    if cached is not None:
+        return cached.response()
+    generation = response_cache.generation(NODE_POLICIES)
+
     stmt = (
         select(models.Node)
         .where(models.Node.id == node_id)
@@ -94,7 +126,49 @@ async def get_policies_for_node(node_id: int, db: AsyncSession = Depends(get_db)
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Node with ID {node_id} not found.",
         )
-    return [schemas.PolicyResponse.model_validate(p) for p in node.policies]
+    body = _POLICY_LIST.dump_json([schemas.PolicyResponse.model_validate(p) for p in node.policies])
+    return response_cache.put(NODE_POLICIES, cache_key, body, generation=generation).response()
+
+
+@router.get(
+    "/{node_id}/bundle",
+    summary="Get a Node's Compiled Policy Bundle",
+    description=(
+        "Agent endpoint (X-API-Key). Returns `{\"version\", \"policies\"}`, where `version` is the "
+        "SHA-256 of the policies and is also the `ETag`. An agent passing its current version as "
+        "`since` gets a delta `{\"version\", \"base\", \"upserts\", \"removed\"}` instead, or "
+        "`304 Not Modified` when nothing changed (as with `If-None-Match`). A `since` the server "
+        "does not know gets the full bundle."
+    ),
+)
+async def get_policy_bundle(
+    node_id: int,
+    since: Optional[str] = Query(None, description="The bundle version the agent has."),
+    if_none_match: Optional[str] = Header(None),
+    key_node_id: Optional[int] = Depends(authentication.verify_api_key),
+):
+    """
+    Serves a node's effective policy from the compiled bundle cache; nothing
+    is queried unless the node's assignments changed since the last request.
+    """
+    if key_node_id is not None and key_node_id != node_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The API key does not belong to this node.",
+        )
+    bundle = await policy_bundles.get(node_id)
+    if bundle is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Node with ID {node_id} not found.",
+        )
+
+    headers = {"ETag": f'"{bundle.version}"', "Cache-Control": "no-cache"}
+    known = since or (if_none_match or "").strip().removeprefix("W/").strip('"')
+    if known == bundle.version:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = policy_bundles.delta(bundle, since) if since else None
+    return Response(content=body or bundle.body, media_type="application/json", headers=headers)
 
 
 @router.post(
@@ -105,32 +179,42 @@ async def get_policies_for_node(node_id: int, db: AsyncSession = Depends(get_db)
 )
 async def assign_policy_to_node(
     assignment: PolicyAssignmentRequest,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """ Creates an association between a node and a policy. """
-    node_stmt = (
-        select(models.Node)
-        .where(models.Node.id == assignment.node_id)
-        .options(selectinload(models.Node.policies))
-    )
-    node_result = await db.execute(node_stmt)
-    node = node_result.scalar_one_or_none()
-    if not node:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Node with ID {assignment.node_id} not found.",
+    async def _assign(session: AsyncSession) -> bool:
+        node_stmt = (
+            select(models.Node)
+            .where(models.Node.id == assignment.node_id)
+            .options(selectinload(models.Node.policies))
         )
+        node_result = await session.execute(node_stmt)
+        node = node_result.scalar_one_or_none()
+        if not node:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Node with ID {assignment.node_id} not found.",
+            )
 
-    policy = await db.get(models.Policy, assignment.policy_id)
-    if not policy:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Policy with ID {assignment.policy_id} not found.",
-        )
+        policy = await session.get(models.Policy, assignment.policy_id)
+        if not policy:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Policy with ID {assignment.policy_id} not found.",
+            )
 
-    if policy not in node.policies:
+        if policy in node.policies:
+            return False
         node.policies.append(policy)
-        await db.commit()
+        await session.flush()
+        return True
+
+    if await write_queue.submit(_assign):
+        # Every response showing the policy lists its nodes
+        response_cache.invalidate(POLICIES, NODE_POLICIES)
+        policy_bundles.invalidate([assignment.node_id])
+        # Push the new assignment to the node's agent if it is connected
+        await agent_manager.push_policies([assignment.node_id])
     
     # Re-fetch node to ensure all relationships are fresh for validation
     final_node_stmt = (
@@ -153,40 +237,38 @@ async def assign_policy_to_node(
 async def delete_policy(
     policy_id: int,
     delete_request: schemas.DeleteConfirmation,
-    db: AsyncSession = Depends(get_db)
 ):
     """ 
     Deletes a policy by its unique ID.
     Requires admin password confirmation to prevent accidental deletions.
     """
-    # Verify admin password
-    result = await db.execute(
-        select(models.User).where(models.User.username == "admin")
-    )
-    admin_user = result.scalar_one_or_none()
-    
-    if not admin_user:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Admin user not found"
-        )
-    
-    if not authentication.verify_password(delete_request.password, admin_user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid admin password"
-        )
-    
-    # Find and delete the policy
-    policy_to_delete = await db.get(models.Policy, policy_id)
+    # Verify admin password (before the write below is queued, so bcrypt never holds a connection)
+    await authentication.verify_admin_password(delete_request.password)
 
-    if not policy_to_delete:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Policy with ID {policy_id} not found."
+    async def _delete(session: AsyncSession) -> List[int]:
+        # Find and delete the policy
+        policy_to_delete = await session.get(models.Policy, policy_id)
+
+        if not policy_to_delete:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Policy with ID {policy_id} not found."
+            )
+
+        # Agents that had the policy get their updated policy list
+        assigned = await session.execute(
+            select(models.node_policy_association.c.node_id)
+            .where(models.node_policy_association.c.policy_id == policy_id)
         )
+        affected_node_ids = assigned.scalars().all()
+
+        await session.delete(policy_to_delete)
+        await session.flush()
+        return affected_node_ids
 
-    await db.delete(policy_to_delete)
-    await db.commit()
+    affected_node_ids = await write_queue.submit(_delete)
+    response_cache.invalidate(POLICIES, NODE_POLICIES)
+    policy_bundles.invalidate(affected_node_ids)
+    await agent_manager.push_policies(affected_node_ids)
 
     return {"status": "success", "detail": f"Policy with ID {policy_id} deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,186 @@
+"""
+Policy Bundles - Compiled, content-hashed policy sets for agents
+
+An agent's effective policy is the list of policies assigned to its node. It
+is compiled once into a bundle:
+
+    {"version": "<sha256>", "policies": [<policy>, ...]}
+
+The policies are in the agent format (no assigned-node lists), ordered by ID,
+and the version is the SHA-256 of their canonical JSON. Nodes with the same
+policies therefore share one bundle, and its serialized bytes are kept ready
+to send. An agent that knows its current version either gets a 304 (nothing
+changed) or a delta against it:
+
+    {"version": "<new>", "base": "<old>", "upserts": [<policy>, ...], "removed": [<id>, ...]}
+
+A node's bundle is recompiled only after an assignment involving the node
+changes or one of its policies is deleted; the handlers doing so invalidate
+it. Bundles no node uses any more are kept (up to POLICY_BUNDLE_CACHE_SIZE) as
+delta bases. Invalidations reach only this process, so a node's bundle is also
+recompiled after POLICY_BUNDLE_TTL seconds, which bounds how long another
+worker process can serve it after a change.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+
+import models
+import schemas
+from db import ReadSessionLocal
+
+# --- Configuration ---
+POLICY_BUNDLE_TTL = float(os.getenv("POLICY_BUNDLE_TTL", "300"))
+POLICY_BUNDLE_CACHE_SIZE = int(os.getenv("POLICY_BUNDLE_CACHE_SIZE", "10000"))
+
+
+def _canonical(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+
+
+class PolicyBundle(NamedTuple):
+    version: str
+    # Policy ID -> policy in the agent format, in ID order
+    policies: Dict[int, dict]
+    # Policy ID -> SHA-256 of the policy, for deltas
+    hashes: Dict[int, str]
+    # The serialized full bundle
+    body: bytes
+
+
+def compile_bundle(policies: List[dict]) -> PolicyBundle:
+    """Builds a bundle from a node's policies (agent format)."""
+    policies = sorted(policies, key=lambda policy: policy["id"])
+    version = hashlib.sha256(_canonical(policies)).hexdigest()
+    return PolicyBundle(
+        version=version,
+        policies={policy["id"]: policy for policy in policies},
+        hashes={policy["id"]: hashlib.sha256(_canonical(policy)).hexdigest() for policy in policies},
+        body=_canonical({"version": version, "policies": policies}),
+    )
+
+
+class PolicyBundleCache:
+    """Compiled policy bundles, shared by content, and the bundle each node uses."""
+
+    def __init__(self, ttl: float = 300, max_bundles: int = 10000):
+        """
+        Args:
+            ttl: How long a node's bundle is used before it is compiled again (seconds)
+            max_bundles: Distinct bundles kept at most (the least recently used are dropped)
+        """
+        self.ttl = ttl
+        self.max_bundles = max_bundles
+        # Version -> bundle
+        self._bundles: "OrderedDict[str, PolicyBundle]" = OrderedDict()
+        # Node ID -> (version of its bundle, expiry)
+        self._nodes: Dict[int, Tuple[str, float]] = {}
+        # Advanced by every invalidation; compiles that raced one are not recorded
+        self._generation = 0
+        self.compiles = 0
+
+    def _remember(self, bundle: PolicyBundle) -> PolicyBundle:
+        """Stores a bundle, or returns the identical one already stored."""
+        existing = self._bundles.get(bundle.version)
+        if existing is not None:
+            self._bundles.move_to_end(bundle.version)
+            return existing
+        self._bundles[bundle.version] = bundle
+        while len(self._bundles) > self.max_bundles:
+            self._bundles.popitem(last=False)
+        return bundle
+
+    def _cached(self, node_id: int) -> Optional[PolicyBundle]:
+        entry = self._nodes.get(node_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        bundle = self._bundles.get(entry[0])
+        if bundle is not None:
+            self._bundles.move_to_end(entry[0])
+        return bundle
+
+    async def get_many(self, node_ids: Iterable[int]) -> Dict[int, PolicyBundle]:
+        """
+        Returns the bundle of each node, compiling the ones not cached in one query.
+
+        Returns:
+            Node ID -> bundle; nodes that do not exist are left out
+        """
+        bundles: Dict[int, PolicyBundle] = {}
+        missing = []
+        for node_id in set(node_ids):
+            bundle = self._cached(node_id)
+            if bundle is None:
+                missing.append(node_id)
+            else:
+                bundles[node_id] = bundle
+        if not missing:
+            return bundles
+
+        generation = self._generation
+        association = models.node_policy_association
+        policies: Dict[int, List[dict]] = {}
+        async with ReadSessionLocal() as session:
+            existing = await session.execute(select(models.Node.id).where(models.Node.id.in_(missing)))
+            for node_id in existing.scalars():
+                policies[node_id] = []
+            assigned = await session.execute(
+                select(association.c.node_id, models.Policy)
+                .join(models.Policy, models.Policy.id == association.c.policy_id)
+                .where(association.c.node_id.in_(list(policies)))
+            )
+            for node_id, policy in assigned.all():
+                policies[node_id].append(schemas.AgentPolicy.model_validate(policy).model_dump(mode="json"))
+
+        expires = time.monotonic() + self.ttl
+        for node_id, node_policies in policies.items():
+            bundle = self._remember(compile_bundle(node_policies))
+            self.compiles += 1
+            if generation == self._generation:
+                self._nodes[node_id] = (bundle.version, expires)
+            bundles[node_id] = bundle
+        return bundles
+
+    async def get(self, node_id: int) -> Optional[PolicyBundle]:
+        """Returns a node's bundle, or None if the node does not exist."""
+        return (await self.get_many([node_id])).get(node_id)
+
+    def delta(self, bundle: PolicyBundle, since: str) -> Optional[bytes]:
+        """
+        Serializes the changes from bundle `since` to `bundle`.
+
+        Returns:
+            The delta, or None if `since` is not known (send the full bundle)
+        """
+        base = self._bundles.get(since)
+        if base is None:
+            return None
+        return _canonical({
+            "version": bundle.version,
+            "base": since,
+            "upserts": [
+                policy for policy_id, policy in bundle.policies.items()
+                if base.hashes.get(policy_id) != bundle.hashes[policy_id]
+            ],
+            "removed": [policy_id for policy_id in base.policies if policy_id not in bundle.policies],
+        })
+
+    def invalidate(self, node_ids: Iterable[int]) -> None:
+        """Recompile the bundles of these nodes on their next use."""
+        self._generation += 1
+        for node_id in node_ids:
+            self._nodes.pop(node_id, None)
+
+    def stats(self) -> dict:
+        """Number of bundles and nodes cached, and compiles so far."""
+        return {"bundles": len(self._bundles), "nodes": len(self._nodes), "compiles": self.compiles}
+
+
+# Global instance
+policy_bundles = PolicyBundleCache(ttl=POLICY_BUNDLE_TTL, max_bundles=POLICY_BUNDLE_CACHE_SIZE)
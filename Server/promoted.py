@@ -0,0 +1,143 @@
+"""
+Promoted - Hot details fields copied into typed, indexed event columns
+
+Most event queries filter on a handful of fields inside `Event.details`. Those
+fields are extracted once, at ingest time, into real columns on `events`
+(each with a (column, timestamp, id) index), so filtering on them is an index
+range scan instead of a JSON scan of every row.
+
+String fields (everything except the port) are interned: the column holds
+the ID of the value in `interned_strings`, which keeps both the rows and the
+indexes small. API responses carry the expanded strings.
+
+Each promoted column is filled from the first JSON path that is present in the
+event's details. The defaults cover the field names sent by the Windows agent
+and used by the detection rules; PROMOTED_FIELDS overrides the paths per
+column as a JSON object, e.g.
+
+    PROMOTED_FIELDS={"process_path": ["process_path", "image.path"]}
+
+Paths are dot-separated keys into nested objects. Only events ingested after a
+path is configured are extracted.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+# Promoted field -> (Python type, maximum length for strings)
+PROMOTED_COLUMNS: Dict[str, tuple] = {
+    "process_name": (str, 255),
+    "parent_process_name": (str, 255),
+    "process_path": (str, 1024),
+    "destination_ip": (str, 45),
+    "destination_port": (int, None),
+    "registry_key": (str, 1024),
+}
+
+# Integer columns are 32-bit INTEGERs on every backend
+INT_COLUMN_RANGE = (-2**31, 2**31 - 1)
+
+_INTEGRAL = re.compile(r"[+-]?\d{1,19}")
+
+# String fields are stored as references into the interned string table
+INTERNED_FIELDS: Dict[str, str] = {
+    column: f"{column}_id" for column, (python_type, _) in PROMOTED_COLUMNS.items() if python_type is str
+}
+
+DEFAULT_PROMOTED_PATHS: Dict[str, List[str]] = {
+    "process_name": ["process_name"],
+    "parent_process_name": ["parent_process_name"],
+    "process_path": ["process_path", "executable_path"],
+    "destination_ip": ["destination_ip", "remote_address", "dst_ip"],
+    "destination_port": ["destination_port", "remote_port", "dst_port"],
+    "registry_key": ["registry_key", "registry_path"],
+}
+
+
+def load_promoted_paths() -> Dict[str, List[List[str]]]:
+    """Returns the configured JSON paths per promoted column, split into keys."""
+    paths = dict(DEFAULT_PROMOTED_PATHS)
+    override = os.getenv("PROMOTED_FIELDS")
+    if override:
+        try:
+            for column, column_paths in json.loads(override).items():
+                if column not in PROMOTED_COLUMNS:
+                    logger.warning(f"PROMOTED_FIELDS: unknown column '{column}' ignored")
+                    continue
+                paths[column] = [column_paths] if isinstance(column_paths, str) else list(column_paths)
+        except (ValueError, AttributeError) as e:
+            logger.error(f"PROMOTED_FIELDS is not a valid JSON object, using defaults: {e}")
+    return {column: [path.split(".") for path in column_paths] for column, column_paths in paths.items()}
+
+
+PROMOTED_PATHS = load_promoted_paths()
+
+
+def _lookup(details: Any, keys: List[str]) -> Any:
+    for key in keys:
+        if not isinstance(details, dict):
+            return None
+        details = details.get(key)
+    return details
+
+
+def _coerce(value: Any, python_type: type, max_length: Optional[int]) -> Any:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if python_type is int:
+        # Only whole numbers: not booleans, not floats (8.9 is not port 8), and
+        # nothing the column cannot hold; anything else is simply not promoted
+        if isinstance(value, str) and _INTEGRAL.fullmatch(value.strip()):
+            value = int(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            return None
+        low, high = INT_COLUMN_RANGE
+        return value if low <= value <= high else None
+    value = str(value)
+    # A truncated value would not match a filter on the full value, so values
+    # that do not fit stay in details only
+    if max_length and len(value) > max_length:
+        return None
+    return value
+
+
+def extract_promoted(details: Any) -> Dict[str, Any]:
+    """
+    Extracts the promoted column values from an event's details.
+
+    Returns:
+        A dict with every promoted column; columns with no matching path are None.
+    """
+    values = {}
+    for column, (python_type, max_length) in PROMOTED_COLUMNS.items():
+        value = None
+        for keys in PROMOTED_PATHS[column]:
+            value = _coerce(_lookup(details, keys), python_type, max_length)
+            if value is not None:
+                break
+        values[column] = value
+    return values
+
+
+def promoted_columns(values: Dict[str, Any], string_ids: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Maps extracted promoted values to event column values.
+
+    Args:
+        values: The output of extract_promoted()
+        string_ids: Interned string IDs covering every string value
+
+    Returns:
+        A dict keyed by event column name
+    """
+    columns = {}
+    for field, value in values.items():
+        if field in INTERNED_FIELDS:
+            columns[INTERNED_FIELDS[field]] = string_ids.get(value) if value is not None else None
+        else:
+            columns[field] = value
+    return columns
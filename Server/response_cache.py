@@ -0,0 +1,164 @@
+"""
+Response Cache - Serialized responses of the list endpoints
+
+`GET /nodes`, `GET /policies` and `GET /policies/{node_id}` change rarely but
+are polled constantly. Their responses are kept here as ready-to-send JSON
+bytes, so a hit costs neither a query nor Pydantic validation and
+serialization. Entries are grouped by namespace (one per endpoint) and keyed
+by the request parameters.
+
+The handlers that change nodes and policies invalidate the namespaces whose
+responses the change shows, right after their commit. Each namespace has a
+generation number that every invalidation advances. A response read before an
+invalidation but finished after it carries the old generation and is not
+stored, so a slow reader cannot put stale data back into the cache.
+
+Entries expire after RESPONSE_CACHE_TTL seconds (0 disables the cache). The
+least recently used ones are dropped beyond RESPONSE_CACHE_SIZE entries or
+RESPONSE_CACHE_MAX_BYTES bytes. Invalidations reach only this process; other
+worker processes serve their copy until it expires.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional, Set, Tuple
+
+from fastapi import Response
+
+# --- Configuration ---
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Namespaces
+NODES = "nodes"
+POLICIES = "policies"
+NODE_POLICIES = "node_policies"
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    headers: Dict[str, str]
+    expires: float
+
+    def response(self) -> Response:
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
+
+
+class ResponseCache:
+    """LRU cache of serialized JSON responses with per-namespace invalidation."""
+
+    def __init__(self, ttl: float = 30, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            ttl: How long a response is served from the cache (seconds, 0 disables caching)
+            max_entries: Responses kept at most
+            max_bytes: Total size of the responses kept at most
+        """
+        self.enabled = ttl > 0 and max_entries > 0
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, Hashable], CachedResponse]" = OrderedDict()
+        self._keys: Dict[str, Set[Hashable]] = {}
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+        # Namespace -> [hits, misses, invalidations]
+        self._counters: Dict[str, list] = {}
+
+    def _count(self, namespace: str, index: int) -> None:
+        self._counters.setdefault(namespace, [0, 0, 0])[index] += 1
+
+    def generation(self, namespace: str) -> int:
+        """Current generation of a namespace; take it before reading what will be cached."""
+        return self._generations.get(namespace, 0)
+
+    def get(self, namespace: str, key: Hashable) -> Optional[CachedResponse]:
+        """Returns the cached response for `key`, or None (counted as a miss)."""
+        if not self.enabled:
+            return None
+        entry = self._entries.get((namespace, key))
+        if entry is not None and entry.expires < time.monotonic():
+            self._remove((namespace, key))
+            entry = None
+        if entry is None:
+            self._count(namespace, 1)
+            return None
+        self._entries.move_to_end((namespace, key))
+        self._count(namespace, 0)
+        return entry
+
+    def put(
+        self,
+        namespace: str,
+        key: Hashable,
+        body: bytes,
+        headers: Optional[Dict[str, str]] = None,
+        generation: Optional[int] = None,
+    ) -> CachedResponse:
+        """
+        Caches a serialized response.
+
+        Args:
+            generation: The namespace's generation when the data was read; the
+                response is not stored if the namespace was invalidated since
+
+        Returns:
+            The entry (also when it was not stored), ready to be sent
+        """
+        entry = CachedResponse(body, dict(headers or {}), time.monotonic() + self.ttl)
+        if (
+            not self.enabled
+            or len(body) > self.max_bytes
+            or (generation is not None and generation != self.generation(namespace))
+        ):
+            return entry
+        self._remove((namespace, key))
+        self._entries[(namespace, key)] = entry
+        self._keys.setdefault(namespace, set()).add(key)
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, cache_key: Tuple[str, Hashable]) -> None:
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+            self._keys[cache_key[0]].discard(cache_key[1])
+
+    def invalidate(self, *namespaces: str) -> None:
+        """Drops every cached response of the given namespaces."""
+        for namespace in namespaces:
+            self._generations[namespace] = self.generation(namespace) + 1
+            self._count(namespace, 2)
+            for key in list(self._keys.get(namespace, ())):
+                self._remove((namespace, key))
+
+    def stats(self) -> dict:
+        """Hit rates and size of the cache, per namespace."""
+        namespaces = {}
+        for namespace, (hits, misses, invalidations) in sorted(self._counters.items()):
+            lookups = hits + misses
+            namespaces[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+                "invalidations": invalidations,
+                "entries": len(self._keys.get(namespace, ())),
+            }
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "namespaces": namespaces,
+        }
+
+
+# Global instance
+response_cache = ResponseCache(
+    ttl=RESPONSE_CACHE_TTL,
+    max_entries=RESPONSE_CACHE_SIZE,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+)
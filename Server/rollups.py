@@ -0,0 +1,282 @@
+"""
+Rollups - Incremental event statistics by minute, hour and day
+
+Every ingested event increments one counter per granularity in the
+`event_rollups` table, inside the same transaction that stores the event, so
+the counts are exact and durable. Statistics queries (time-bucketed histograms
+and top-N breakdowns) read only these small pre-aggregated rows and therefore
+cost the same no matter how large the raw events table grows.
+
+A background compactor prunes fine-grained rollups past their retention
+(minute rows after ROLLUP_MINUTE_RETENTION_HOURS, hour rows after
+ROLLUP_HOUR_RETENTION_DAYS); day rows are kept.
+"""
+
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from db import IS_POSTGRES, write_queue
+
+# --- Configuration ---
+ROLLUP_MINUTE_RETENTION_HOURS = int(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", "48"))
+ROLLUP_HOUR_RETENTION_DAYS = int(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", "90"))
+ROLLUP_COMPACT_INTERVAL = int(os.getenv("ROLLUP_COMPACT_INTERVAL", "3600"))
+
+GRANULARITIES = ("minute", "hour", "day")
+
+_KEY_COLUMNS = ("granularity", "bucket", "node_id", "group", "severity", "event_type")
+
+
+def truncate(value: datetime, granularity: str) -> datetime:
+    """Returns the start of the `granularity` bucket containing `value`."""
+    if granularity == "minute":
+        return value.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def retained_from(granularity: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Returns the oldest `granularity` bucket the compactor keeps, or None if
+    rows of that granularity are never pruned.
+    """
+    keep = rollup_compactor.retention.get(granularity)
+    if keep is None:
+        return None
+    return (now or datetime.utcnow()) - keep
+
+
+def is_retained(granularity: str, start_time: datetime) -> bool:
+    """Whether `granularity` rows covering `start_time` onwards are still kept."""
+    oldest = retained_from(granularity)
+    return oldest is None or truncate(start_time, granularity) >= oldest
+
+
+def choose_granularity(start_time: datetime, end_time: datetime) -> str:
+    """
+    Picks the coarsest granularity that still gives a useful histogram, or a
+    coarser one if its rows for `start_time` have already been pruned.
+    """
+    span = end_time - start_time
+    if span <= timedelta(hours=2):
+        preferred = "minute"
+    elif span <= timedelta(days=7):
+        preferred = "hour"
+    else:
+        preferred = "day"
+    for granularity in GRANULARITIES[GRANULARITIES.index(preferred):]:
+        if is_retained(granularity, start_time):
+            return granularity
+    return "day"
+
+
+# ==============================================================================
+# Ingest-time maintenance
+# ==============================================================================
+
+async def record_events(
+    session: AsyncSession,
+    events: Iterable[models.Event],
+    node_groups: Dict[int, Optional[str]],
+) -> None:
+    """
+    Adds newly stored events to the rollup counters.
+
+    Events of the same key within the batch are summed first, so the counters
+    are updated with a single multi-row upsert per call. The rows are sorted by
+    key, so concurrent batches lock the counters they share in the same order
+    (on PostgreSQL they would otherwise be able to deadlock).
+    """
+    counts: Counter = Counter()
+    for event in events:
+        group = node_groups.get(event.node_id) or ""
+        for granularity in GRANULARITIES:
+            key = (granularity, truncate(event.timestamp, granularity), event.node_id,
+                   group, event.severity, event.event_type)
+            counts[key] += 1
+    if not counts:
+        return
+
+    rows = [dict(zip(_KEY_COLUMNS, key), count=count) for key, count in sorted(counts.items())]
+    dialect_insert = postgres_insert if IS_POSTGRES else sqlite_insert
+    stmt = dialect_insert(models.EventRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(_KEY_COLUMNS),
+        set_={"count": models.EventRollup.count + stmt.excluded["count"]},
+    )
+    await session.execute(stmt, rows)
+
+
+async def delete_node_rollups(session: AsyncSession, node_id: int) -> None:
+    """Removes a deleted node's counters."""
+    await session.execute(delete(models.EventRollup).where(models.EventRollup.node_id == node_id))
+
+
+# ==============================================================================
+# Statistics queries
+# ==============================================================================
+
+BREAKDOWN_DIMENSIONS = {
+    "by_severity": models.EventRollup.severity,
+    "by_event_type": models.EventRollup.event_type,
+    "by_node": models.EventRollup.node_id,
+    "by_group": models.EventRollup.group,
+}
+
+
+async def query_stats(
+    session: AsyncSession,
+    start_time: datetime,
+    end_time: datetime,
+    granularity: str,
+    node_id: Optional[int] = None,
+    group: Optional[str] = None,
+    severity: Optional[str] = None,
+    event_type: Optional[str] = None,
+    top: int = 10,
+) -> dict:
+    """
+    Builds a histogram and top-N breakdowns from the rollup table.
+
+    Buckets are included whole, so counts are exact at bucket granularity.
+    """
+    Rollup = models.EventRollup
+    conditions = [
+        Rollup.granularity == granularity,
+        Rollup.bucket >= truncate(start_time, granularity),
+        Rollup.bucket <= end_time,
+    ]
+    if node_id is not None:
+        conditions.append(Rollup.node_id == node_id)
+    if group is not None:
+        conditions.append(Rollup.group == group)
+    if severity is not None:
+        conditions.append(Rollup.severity == severity)
+    if event_type is not None:
+        conditions.append(Rollup.event_type == event_type)
+
+    total_count = func.sum(Rollup.count)
+
+    histogram_stmt = (
+        select(Rollup.bucket, total_count)
+        .where(*conditions)
+        .group_by(Rollup.bucket)
+        .order_by(Rollup.bucket)
+    )
+    histogram = [
+        {"bucket": bucket, "count": int(count)}
+        for bucket, count in (await session.execute(histogram_stmt)).all()
+    ]
+
+    stats = {
+        "interval": granularity,
+        "start_time": start_time,
+        "end_time": end_time,
+        "total": sum(item["count"] for item in histogram),
+        "histogram": histogram,
+    }
+    for name, column in BREAKDOWN_DIMENSIONS.items():
+        stmt = (
+            select(column, total_count)
+            .where(*conditions)
+            .group_by(column)
+            .order_by(total_count.desc())
+            .limit(top)
+        )
+        stats[name] = [
+            {"key": key, "count": int(count)}
+            for key, count in (await session.execute(stmt)).all()
+        ]
+    return stats
+
+
+# ==============================================================================
+# Background compactor
+# ==============================================================================
+
+class RollupCompactor:
+    """Prunes minute and hour rollups that are past their retention."""
+
+    def __init__(self, minute_retention_hours: int = 48, hour_retention_days: int = 90, check_interval: int = 3600):
+        """
+        Args:
+            minute_retention_hours: How long per-minute counters are kept
+            hour_retention_days: How long per-hour counters are kept
+            check_interval: How often to prune (seconds)
+        """
+        self.retention: Dict[str, timedelta] = {
+            "minute": timedelta(hours=minute_retention_hours),
+            "hour": timedelta(days=hour_retention_days),
+        }
+        self.check_interval = check_interval
+        self.running = False
+        self.task = None
+
+    async def compact(self) -> int:
+        now = datetime.utcnow()
+
+        async def _prune(session: AsyncSession) -> int:
+            removed = 0
+            for granularity, keep in self.retention.items():
+                result = await session.execute(
+                    delete(models.EventRollup).where(
+                        models.EventRollup.granularity == granularity,
+                        models.EventRollup.bucket < now - keep,
+                    )
+                )
+                removed += result.rowcount or 0
+            return removed
+
+        removed = await write_queue.submit(_prune)
+        if removed:
+            logger.info(f"RollupCompactor pruned {removed} expired rollup rows")
+        return removed
+
+    async def start(self):
+        """Start the rollup compaction task."""
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._compact_loop())
+
+    async def stop(self):
+        """Stop the rollup compaction task."""
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def _compact_loop(self):
+        while self.running:
+            try:
+                await self.compact()
+                await asyncio.sleep(self.check_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error compacting rollups: {e}")
+                await asyncio.sleep(self.check_interval)
+
+
+# Global instance
+rollup_compactor = RollupCompactor(
+    minute_retention_hours=ROLLUP_MINUTE_RETENTION_HOURS,
+    hour_retention_days=ROLLUP_HOUR_RETENTION_DAYS,
+    check_interval=ROLLUP_COMPACT_INTERVAL,
+)
@@ -5,6 +5,8 @@ from collections import deque
 from datetime import datetime, timedelta
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
+from baselines import baseline_tracker
+
 # --- Basic Logging Configuration ---
 logging.basicConfig(
     level=logging.INFO,
@@ -156,6 +158,19 @@ def _rule_high_frequency_outbound_connections(event: Dict[str, Any]) -> Optional
     return None
 
 
+def _rule_baseline_rate_deviation(event: Dict[str, Any]) -> Optional[str]:
+    """Detects an event rate far above the node's learned baseline for that event type."""
+    node_id = event.get("node_id")
+    event_type = event.get("event_type")
+    if not isinstance(node_id, int) or not event_type:
+        return None
+
+    # Stateful: the per-node baselines are learned from every event seen
+    if baseline_tracker.observe(node_id, event_type) is not None:
+        return "BASELINE_RATE_DEVIATION"
+    return None
+
+
 # --- Rule Registry ---
 # A list of all rule functions to be evaluated. To add a new rule,
 # simply define a new function and add it to this list.
@@ -163,6 +178,7 @@ ALL_RULES: List[Callable[[Dict[str, Any]], Optional[str]]] = [
     _rule_unsigned_executable_in_user_dir,
     _rule_suspicious_parent_child_process,
     _rule_high_frequency_outbound_connections,
+    _rule_baseline_rate_deviation,
 ]
 
 
@@ -3,9 +3,11 @@
 from __future__ import annotations
 
 import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from compression import details_codec
 
 
 # ==============================================================================
@@ -52,6 +54,20 @@ class NodeResponse(NodeBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class NodeRegisterResponse(NodeResponse):
+    """
+    Schema for the registration response.
+    Carries the node's own agent API key when one was issued for it.
+    """
+    api_key: Optional[str] = Field(None, description="The node's agent API key; only returned when it is issued.")
+
+
+class NodeApiKeyResponse(BaseModel):
+    """Schema for a newly issued per-node agent API key (shown only once)."""
+    node_id: int
+    api_key: str
+
+
 # ==============================================================================
 # Event Schemas
 # ==============================================================================
@@ -68,14 +84,58 @@ class EventIngestRequest(EventBase):
     node_id: int = Field(..., description="The ID of the node that generated the event.")
 
 
+class EventBatchIngestRequest(BaseModel):
+    """Schema for ingesting many events from a node in a single request."""
+    events: List[EventIngestRequest] = Field(..., min_length=1, max_length=1000, description="The events to ingest.")
+
+
 class EventResponse(EventBase):
     """Schema for representing an Event in API responses."""
     id: int
     node_id: int
     timestamp: datetime.datetime
 
+    # Promoted details fields, expanded from their interned string IDs
+    process_name: Optional[str] = None
+    parent_process_name: Optional[str] = None
+    process_path: Optional[str] = None
+    destination_ip: Optional[str] = None
+    destination_port: Optional[int] = None
+    registry_key: Optional[str] = None
+
     model_config = ConfigDict(from_attributes=True)
 
+    @field_validator("details", mode="before")
+    @classmethod
+    def expand_details(cls, value: Any) -> Any:
+        # Stored details may be a compressed blob; decode it only when serialized.
+        return details_codec.expand(value)
+
+
+class EventStatsBucket(BaseModel):
+    """One histogram bucket of event counts."""
+    bucket: datetime.datetime = Field(description="Start of the time bucket.")
+    count: int
+
+
+class EventStatsBreakdownItem(BaseModel):
+    """One entry of a top-N breakdown (a severity, event type, node ID or group)."""
+    key: Union[int, str]
+    count: int
+
+
+class EventStatsResponse(BaseModel):
+    """Schema for time-bucketed event statistics served from the rollup tables."""
+    interval: str = Field(description="Bucket granularity: 'minute', 'hour' or 'day'.")
+    start_time: datetime.datetime
+    end_time: datetime.datetime
+    total: int
+    histogram: List[EventStatsBucket]
+    by_severity: List[EventStatsBreakdownItem]
+    by_event_type: List[EventStatsBreakdownItem]
+    by_node: List[EventStatsBreakdownItem]
+    by_group: List[EventStatsBreakdownItem]
+
 
 # ==============================================================================
 # Policy Schemas
@@ -102,6 +162,13 @@ class PolicyResponse(PolicyBase):
     assigned_nodes: List[NodeResponse] = []
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class AgentPolicy(PolicyBase):
+    """Schema for a policy pushed to an agent over the agent channel."""
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
     
 
 # ==============================================================================
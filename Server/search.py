@@ -0,0 +1,265 @@
+"""
+Search - Full-text index over event details
+
+The values inside `Event.details` (and optionally its keys) are flattened into
+one document per event and indexed for word search, so a query such as
+"any event mentioning mimikatz" is an index lookup rather than a scan of every
+JSON blob.
+
+- SQLite: an FTS5 virtual table `event_search` keyed by event ID (rowid),
+  filled at ingest time in the same transaction as the events. It is
+  contentless on SQLite >= 3.43, otherwise it also stores the flattened text.
+  With event partitioning, every partition has its own FTS5 table
+  (`event_search_<partition>`), which retention drops along with the
+  partition instead of deleting its entries row by row.
+- PostgreSQL: a stored generated `search_vector` tsvector column on `events`
+  (computed by `jsonb_to_tsvector` on every insert) with a GIN index. It lives
+  in each event partition, so it is dropped together with the partition.
+
+Search terms are matched as whole words and all terms must be present.
+The time spent building and writing the SQLite index is tracked per event
+(see `SearchIndex.stats` and `benchmark_search.py`).
+"""
+
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Select,
+    Text,
+    Table,
+    column,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal_column,
+    select,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from db import IS_POSTGRES, IS_SQLITE
+
+# --- Configuration ---
+EVENT_SEARCH = os.getenv("EVENT_SEARCH", "true").lower() in ("1", "true", "yes", "on")
+# Index key names as well as values (PostgreSQL: applies when the column is created)
+EVENT_SEARCH_INCLUDE_KEYS = os.getenv("EVENT_SEARCH_INCLUDE_KEYS", "false").lower() in ("1", "true", "yes", "on")
+# Flattened text indexed per event on SQLite; longer documents are truncated
+EVENT_SEARCH_MAX_CHARS = int(os.getenv("EVENT_SEARCH_MAX_CHARS", "4096"))
+
+SEARCH_TABLE = "event_search"
+SEARCH_COLUMN = "search_vector"
+SEARCH_TS_CONFIG = "simple"
+
+# Not part of Base.metadata: the FTS5 tables are created by prepare_schema()
+# and create_table()
+_search_metadata = MetaData()
+
+
+def _fts_table(name: str) -> Table:
+    table = _search_metadata.tables.get(name)
+    if table is None:
+        table = Table(name, _search_metadata, Column("rowid", Integer, primary_key=True), Column("body", Text))
+    return table
+
+
+_search_table = _fts_table(SEARCH_TABLE)
+
+
+def partition_search_table(partition: str) -> str:
+    """Name of the FTS5 table indexing the events of a SQLite partition table."""
+    return f"{SEARCH_TABLE}_{partition}"
+
+
+def _flatten(value: Any, parts: List[str], include_keys: bool) -> None:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if include_keys:
+                parts.append(str(key))
+            _flatten(item, parts, include_keys)
+    elif isinstance(value, list):
+        for item in value:
+            _flatten(item, parts, include_keys)
+    elif isinstance(value, bool):
+        parts.append("true" if value else "false")
+    elif value is not None:
+        parts.append(str(value))
+
+
+def flatten_details(details: Any, include_keys: bool = False, max_chars: int = 0) -> str:
+    """
+    Flattens a details document into the whitespace-separated text that is indexed.
+
+    Args:
+        details: The event's details (any JSON value)
+        include_keys: Also emit object keys
+        max_chars: Truncate the text to this many characters (0 = no limit)
+    """
+    parts: List[str] = []
+    _flatten(details, parts, include_keys)
+    text = " ".join(parts)
+    return text[:max_chars] if max_chars > 0 else text
+
+
+def _fts5_query(terms: str) -> str:
+    """Quotes each term so user input is never parsed as FTS5 query syntax."""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+
+
+class SearchIndex:
+    """Maintains and queries the full-text index over event details."""
+
+    def __init__(self, enabled: bool = True, include_keys: bool = False, max_chars: int = 4096):
+        """
+        Args:
+            enabled: Index events at ingest and allow searches
+            include_keys: Index details keys as well as values
+            max_chars: Maximum flattened characters indexed per event (SQLite)
+        """
+        self.enabled = enabled and (IS_SQLITE or IS_POSTGRES)
+        self.include_keys = include_keys
+        self.max_chars = max_chars
+
+        # Indexing cost counters (SQLite; on PostgreSQL the work happens inside INSERT)
+        self.indexed_events = 0
+        self.indexed_chars = 0
+        self.index_seconds = 0.0
+
+        # SQLite partitioning (see route_partitions): FTS5 table of an event,
+        # and FTS5 tables covering an event source
+        self._table_of: Optional[Callable[[Any], str]] = None
+        self._tables_of: Optional[Callable[[Any], List[str]]] = None
+        self._fts_options: Optional[str] = None
+
+    def route_partitions(self, table_of: Callable[[Any], str], tables_of: Callable[[Any], List[str]]) -> None:
+        """
+        Indexes events in per-partition FTS5 tables (SQLite event partitioning).
+
+        Args:
+            table_of: Returns the FTS5 table name for a stored event
+            tables_of: Returns the FTS5 table names to search for an event
+                source from `partition_manager.event_source`
+        """
+        self._table_of = table_of
+        self._tables_of = tables_of
+
+    # --------------------------------------------------------------------------
+    # Schema
+    # --------------------------------------------------------------------------
+
+    def prepare_schema(self, sync_conn) -> None:
+        """Creates the search index. Runs after Base.metadata.create_all()."""
+        if not self.enabled:
+            return
+        if IS_SQLITE:
+            self.create_table(sync_conn, SEARCH_TABLE)
+        elif IS_POSTGRES:
+            filters = '["string", "numeric", "boolean"' + (', "key"' if self.include_keys else "") + "]"
+            # Adding the column rewrites an existing events table once
+            sync_conn.exec_driver_sql(
+                f"ALTER TABLE events ADD COLUMN IF NOT EXISTS {SEARCH_COLUMN} tsvector "
+                f"GENERATED ALWAYS AS (jsonb_to_tsvector('{SEARCH_TS_CONFIG}', "
+                f"coalesce(details, '{{}}'::jsonb), '{filters}')) STORED"
+            )
+            sync_conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_events_{SEARCH_COLUMN} ON events USING gin ({SEARCH_COLUMN})"
+            )
+
+    def create_table(self, sync_conn, name: str) -> None:
+        """Creates a SQLite FTS5 index table (if search is enabled)."""
+        if not self.enabled or not IS_SQLITE:
+            return
+        if self._fts_options is None:
+            version = sync_conn.exec_driver_sql("SELECT sqlite_version()").scalar()
+            contentless = tuple(int(part) for part in version.split(".")[:2]) >= (3, 43)
+            self._fts_options = ", content='', contentless_delete=1" if contentless else ""
+        sync_conn.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(body{self._fts_options})")
+
+    # --------------------------------------------------------------------------
+    # Ingest-time maintenance
+    # --------------------------------------------------------------------------
+
+    async def index_events(self, session: AsyncSession, events: Iterable[models.Event]) -> None:
+        """Adds newly stored events to the index (SQLite; PostgreSQL computes it itself)."""
+        if not self.enabled or not IS_SQLITE:
+            return
+        started = time.perf_counter()
+        rows: Dict[str, List[dict]] = {}
+        for event in events:
+            body = flatten_details(event.details, self.include_keys, self.max_chars)
+            if body:
+                table = self._table_of(event) if self._table_of else SEARCH_TABLE
+                rows.setdefault(table, []).append({"rowid": event.id, "body": body})
+        for table, table_rows in rows.items():
+            await session.execute(insert(_fts_table(table)), table_rows)
+
+        indexed = [row for table_rows in rows.values() for row in table_rows]
+        self.indexed_events += len(indexed)
+        self.indexed_chars += sum(len(row["body"]) for row in indexed)
+        self.index_seconds += time.perf_counter() - started
+
+    async def delete_events(self, session: AsyncSession, event_ids: Select, table: str = SEARCH_TABLE) -> None:
+        """Removes the index entries of the events selected by `event_ids` from one FTS5 table."""
+        if not self.enabled or not IS_SQLITE:
+            return
+        search_table = _fts_table(table)
+        await session.execute(delete(search_table).where(search_table.c.rowid.in_(event_ids)))
+
+    def stats(self) -> dict:
+        """
+        Returns the cumulative and per-event cost of SQLite index maintenance
+        in this worker process (PostgreSQL computes its column itself).
+        """
+        events = self.indexed_events or 1
+        return {
+            "indexed_events": self.indexed_events,
+            "avg_chars_per_event": self.indexed_chars / events,
+            "avg_microseconds_per_event": self.index_seconds * 1e6 / events,
+        }
+
+    # --------------------------------------------------------------------------
+    # Queries
+    # --------------------------------------------------------------------------
+
+    def match(self, Event, terms: str):
+        """
+        Returns a WHERE condition selecting events whose details contain every term.
+
+        Args:
+            Event: The event entity being selected from
+            terms: Whitespace-separated search words
+        """
+        if not self.enabled:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Full-text search is disabled on this server.",
+            )
+        if IS_POSTGRES:
+            query = func.plainto_tsquery(literal_column(f"'{SEARCH_TS_CONFIG}'::regconfig"), terms)
+            # Not mapped (added by prepare_schema), so bind it to the table or alias Event selects from
+            search_vector = column(SEARCH_COLUMN, TSVECTOR, _selectable=inspect(Event).selectable)
+            return search_vector.op("@@")(query)
+        query = _fts5_query(terms)
+        tables = self._tables_of(Event) if self._tables_of else [SEARCH_TABLE]
+        selects = [
+            select(_fts_table(table).c.rowid).where(literal_column(table).op("MATCH")(query))
+            for table in tables
+        ]
+        matching_ids = selects[0] if len(selects) == 1 else union_all(*selects)
+        return Event.id.in_(matching_ids)
+
+
+# Global instance
+search_index = SearchIndex(
+    enabled=EVENT_SEARCH,
+    include_keys=EVENT_SEARCH_INCLUDE_KEYS,
+    max_chars=EVENT_SEARCH_MAX_CHARS,
+)
@@ -2,57 +2,617 @@
 
 import json
 import asyncio
-from typing import Set
-from fastapi import WebSocket, WebSocketDisconnect
+import os
+import uuid
+from collections import Counter, deque
+from typing import Any, Deque, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+from fastapi import WebSocket, WebSocketDisconnect, status
 import logging
 
+from broadcast_bus import BroadcastBus, broadcast_bus
+
 logger = logging.getLogger(__name__)
 
+# --- Configuration ---
+# Messages buffered per client before the slow-consumer policy applies
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# What happens when a client's buffer is full:
+# - "drop_oldest": discard the oldest buffered message
+# - "coalesce":    replace a buffered update of the same node, else drop the oldest
+# - "disconnect":  close the connection (the client reconnects and reloads)
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest").lower()
+# Micro-batching: broadcasts are collected for up to this long (the latency
+# budget) and sent to each client as one JSON array frame, so a client gets at
+# most 1000 / WS_BATCH_WINDOW_MS frames per second. 0 sends one frame per message.
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "0"))
+# A batch is sent early once this many messages are waiting
+WS_BATCH_MAX_MESSAGES = int(os.getenv("WS_BATCH_MAX_MESSAGES", "500"))
+# Recent broadcasts kept for clients resuming after a reconnect
+WS_REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "1000"))
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# Fields a client can filter on; "types" is the message type (e.g. "event_created")
+FILTER_FIELDS = ("types", "node_id", "group", "severity", "event_type")
+
+# Subscription modes: "summary" sends events without their details (fetch them
+# with GET /logs/{id} when needed)
+SUBSCRIPTION_MODES = ("full", "summary")
+SUMMARY_FIELDS = ("id", "node_id", "event_type", "severity", "timestamp")
+
+
+def summarize(message: dict) -> dict:
+    """Returns the summary form of a message (the message itself if it has none)."""
+    data = message.get("data")
+    if message.get("type") == "event_created" and isinstance(data, dict):
+        return {**message, "data": {field: data[field] for field in SUMMARY_FIELDS if field in data}}
+    return message
+
+
+def coalesce_key(message: dict) -> Optional[tuple]:
+    """Messages carrying the latest state of a node supersede older ones for the same node."""
+    if message.get("type") in ("node_created", "node_updated"):
+        data = message.get("data") or {}
+        return ("node", data.get("id"))
+    return None
+
+
+def routing_attributes(message_type: Optional[str], data: Any, extra: Optional[dict] = None) -> Dict[str, Any]:
+    """
+    Returns the filterable attributes of a message (or of one item of a list message).
+
+    Only the fields a message actually carries are returned; a filter on a
+    field the message does not carry does not exclude it.
+    """
+    attributes: Dict[str, Any] = {"types": message_type}
+    if isinstance(data, dict):
+        if message_type in ("node_created", "node_updated", "nodes_updated", "node_deleted"):
+            attributes["node_id"] = data.get("id")
+            if "group" in data:
+                attributes["group"] = data["group"]
+        else:
+            for field in ("node_id", "group", "severity", "event_type"):
+                if field in data:
+                    attributes[field] = data[field]
+    if extra:
+        attributes.update(extra)
+    return attributes
+
+
+def parse_filters(raw: Any) -> Dict[str, FrozenSet]:
+    """
+    Validates the filters of a subscribe message.
+
+    Each field takes a single value or a list of values; an empty object
+    subscribes to everything.
+
+    Raises:
+        ValueError: If the filters are malformed
+    """
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object")
+    filters = {}
+    for field, values in raw.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"unknown filter field '{field}'")
+        if values is None:
+            continue
+        values = values if isinstance(values, list) else [values]
+        if any(isinstance(value, bool) or not isinstance(value, (str, int)) for value in values):
+            raise ValueError(f"{field} filter values must be strings or integers")
+        if field == "node_id":
+            try:
+                values = [int(value) for value in values]
+            except (TypeError, ValueError):
+                raise ValueError("node_id filter values must be integers")
+        filters[field] = frozenset(values)
+    return filters
+
+
+class SubscriptionIndex:
+    """
+    Finds the clients whose filters match a message without visiting every client.
+
+    Clients with filters are indexed by (field, value). A client matches when
+    each of its filtered fields that the message carries has a matching
+    value, which is counted through the index; clients whose filtered fields
+    the message does not carry at all match directly.
+    """
 
-class ConnectionManager:
-    """Manages WebSocket connections for real-time updates."""
-    
     def __init__(self):
-        self.active_connections: Set[WebSocket] = set()
-    
+        self._unfiltered: Set["ClientConnection"] = set()
+        self._index: Dict[str, Dict[Any, Set["ClientConnection"]]] = {field: {} for field in FILTER_FIELDS}
+        # Clients grouped by the set of fields they filter on
+        self._by_fields: Dict[FrozenSet[str], Set["ClientConnection"]] = {}
+
+    def add(self, client: "ClientConnection"):
+        if not client.filters:
+            self._unfiltered.add(client)
+            return
+        fields = frozenset(client.filters)
+        self._by_fields.setdefault(fields, set()).add(client)
+        for field, values in client.filters.items():
+            for value in values:
+                self._index[field].setdefault(value, set()).add(client)
+
+    def remove(self, client: "ClientConnection"):
+        if not client.filters:
+            self._unfiltered.discard(client)
+            return
+        fields = frozenset(client.filters)
+        group = self._by_fields.get(fields)
+        if group is not None:
+            group.discard(client)
+            if not group:
+                del self._by_fields[fields]
+        for field, values in client.filters.items():
+            for value in values:
+                clients = self._index[field].get(value)
+                if clients is not None:
+                    clients.discard(client)
+                    if not clients:
+                        del self._index[field][value]
+
+    def match(self, attributes: Dict[str, Any]) -> Set["ClientConnection"]:
+        """Returns every client that should receive a message with `attributes`."""
+        matched = set(self._unfiltered)
+        present = attributes.keys() & self._index.keys()
+        counts: Counter = Counter()
+        for field in present:
+            for client in self._index[field].get(attributes[field], ()):
+                counts[client] += 1
+        for fields, clients in self._by_fields.items():
+            carried = len(fields & present)
+            if carried == 0:
+                matched |= clients
+            else:
+                matched.update(client for client in clients if counts[client] == carried)
+        return matched
+
+
+class ClientConnection:
+    """A dashboard connection with its bounded outbound queue and subscription filters."""
+
+    def __init__(self, websocket: WebSocket, max_queue: int, policy: str):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue: Deque[Tuple[Optional[tuple], str]] = deque()
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.evicted = False
+        # Field -> accepted values; empty means every message
+        self.filters: Dict[str, FrozenSet] = {}
+        self.mode = "full"
+        # Sequence number of the last broadcast before the client connected
+        self.start_seq = 0
+
+    def accepts(self, attributes: Dict[str, Any]) -> bool:
+        """Whether the client's filters let through a message with `attributes`."""
+        return all(
+            attributes[field] in values
+            for field, values in self.filters.items()
+            if field in attributes
+        )
+
+    def enqueue(self, text: str, key: Optional[tuple] = None) -> bool:
+        """
+        Buffers a serialized message for the writer task. Never blocks.
+
+        Returns:
+            False if the client is too slow and must be disconnected
+        """
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                return False
+            if not (self.policy == "coalesce" and key is not None and self._replace(key, text)):
+                self.queue.popleft()
+                self.queue.append((key, text))
+                self.dropped += 1
+        else:
+            self.queue.append((key, text))
+        self.ready.set()
+        return True
+
+    def _replace(self, key: tuple, text: str) -> bool:
+        for index, (queued_key, _) in enumerate(self.queue):
+            if queued_key == key:
+                del self.queue[index]
+                self.queue.append((key, text))
+                return True
+        return False
+
+
+class ConnectionManager:
+    """
+    Manages WebSocket connections for real-time updates.
+
+    Every connection has a bounded queue drained by its own writer task, so a
+    slow client never delays the others or the request that broadcast the
+    message. broadcast() only appends to an outbox; a dispatcher task looks up
+    the subscribed clients, serializes each message once (only if anyone
+    wants it) and hands it to their queues. When the dispatcher is not running
+    (scripts, tests) messages are fanned out inline, still without waiting on
+    any client.
+
+    With a batch window, the dispatcher instead collects broadcasts for up to
+    `batch_window_ms`, keeps only the latest state message per node, and
+    queues one array frame per client holding the messages it subscribed to.
+
+    Every broadcast is also published on the broadcast bus, and messages
+    published by other worker processes are delivered to this process's
+    clients like local ones.
+
+    Every broadcast carries a "seq" number, and the last `replay_size`
+    broadcasts are kept in memory. On connect a client receives
+        {"type": "hello", "stream": <id>, "seq": <latest>}
+    and after a reconnect it can pass back the stream id and the last seq it
+    processed (`/ws?stream=<id>&resume_from=<seq>`, or "stream" and
+    "resume_from" in its subscribe message) to get
+        {"type": "resumed", "stream": <id>, "seq": <latest>, "data": [<missed messages>]}
+    holding the broadcasts it missed while disconnected. If they are no longer
+    all buffered, or the stream id belongs to another process, it gets
+        {"type": "resync", "stream": <id>, "seq": <latest>}
+    and reloads in full instead.
+
+    Clients subscribe by sending
+        {"type": "subscribe", "filters": {"node_id": [3], "severity": ["high", "critical"]}}
+    with any of FILTER_FIELDS, and optionally "mode": "summary" to receive
+    events without their details; {"type": "unsubscribe"} restores the full feed.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 256,
+        policy: str = "drop_oldest",
+        batch_window_ms: float = 0,
+        batch_max_messages: int = 500,
+        bus: Optional[BroadcastBus] = None,
+        replay_size: int = 1000,
+    ):
+        """
+        Args:
+            max_queue: Frames buffered per client
+            policy: Slow-consumer policy, one of SLOW_CONSUMER_POLICIES
+            batch_window_ms: How long broadcasts are collected into one frame (0 disables batching)
+            batch_max_messages: Messages that end a batch before the window has passed
+            bus: Bus shared with the other worker processes (default: none)
+            replay_size: Broadcasts kept for resuming clients (0 disables resuming)
+        """
+        if policy not in SLOW_CONSUMER_POLICIES:
+            logger.error(f"Unknown WS_SLOW_CONSUMER_POLICY '{policy}', using 'drop_oldest'")
+            policy = "drop_oldest"
+        self.max_queue = max_queue
+        self.policy = policy
+        self.batch_window = batch_window_ms / 1000.0
+        self.batch_max_messages = batch_max_messages
+        self.bus = bus or BroadcastBus()
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.running = False
+        self.task = None
+        self.subscriptions = SubscriptionIndex()
+        self._outbox: Deque[Tuple[dict, Optional[dict]]] = deque()
+        self._pending = asyncio.Event()
+        # Identifies this process's numbering; sequence numbers restart with it
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self._replay: Deque[Tuple[int, dict, Optional[dict]]] = deque(maxlen=replay_size)
+
     async def connect(self, websocket: WebSocket):
         """Accept and register a new WebSocket connection."""
         await websocket.accept()
-        self.active_connections.add(websocket)
+        client = ClientConnection(websocket, self.max_queue, self.policy)
+        client.task = asyncio.create_task(self._writer(client))
+        self.active_connections[websocket] = client
+        self.subscriptions.add(client)
+        client.start_seq = self.seq
+        client.enqueue(json.dumps({"type": "hello", "stream": self.stream_id, "seq": self.seq}))
         logger.info(f"New WebSocket connection. Total connections: {len(self.active_connections)}")
-    
+
     def disconnect(self, websocket: WebSocket):
         """Remove a WebSocket connection."""
-        self.active_connections.discard(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        self.subscriptions.remove(client)
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+        if client.dropped:
+            logger.info(f"WebSocket client dropped {client.dropped} messages while connected")
         logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
-    
-    async def broadcast(self, message: dict):
-        """Send a message to all connected clients."""
-        if not self.active_connections:
-            return
-        
-        message_json = json.dumps(message)
-        disconnected = set()
-        
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message_json)
-            except Exception as e:
-                logger.error(f"Error sending message to client: {e}")
-                disconnected.add(connection)
-        
-        # Clean up any disconnected clients
-        for conn in disconnected:
-            self.disconnect(conn)
-    
+
+    async def broadcast(self, message: dict, attributes: Optional[dict] = None):
+        """
+        Send a message to all subscribed clients (returns without waiting on any of them).
+
+        Args:
+            message: The message; its "type" and "data" fields are used for routing
+            attributes: Routing attributes the data does not carry (e.g. an event's node group)
+        """
+        self.bus.publish(message, attributes)
+        self._enqueue(message, attributes)
+
+    def _enqueue(self, message: dict, attributes: Optional[dict] = None):
+        """Hands a message (local or from another process) to the dispatcher."""
+        if not self.running:
+            self._fan_out(message, attributes)
+            return
+        self._outbox.append((message, attributes))
+        if len(self._outbox) == 1 or len(self._outbox) >= self.batch_max_messages:
+            self._pending.set()
+
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Send a message to a specific client."""
+        client = self.active_connections.get(websocket)
+        if client is not None and not client.enqueue(json.dumps(message)):
+            self._evict(client)
+
+    def subscribe(self, websocket: WebSocket, filters: Dict[str, FrozenSet], mode: str = "full"):
+        """Replace a client's subscription filters and mode."""
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return
+        self.subscriptions.remove(client)
+        client.filters = filters
+        client.mode = mode
+        self.subscriptions.add(client)
+
+    async def handle_client_message(self, websocket: WebSocket, text: str):
+        """Handles a message from a dashboard client (subscriptions; anything else is a keepalive)."""
         try:
-            await websocket.send_text(json.dumps(message))
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        message_type = message.get("type") if isinstance(message, dict) else None
+
+        if message_type in ("subscribe", "unsubscribe"):
+            mode = (message.get("mode") or "full") if message_type == "subscribe" else "full"
+            try:
+                filters = parse_filters(message.get("filters")) if message_type == "subscribe" else {}
+                if mode not in SUBSCRIPTION_MODES:
+                    raise ValueError(f"mode must be one of {', '.join(SUBSCRIPTION_MODES)}")
+            except ValueError as e:
+                await self.send_personal_message({"type": "error", "detail": str(e)}, websocket)
+                return
+            self.subscribe(websocket, filters, mode)
+            await self.send_personal_message({
+                "type": "subscribed",
+                "filters": {field: sorted(values, key=str) for field, values in filters.items()},
+                "mode": mode,
+            }, websocket)
+            if message.get("resume_from") is not None:
+                try:
+                    resume_from = int(message["resume_from"])
+                except (TypeError, ValueError):
+                    await self.send_personal_message({"type": "error", "detail": "resume_from must be an integer"}, websocket)
+                    return
+                self.resume(websocket, resume_from, message.get("stream"))
+            return
+
+        await self.send_personal_message({"type": "pong", "message": "Connection alive"}, websocket)
+
+    def resume(self, websocket: WebSocket, resume_from: int, stream: Optional[str] = None):
+        """
+        Sends a reconnected client the broadcasts it missed, or tells it to resync.
+
+        Args:
+            websocket: The client's connection
+            resume_from: Last sequence number the client processed
+            stream: Stream id from the client's previous hello message
+        """
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return
+        oldest = self._replay[0][0] if self._replay else self.seq + 1
+        if stream != self.stream_id or resume_from > self.seq or resume_from + 1 < oldest:
+            reply = {"type": "resync", "stream": self.stream_id, "seq": self.seq}
+        else:
+            # Broadcasts made since the client connected were already sent to it
+            missed = []
+            for seq, message, attributes in self._replay:
+                if seq <= resume_from or seq > client.start_seq:
+                    continue
+                selected = self._select(client, message, attributes)
+                if selected is not None:
+                    missed.append(selected)
+            reply = {"type": "resumed", "stream": self.stream_id, "seq": self.seq, "data": missed}
+        if not client.enqueue(json.dumps(reply)):
+            self._evict(client)
+
+    @staticmethod
+    def _select(client: ClientConnection, message: dict, attributes: Optional[dict]) -> Optional[dict]:
+        """Returns the part of a message a client subscribed to, if any."""
+        message_type = message.get("type")
+        data = message.get("data")
+        if not isinstance(data, list):
+            if not client.accepts(routing_attributes(message_type, data, attributes)):
+                return None
+            return summarize(message) if client.mode == "summary" else message
+        items = [item for item in data if client.accepts(routing_attributes(message_type, item, attributes))]
+        return {**message, "data": items} if items else None
+
+    # --- Fan-out ---
+
+    def _record(self, message: dict, attributes: Optional[dict] = None) -> dict:
+        """Numbers a message and keeps it for resuming clients."""
+        self.seq += 1
+        message = {**message, "seq": self.seq}
+        self._replay.append((self.seq, message, attributes))
+        return message
+
+    def _route(
+        self, message: dict, attributes: Optional[dict] = None
+    ) -> Iterator[Tuple[List[ClientConnection], str, Optional[tuple]]]:
+        """
+        Yields (clients, serialized message, coalesce key) for the subscribers of a message.
+
+        List messages are routed per item: every client gets the items it
+        subscribed to, and clients that picked the same items share one
+        serialized message. Messages with a summary form are serialized at
+        most twice, once per subscription mode.
+        """
+        message_type = message.get("type")
+        data = message.get("data")
+        if not isinstance(data, list):
+            clients = self.subscriptions.match(routing_attributes(message_type, data, attributes))
+            if not clients:
+                return
+            key = coalesce_key(message)
+            summary = summarize(message)
+            if summary is message:
+                yield list(clients), json.dumps(message), key
+                return
+            full = [client for client in clients if client.mode == "full"]
+            brief = [client for client in clients if client.mode == "summary"]
+            if full:
+                yield full, json.dumps(message), key
+            if brief:
+                yield brief, json.dumps(summary), key
+            return
+
+        items_per_client: Dict[ClientConnection, List[int]] = {}
+        for position, item in enumerate(data):
+            for client in self.subscriptions.match(routing_attributes(message_type, item, attributes)):
+                items_per_client.setdefault(client, []).append(position)
+        clients_per_selection: Dict[Tuple[int, ...], List[ClientConnection]] = {}
+        for client, positions in items_per_client.items():
+            clients_per_selection.setdefault(tuple(positions), []).append(client)
+        for positions, clients in clients_per_selection.items():
+            yield clients, json.dumps({**message, "data": [data[position] for position in positions]}), None
+
+    def _fan_out(self, message: dict, attributes: Optional[dict] = None):
+        """Serializes a message once and queues it for every subscribed client."""
+        message = self._record(message, attributes)
+        for clients, text, key in self._route(message, attributes):
+            self._deliver(clients, text, key)
+
+    def _fan_out_batch(self, batch: List[Tuple[dict, Optional[dict]]]):
+        """Queues one array frame per client with the batch's messages it subscribed to."""
+        # Only the latest state of each node is sent
+        latest: Dict[tuple, int] = {}
+        for position, (message, _) in enumerate(batch):
+            key = coalesce_key(message)
+            if key is not None:
+                latest[key] = position
+
+        frames: Dict[ClientConnection, List[str]] = {}
+        for position, (message, attributes) in enumerate(batch):
+            key = coalesce_key(message)
+            if key is not None and latest[key] != position:
+                continue
+            message = self._record(message, attributes)
+            for clients, text, _ in self._route(message, attributes):
+                for client in clients:
+                    frames.setdefault(client, []).append(text)
+        for client, texts in frames.items():
+            self._deliver([client], "[" + ",".join(texts) + "]", None)
+
+    def _deliver(self, clients: Iterable[ClientConnection], text: str, key: Optional[tuple]):
+        for client in clients:
+            if not client.enqueue(text, key):
+                self._evict(client)
+
+    def _evict(self, client: ClientConnection):
+        """Disconnects a client that cannot keep up (its writer closes the socket)."""
+        if not client.evicted:
+            client.evicted = True
+            client.ready.set()
+            logger.warning("WebSocket client too slow, disconnecting")
+
+    async def _collect_batch(self) -> List[Tuple[dict, Optional[dict]]]:
+        """Waits for a broadcast, then for the batch window or a full batch."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(self._outbox) < self.batch_max_messages:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._pending.clear()
+            try:
+                await asyncio.wait_for(self._pending.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        count = min(len(self._outbox), self.batch_max_messages)
+        return [self._outbox.popleft() for _ in range(count)]
+
+    async def _dispatch_loop(self):
+        while self.running:
+            try:
+                if not self._outbox:
+                    self._pending.clear()
+                    await self._pending.wait()
+                    continue
+                if self.batch_window > 0:
+                    self._fan_out_batch(await self._collect_batch())
+                else:
+                    self._fan_out(*self._outbox.popleft())
+                # Let the writers drain between messages of a burst
+                await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error dispatching WebSocket message: {e}")
+
+    async def _writer(self, client: ClientConnection):
+        """Drains one client's queue onto its socket."""
+        websocket = client.websocket
+        try:
+            while True:
+                if client.evicted:
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                    break
+                if not client.queue:
+                    client.ready.clear()
+                    await client.ready.wait()
+                    continue
+                _, text = client.queue.popleft()
+                await websocket.send_text(text)
+        except asyncio.CancelledError:
+            return
         except Exception as e:
-            logger.error(f"Error sending personal message: {e}")
+            logger.error(f"Error sending message to client: {e}")
+        self.disconnect(websocket)
+
+    # --- Lifecycle ---
+
+    async def start(self):
+        """Start the dispatcher task and join the broadcast bus."""
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._dispatch_loop())
+        await self.bus.start(self._enqueue)
+        logger.info(
+            f"WebSocket dispatcher started: queue={self.max_queue}, slow consumers: {self.policy}, "
+            f"batch window={self.batch_window * 1000:.0f}ms, bus: {self.bus.name}"
+        )
+
+    async def stop(self):
+        """Leave the broadcast bus and stop the dispatcher and every writer task."""
+        if not self.running:
+            return
+        await self.bus.stop()
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        for websocket in list(self.active_connections):
             self.disconnect(websocket)
+        logger.info("WebSocket dispatcher stopped")
 
 
 # Global connection manager instance
-manager = ConnectionManager()
+manager = ConnectionManager(
+    max_queue=WS_SEND_QUEUE_SIZE,
+    policy=WS_SLOW_CONSUMER_POLICY,
+    batch_window_ms=WS_BATCH_WINDOW_MS,
+    batch_max_messages=WS_BATCH_MAX_MESSAGES,
+    bus=broadcast_bus,
+    replay_size=WS_REPLAY_BUFFER_SIZE,
+)